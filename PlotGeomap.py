@@ -32,19 +32,30 @@ p.add_argument(
     help="altitude of observer (meters)",
     default=0.0,
 )
+p.add_argument(
+    "--engine",
+    choices=["shell", "secant"],
+    default="shell",
+    help="projection: exact WGS84 shell intersection or flat-earth secant",
+)
+p.add_argument(
+    "--raster",
+    action="store_true",
+    help="regrid to a regular lat/lon raster for fast plotting",
+)
 P = p.parse_args()
 
 in_file = Path(P.in_file).expanduser()
 
 img = read_data(in_file)
 
-img = project.image_altitude(img, P.projection_altitude_km, P.observer_altitude_m)
+img = project.image_altitude(img, P.projection_altitude_km, P.observer_altitude_m, engine=P.engine)
 
 out_file = in_file.parent / (in_file.stem + "_proj.nc")
 print("Save projected data to", out_file)
 write_netcdf(img, out_file)
 
-fig = plot_project.geomap(img, P.minimum_elevation)
+fig = plot_project.geomap(img, P.minimum_elevation, raster=P.raster)
 
 figure_fn = in_file.parent / (in_file.stem + "_proj.png")
 print("Save projected image to", figure_fn)
@@ -1,10 +1,12 @@
 from pathlib import Path
 from datetime import datetime
 from datetime import timezone as tz
+from concurrent.futures import ThreadPoolExecutor
 import functools
 import shutil
 import shlex
 import subprocess
+from time import monotonic
 from packaging.version import Version
 
 import numpy as np
@@ -18,32 +20,81 @@ from astropy import units as u
 from astropy.io import fits
 import astropy.wcs as awcs
 
-__all__ = ["fits2azel", "fits2radec", "radec2azel", "doSolve"]
+__all__ = ["fits2azel", "fits2azel_series", "fits2radec", "radec2azel", "doSolve"]
 
 __version__ = "1.4.1"
 
 
 def fits2radec(
-    fitsfn: Path, solve: bool = False, args: str = "", index_dir: str | None = None
+    fitsfn: Path,
+    solve: bool = False,
+    args: str = "",
+    index_dir: str | None = None,
+    cache_dir: Path | None = None,
+    dtype=np.float64,
+    chunks: int | tuple[int, int] | None = None,
+    workers: int = 1,
 ) -> xarray.Dataset:
     """
     get RA, Decl from FITS file
+
+    dtype: output data type, e.g. numpy.float32 halves memory with ~0.1 arcsec precision.
+    WCS computations are in float64 regardless.
+
+    chunks: if given, ra and dec are lazy Dask arrays with this (y, x) chunk size,
+    computed tile by tile only when needed, e.g. by write_netcdf() or slicing.
+
+    workers: number of threads evaluating the WCS over row tiles, see pix2world_tiled()
     """
     fitsfn = Path(fitsfn).expanduser()
 
     if solve:
-        doSolve(fitsfn, args, index_dir=index_dir)
+        doSolve(fitsfn, args, index_dir=index_dir, cache_dir=cache_dir)
 
     with fits.open(fitsfn, mode="readonly") as f:
         yPix, xPix = f[0].shape[-2:]
 
-    x, y = np.meshgrid(range(xPix), range(yPix))
-    # pixel indices to find RA/dec of
-    xy = np.column_stack((x.ravel(order="C"), y.ravel(order="C")))
+    w = read_wcs(find_wcs(fitsfn))
+
+    if chunks is None:
+        ra, dec = pix2world_tiled(w, yPix, xPix, workers)
+        ra = ra.astype(dtype, copy=False)
+        dec = dec.astype(dtype, copy=False)
+    else:
+        import dask.array as da
+
+        if isinstance(chunks, int):
+            chunks = (chunks, chunks)
+
+        radec = da.map_blocks(
+            _pix2world_block,
+            w,
+            dtype,
+            chunks=da.core.normalize_chunks((2, *chunks), (2, yPix, xPix)),
+            dtype=dtype,
+            meta=np.empty((0, 0, 0), dtype=dtype),
+        )
+        ra, dec = radec[0], radec[1]
+    # %% collect output
+    radec = xarray.Dataset(
+        {"ra": (("y", "x"), ra), "dec": (("y", "x"), dec)},
+        {"x": range(xPix), "y": range(yPix)},
+        attrs={"filename": str(fitsfn)},
+    )
+
+    radec["ra"].attrs["units"] = "Right Ascension degrees east"
+    radec["dec"].attrs["units"] = "Declination degrees north"
+    radec["x"].attrs["units"] = "pixel index"
+    radec["y"].attrs["units"] = "pixel index"
+
+    return radec
+
+
+def read_wcs(wcsfn: Path) -> awcs.WCS:
+    """
+    read celestial WCS from FITS header
+    """
 
-    if not (wcsfn := fitsfn.with_suffix(".wcs")).is_file():
-        if not (wcsfn := fitsfn.with_name("wcs.fits")).is_file():
-            raise FileNotFoundError(f"could not find WCS file for {fitsfn}")
     with fits.open(wcsfn, mode="readonly") as f:
         # %% use astropy.wcs to register pixels to RA/DEC
         # https://docs.astropy.org/en/stable/api/astropy.wcs.WCS.html#astropy.wcs.WCS
@@ -51,67 +102,274 @@ def fits2radec(
         # WARNING: FITSFixedWarning: The WCS transformation has more axes (2) than the image it is associated with (0) [astropy.wcs.wcs]
         if f[0].header["WCSAXES"] == 2:
             # greyscale image
-            radec = awcs.wcs.WCS(f[0].header).all_pix2world(xy, 0)
+            return awcs.wcs.WCS(f[0].header)
         elif f[0].header["WCSAXES"] == 3:
             # color image
-            radec = awcs.wcs.WCS(f[0].header, naxis=[0, 1]).all_pix2world(xy, 0)
+            return awcs.wcs.WCS(f[0].header, naxis=[0, 1])
         else:
-            raise ValueError(f"{fitsfn} has {f[0].header['NAXIS']} axes -- expected 2 or 3")
+            raise ValueError(f"{wcsfn} has {f[0].header['NAXIS']} axes -- expected 2 or 3")
 
-    ra = radec[:, 0].reshape((yPix, xPix), order="C")
-    dec = radec[:, 1].reshape((yPix, xPix), order="C")
-    # %% collect output
-    radec = xarray.Dataset(
-        {"ra": (("y", "x"), ra), "dec": (("y", "x"), dec)},
-        {"x": range(xPix), "y": range(yPix)},
-        attrs={"filename": str(fitsfn)},
-    )
 
-    radec["ra"].attrs["units"] = "Right Ascension degrees east"
-    radec["dec"].attrs["units"] = "Declination degrees north"
-    radec["x"].attrs["units"] = "pixel index"
-    radec["y"].attrs["units"] = "pixel index"
+def pix2world(w: awcs.WCS, rows: slice, cols: slice) -> tuple:
+    """
+    RA, Dec (degrees) of a rectangular tile of pixels
 
-    return radec
+    Pixel indices are generated per tile rather than for the whole frame at once.
+    """
+
+    x, y = np.meshgrid(np.arange(cols.start, cols.stop), np.arange(rows.start, rows.stop))
+
+    return w.all_pix2world(x, y, 0)
+
+
+def pix2world_tiled(w: awcs.WCS, yPix: int, xPix: int, workers: int = 1) -> tuple:
+    """
+    RA, Dec (degrees) of every pixel of a yPix x xPix frame,
+    with row tiles evaluated on a pool of threads.
+
+    WCSLIB and the SIP distortion evaluation release the GIL, so threads scale with cores.
+    Each pixel is computed independently, so the result is bit-identical to workers=1.
+    """
+
+    if workers <= 1 or yPix < 2:
+        return pix2world(w, slice(0, yPix), slice(0, xPix))
+
+    ra = np.empty((yPix, xPix))
+    dec = np.empty((yPix, xPix))
+
+    # several tiles per worker to even out load
+    edges = np.linspace(0, yPix, min(yPix, 4 * workers) + 1).astype(int)
+
+    def tile(i: int, j: int) -> None:
+        # WCS objects are not guaranteed thread-safe
+        ra[i:j], dec[i:j] = pix2world(w.deepcopy(), slice(i, j), slice(0, xPix))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # list() to raise any exception from the workers
+        list(pool.map(tile, edges[:-1], edges[1:]))
+
+    return ra, dec
+
+
+def _pix2world_block(w: awcs.WCS, dtype, block_info=None):
+    """
+    Dask block of stacked (ra, dec)
+    """
+
+    _, rows, cols = block_info[None]["array-location"]
+
+    return np.stack(pix2world(w, slice(*rows), slice(*cols))).astype(dtype, copy=False)
+
+
+def find_wcs(fitsfn: Path) -> Path:
+    """
+    WCS file from solve-field (.wcs) or nova.astrometry.net (wcs.fits) for an image file
+    """
+
+    if not (wcsfn := fitsfn.with_suffix(".wcs")).is_file():
+        if not (wcsfn := fitsfn.with_name("wcs.fits")).is_file():
+            raise FileNotFoundError(f"could not find WCS file for {fitsfn}")
+
+    return wcsfn
 
 
 def fits2azel(
     fitsfn: Path,
     *,
     latlon: tuple[float, float],
-    time: datetime,
+    time: datetime | str | float,
     solve: bool = False,
     args: str = "",
     index_dir: str | None = None,
+    cache_dir: Path | None = None,
+    method: str = "astropy",
+    max_error_deg: float = 1 / 3600,
+    dtype=np.float64,
+    chunks: int | tuple[int, int] | None = None,
+    workers: int = 1,
 ):
     fitsfn = Path(fitsfn).expanduser()
 
-    radec = fits2radec(fitsfn, solve, args, index_dir=index_dir)
+    radec = fits2radec(
+        fitsfn,
+        solve,
+        args,
+        index_dir=index_dir,
+        cache_dir=cache_dir,
+        dtype=dtype,
+        chunks=chunks,
+        workers=workers,
+    )
 
-    return radec2azel(radec, latlon, time)
+    return radec2azel(radec, latlon, time, method=method, max_error_deg=max_error_deg, dtype=dtype)
 
 
-def radec2azel(scale: xarray.Dataset, latlon: tuple[float, float], time: datetime):
+def fits2azel_series(
+    fitsfn: Path,
+    *,
+    latlon: tuple[float, float],
+    times,
+    solve: bool = False,
+    args: str = "",
+    index_dir: str | None = None,
+    cache_dir: Path | None = None,
+    anchor_interval: float = 3600.0,
+    dtype=np.float64,
+) -> xarray.Dataset:
     """
-    right ascension/declination to azimuth/elevation
+    azimuth/elevation of each pixel for a vector of times, for a fixed camera
+    where one plate solution holds for many frames.
+
+    RA/Dec is computed once from the WCS. Each time step applies the sidereal rotation
+    to one exact AstroPy transform per anchor_interval seconds, see sky.icrs2enu_series().
+    dtype is the output data type; computations are in float64.
+
+    Returns
+    -------
+    scale: xarray.Dataset
+        azimuth, elevation (time, y, x) and ra, dec (y, x)
+    """
+
+    from .sky import apply_icrs2enu, icrs2enu_series, radec2icrs
+
+    fitsfn = Path(fitsfn).expanduser()
+
+    scale = fits2radec(fitsfn, solve, args, index_dir=index_dir, cache_dir=cache_dir, dtype=dtype)
+
+    times = [to_datetime(t) for t in times]
+    M = icrs2enu_series(*latlon, times, anchor_interval=anchor_interval)
+
+    xyz = radec2icrs(scale["ra"].values.astype(np.float64), scale["dec"].values.astype(np.float64))
+
+    shape = (len(times), *scale["ra"].shape)
+    az = np.empty(shape, dtype=dtype)
+    el = np.empty(shape, dtype=dtype)
+    for i, m in enumerate(M):
+        az[i], el[i] = apply_icrs2enu(m, *xyz)
+
+    # %% collect output
+    scale = scale.assign_coords(time=Time(times).datetime64)
+
+    scale["azimuth"] = (("time", "y", "x"), az)
+    scale["azimuth"].attrs["units"] = "degrees clockwise from north"
+
+    scale["elevation"] = (("time", "y", "x"), el)
+    scale["elevation"].attrs["units"] = "degrees above horizon"
+
+    scale["observer_latitude"] = latlon[0]
+    scale["observer_latitude"].attrs["units"] = "degrees north WGS84"
+
+    scale["observer_longitude"] = latlon[1]
+    scale["observer_longitude"].attrs["units"] = "degrees east WGS84"
+
+    return scale
+
+
+def to_datetime(time) -> datetime:
+    """
+    time as datetime, from datetime, ISO 8601 str, or UT1_Unix float
     """
 
     match time:
         case datetime():
             pass
         case float() | int():  # assume UT1_Unix
-            time = datetime.fromtimestamp(time, tz=tz.UTC)
+            time = datetime.fromtimestamp(time, tz=tz.utc)
         case str():
             time = datetime.fromisoformat(time)
         case _:
             raise TypeError(f"expected datetime, float, int, or str -- got {type(time)}")
 
+    return time
+
+
+def radec2azel(
+    scale: xarray.Dataset,
+    latlon: tuple[float, float],
+    time: datetime | str | float,
+    *,
+    method: str = "astropy",
+    max_error_deg: float = 1 / 3600,
+    dtype=np.float64,
+):
+    """
+    right ascension/declination to azimuth/elevation
+
+    dtype: output data type. Computations are in float64 regardless.
+
+    method:
+        "astropy": exact AstroPy transform of every pixel
+        "interp": exact transform on a coarse control grid, spline interpolation between,
+                  refined until error at check pixels is below max_error_deg
+        "rotation": one affine rotation + aberration matrix per frame from AstroPy,
+                    applied to all pixels with NumPy. See sky.accuracy_report()
+
+    If ra and dec are lazy Dask arrays, e.g. from fits2radec(chunks=),
+    azimuth and elevation are too, with the same chunks.
+    The "rotation" matrix and "interp" splines are fit once for the whole frame
+    and evaluated chunk by chunk.
+    """
+
+    time = to_datetime(time)
+
+    if method not in {"astropy", "interp", "rotation"}:
+        raise ValueError(f"unknown method {method}")
+
     print("image time:", time)
     # %% knowing camera location, time, and sky coordinates observed, convert to az/el for each pixel
-    # .values is to avoid silently freezing AstroPy
+    if scale["ra"].chunks is not None:
+        # lazy Dask arrays from fits2radec(chunks=): az/el are computed tile by tile
+        import dask.array as da
+
+        ra = scale["ra"].data
+        dec = scale["dec"].data
+
+        # per frame, not per chunk
+        fit = None
+        match method:
+            case "rotation":
+                from .sky import icrs2enu_matrix
+
+                fit = icrs2enu_matrix(*latlon, time)
+            case "interp":
+                from .sky import enu_splines
+
+                def sample(y, x):
+                    return da.compute(ra.vindex[y, x], dec.vindex[y, x])
+
+                fit = enu_splines(sample, ra.shape, *latlon, time, max_error_deg=max_error_deg)
+                if fit is None:
+                    logging.warning(
+                        "radec2azel: could not meet max_error_deg, using exact transform"
+                    )
+                    method = "astropy"
+
+        azel = da.map_blocks(
+            _radec2azel_block,
+            ra,
+            dec,
+            latlon,
+            time,
+            method,
+            max_error_deg,
+            dtype,
+            fit,
+            new_axis=0,
+            chunks=((2,), *scale["ra"].chunks),
+            dtype=dtype,
+            meta=np.empty((0, 0, 0), dtype=dtype),
+        )
+        az, el = azel[0], azel[1]
+    else:
+        # .values is to avoid silently freezing AstroPy
+        az, el = _radec2azel(
+            scale["ra"].values, scale["dec"].values, latlon, time, method, max_error_deg
+        )
+        az = az.astype(dtype, copy=False)
+        el = el.astype(dtype, copy=False)
 
-    az, el = pymap3d_radec2azel(scale["ra"].values, scale["dec"].values, *latlon, time)
-    if (el < 0).any():
+    # not checked for lazy arrays, as that would compute the whole frame
+    if isinstance(el, np.ndarray) and (el < 0).any():
         Nbelow = (el < 0).nonzero()
         logging.error(
             f"{Nbelow} points were below the horizon."
@@ -137,6 +395,48 @@ def radec2azel(scale: xarray.Dataset, latlon: tuple[float, float], time: datetim
     return scale
 
 
+def _radec2azel(ra, dec, latlon: tuple[float, float], time: datetime, method: str, max_error_deg):
+    ra = np.asarray(ra, dtype=np.float64)
+    dec = np.asarray(dec, dtype=np.float64)
+
+    match method:
+        case "astropy":
+            return pymap3d_radec2azel(ra, dec, *latlon, time)
+        case "interp":
+            from .sky import interp_radec2azel
+
+            return interp_radec2azel(ra, dec, *latlon, time, max_error_deg=max_error_deg)
+        case "rotation":
+            from .sky import rotation_radec2azel
+
+            return rotation_radec2azel(ra, dec, *latlon, time)
+        case _:
+            raise ValueError(f"unknown method {method}")
+
+
+def _radec2azel_block(ra, dec, latlon, time, method, max_error_deg, dtype, fit, block_info=None):
+    """
+    Dask block of stacked (az, el)
+
+    fit: whole-frame icrs2enu_matrix() for "rotation", enu_splines() for "interp"
+    """
+
+    match method:
+        case "rotation":
+            from .sky import rotation_radec2azel
+
+            azel = rotation_radec2azel(ra, dec, *latlon, time, M=fit)
+        case "interp":
+            from .sky import eval_enu_splines
+
+            rows, cols = block_info[0]["array-location"]
+            azel = eval_enu_splines(fit, np.arange(*rows), np.arange(*cols))
+        case _:
+            azel = _radec2azel(ra, dec, latlon, time, method, max_error_deg)
+
+    return np.stack(azel).astype(dtype, copy=False)
+
+
 def pymap3d_radec2azel(
     ra_deg,
     dec_deg,
@@ -190,9 +490,37 @@ def get_solve_exe() -> str | None:
     return shutil.which("solve-field")
 
 
-def doSolve(fitsfn: Path, args: str = "", index_dir: str | None = None) -> None:
+def doSolve(
+    fitsfn: Path,
+    args: str = "",
+    index_dir: str | None = None,
+    cache_dir: Path | None = None,
+    cache_max_bytes: int = 2**30,
+    timeout: float | None = None,
+    prior: Path | str | None = None,
+    time: datetime | str | float | None = None,
+    fov_deg: float | tuple[float, float] | None = None,
+    binning: int = 1,
+) -> None:
     """
     run Astrometry.net solve-field from Python
+
+    timeout: time limit (seconds) for all solve-field runs of this call together:
+    a hinted solve that fails leaves the blind solve only the remaining time
+
+    If cache_dir is given, solve-field products are cached there keyed by the image bytes,
+    args, index files and solve-field version, and restored instead of re-solving.
+
+    If prior is given (a previous .wcs, or a .nc camera calibration from plate_scale),
+    the position and scale hints from solve_hints() are tried first,
+    falling back to a blind solve if the hinted solve fails.
+
+    fov_deg: field of view (degrees), one value or (narrowest, widest).
+    If given, or derived from prior, solve-field loads only the index files of
+    scales that matter for this field of view, see index.index_range().
+
+    binning: fitsfn pixels are binning x binning pixels of the prior, e.g. a star list
+    from condition.star_list(), so the scale hint is multiplied by binning.
     """
 
     fitsfn = Path(fitsfn).expanduser().resolve(strict=True)
@@ -208,6 +536,8 @@ def doSolve(fitsfn: Path, args: str = "", index_dir: str | None = None) -> None:
 
     version = Version(subprocess.check_output([exe, "--version"], text=True).strip())
 
+    files = None
+
     # need version 0.95 or newer to have "--index-dir" option
     if version >= Version("0.95"):
         if index_dir is None:
@@ -219,16 +549,173 @@ def doSolve(fitsfn: Path, args: str = "", index_dir: str | None = None) -> None:
                 f"solve-field version {version} does not support --index-dir option."
                 "Please upgrade to Astrometry.net 0.95 or newer."
             )
-        cmd += ["--index-dir", str(index_dir)]
 
-    if args:
+        if fov_deg is None and prior is not None:
+            from .index import field_of_view
+
+            fov_deg = field_of_view(prior_wcs(prior)[0])
+
+        if fov_deg is not None:
+            from .index import index_files, index_range
+
+            files = index_files(index_dir, index_range(fov_deg))
+            if not files:
+                logging.warning(f"no index files for {fov_deg} degree FOV in {index_dir}")
+
+        if files:
+            from .index import system_config, write_config
+
+            cfgfn = write_config(files, fitsfn.with_suffix(".cfg"), system_config(exe))
+            cmd += ["--config", str(cfgfn)]
+        else:
+            cmd += ["--index-dir", str(index_dir)]
+
+    deadline = None if timeout is None else monotonic() + timeout
+
+    attempts = [args]
+    if prior is not None:
+        attempts.insert(0, f"{args} {solve_hints(prior, time, binning=binning)}")
+
+    for i, a in enumerate(attempts):
+        if cache_dir is not None:
+            from . import cache
+
+            key = cache.solve_key(fitsfn, a, index_dir, str(version), files)
+            if cache.restore(key, fitsfn, cache_dir):
+                print("solve-field result restored from cache", cache_dir)
+                return
+
+        # don't mistake a stale result for success
+        fitsfn.with_suffix(".solved").unlink(missing_ok=True)
+
         # if args is a string, split it. Don't append an empty space or solve-field CLI fail
-        cmd += shlex.split(args)
+        try:
+            if deadline is not None:
+                timeout = deadline - monotonic()
+                if timeout <= 0:
+                    raise TimeoutError("no time left for solve-field")
+            run_solve(cmd + shlex.split(a), timeout)
+        except (RuntimeError, TimeoutError) as e:
+            if i == len(attempts) - 1:
+                raise
+            logging.warning(f"hinted solve failed, trying blind solve: {e}")
+            continue
+
+        if fitsfn.with_suffix(".solved").is_file():
+            break
+
+        if i < len(attempts) - 1:
+            logging.warning("hinted solve did not solve, trying blind solve")
+
+    if cache_dir is not None and fitsfn.with_suffix(".solved").is_file():
+        cache.store(key, fitsfn, cache_dir, cache_max_bytes)
+
+
+def run_solve(cmd: list[str], timeout: float | None = None) -> None:
+    """
+    execute solve-field command, with live progress output
+    """
 
     print("\n", " ".join(cmd), "\n")
-    # %% execute, with live progress output
 
     with subprocess.Popen(cmd) as p:
-        p.wait()
+        try:
+            p.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            p.kill()
+            raise TimeoutError(f"solve-field exceeded {timeout} seconds: {' '.join(cmd)}")
         if p.returncode != 0:
             raise RuntimeError(f"solve-field failed with exit code {p.returncode}")
+
+
+def prior_wcs(prior: Path | str) -> tuple:
+    """
+    WCS file and time (if known) of a previous solution: a WCS FITS file,
+    or a netCDF camera calibration from plate_scale()
+
+    Returns
+    -------
+    wcsfn: pathlib.Path
+    time: astropy.time.Time or None
+    """
+
+    prior = Path(prior).expanduser()
+
+    if prior.suffix != ".nc":
+        return prior, None
+
+    with xarray.open_dataset(prior) as cal:
+        wcsfn = find_wcs(Path(cal.filename))
+        if "time" in cal and cal["time"].ndim == 0:
+            return wcsfn, Time(cal["time"].values)
+
+    return wcsfn, None
+
+
+def solve_hints(
+    prior: Path | str,
+    time: datetime | str | float | None = None,
+    scale_tolerance: float = 0.1,
+    binning: int = 1,
+) -> str:
+    """
+    solve-field arguments for position and scale from a previous solution of the same camera
+
+    Parameters
+    ----------
+    prior: pathlib.Path
+        WCS FITS file (.wcs, .new, wcs.fits) or netCDF camera calibration from plate_scale()
+    time: datetime.datetime, optional
+        time of the new image. If the prior is a netCDF calibration with a time,
+        the field center RA is advanced by the sidereal rotation, as for a fixed camera.
+    scale_tolerance: float
+        fractional range of plate scale to search
+    binning: int
+        pixels of the new image per prior pixel along each axis, e.g. from condition.star_list()
+
+    Returns
+    -------
+    args: str
+        --ra --dec --radius --scale-low --scale-high --scale-units
+    """
+
+    wcsfn, prior_time = prior_wcs(prior)
+
+    with fits.open(wcsfn, mode="readonly") as f:
+        hdr = f[0].header
+        w = awcs.WCS(hdr).celestial
+
+    width = hdr.get("IMAGEW", hdr.get("NAXIS1", 2 * hdr["CRPIX1"]))
+    height = hdr.get("IMAGEH", hdr.get("NAXIS2", 2 * hdr["CRPIX2"]))
+
+    corners = [[0, 0], [width - 1, 0], [0, height - 1], [width - 1, height - 1]]
+    center = w.all_pix2world([[(width - 1) / 2, (height - 1) / 2]], 0)[0]
+    sky = w.all_pix2world(corners, 0)
+
+    c0 = SkyCoord(*center, unit=u.deg)
+    half_diagonal = c0.separation(SkyCoord(sky[:, 0], sky[:, 1], unit=u.deg)).deg.max()
+
+    ra = center[0]
+    if prior_time is not None and time is not None:
+        # fixed camera: sky rotates westward at the sidereal rate
+        days = (Time(to_datetime(time)) - prior_time).jd
+        ra = (ra + 360.98564736629 * days) % 360.0
+
+    scale = awcs.utils.proj_plane_pixel_scales(w).mean() * 3600 * binning
+
+    return shlex.join(
+        [
+            "--ra",
+            f"{ra:.6f}",
+            "--dec",
+            f"{center[1]:.6f}",
+            "--radius",
+            f"{half_diagonal:.3f}",
+            "--scale-low",
+            f"{scale * (1 - scale_tolerance):.4f}",
+            "--scale-high",
+            f"{scale * (1 + scale_tolerance):.4f}",
+            "--scale-units",
+            "arcsecperpix",
+        ]
+    )
@@ -10,14 +10,39 @@ from pathlib import Path
 from argparse import ArgumentParser
 
 from . import default_index_dir
+from .cache import default_cache_dir
 
 from .project import plate_scale
 from . import plot
 
 
-def main(path, latlon, ut1, solve, args, index_dir):
+def main(
+    path,
+    latlon,
+    ut1,
+    solve,
+    args,
+    index_dir,
+    cache_dir=None,
+    prior=None,
+    dtype="float64",
+    workers=1,
+    presolve=None,
+):
     try:
-        scale, img = plate_scale(path, latlon, ut1, solve, args, index_dir=index_dir)
+        scale, img = plate_scale(
+            path,
+            latlon,
+            ut1,
+            solve,
+            args,
+            index_dir=index_dir,
+            cache_dir=cache_dir,
+            prior=prior,
+            dtype=dtype,
+            workers=workers,
+            presolve=presolve,
+        )
     except FileNotFoundError as e:
         if "could not find WCS file" in str(e):
             raise RuntimeError(f"Please specify --solve option to run solve-field on {path}")
@@ -53,10 +78,68 @@ if __name__ == "__main__":
         "-s", "--solve", help="run solve-field step of astrometry.net", action="store_true"
     )
     p.add_argument("-a", "--args", help="arguments to pass through to solve-field", default="")
+    p.add_argument(
+        "-c",
+        "--cache",
+        help="reuse solve-field results for identical image, args and index files",
+        action="store_true",
+    )
+    p.add_argument(
+        "-p",
+        "--prior",
+        help="previous .wcs or .nc solution of this camera: hint solve-field position and scale",
+    )
+    p.add_argument(
+        "--dtype",
+        help="data type of coordinate grids (float32 halves memory and file size)",
+        choices=["float32", "float64"],
+        default="float64",
+    )
+    p.add_argument(
+        "-j",
+        "--workers",
+        help="number of threads computing sky coordinates of pixels",
+        type=int,
+        default=1,
+    )
+    p.add_argument(
+        "-b",
+        "--bin",
+        help="bin image by this factor and solve its star list instead of the image",
+        type=int,
+    )
+    p.add_argument("--crop", help="solve only this region: y0 y1 x0 x1 (pixels)", nargs=4, type=int)
+    p.add_argument(
+        "--horizon-radius",
+        help="ignore pixels further than this from the image center (pixels)",
+        type=float,
+    )
+    p.add_argument("--mask", help="image file, zero over obstructions to ignore")
     P = p.parse_args()
 
+    presolve = None
+    if P.bin or P.crop or P.horizon_radius or P.mask:
+        presolve = {
+            "bin_factor": P.bin or 1,
+            "crop": P.crop,
+            "horizon_radius": P.horizon_radius,
+            "mask": P.mask,
+        }
+
     path = Path(P.infn).expanduser()
 
     print(P.latlon)
 
-    main(path, P.latlon, P.ut1, P.solve, P.args, index_dir=P.index_dir)
+    main(
+        path,
+        P.latlon,
+        P.ut1,
+        P.solve,
+        P.args,
+        index_dir=P.index_dir,
+        cache_dir=default_cache_dir() if P.cache else None,
+        prior=P.prior,
+        dtype=P.dtype,
+        workers=P.workers,
+        presolve=presolve,
+    )
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+batch plate scaling of many image files on a process pool
+
+    python -m astrometry_azel.batch ~/data/night1/ --latlon 61.2 -149.9 --solve -j 4
+
+Inputs may be directories, glob patterns, image files, or manifest files (.csv or .txt)
+with lines "filename,time". Image time is taken from the manifest, else --ut1,
+else the FITS DATE-OBS header or HDF5 /ut1_unix.
+
+Job status is saved to a JSON state file after each job, so an interrupted batch
+resumes where it left off, skipping completed files.
+"""
+
+from pathlib import Path
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import glob
+import json
+import logging
+import time
+
+from . import default_index_dir
+from .cache import default_cache_dir
+
+IMAGE_SUFFIXES = {".fits", ".fit", ".new", ".h5", ".png", ".jpg", ".jpeg", ".tif", ".tiff"}
+
+
+def find_jobs(inputs: list[str], ut1: str | None = None) -> dict[str, str | None]:
+    """
+    expand directories, globs and manifests to image files
+
+    Returns
+    -------
+    jobs: dict
+        absolute filename: time string or None
+    """
+
+    jobs: dict[str, str | None] = {}
+
+    for i in inputs:
+        path = Path(i).expanduser()
+        if path.is_dir():
+            for fn in sorted(path.iterdir()):
+                if fn.suffix.lower() in IMAGE_SUFFIXES and not fn.stem.endswith("_new"):
+                    jobs[str(fn.resolve())] = ut1
+        elif path.suffix.lower() in {".csv", ".txt"}:
+            for line in path.read_text().splitlines():
+                if not (line := line.strip()) or line.startswith("#"):
+                    continue
+                name, *t = (s.strip() for s in line.split(","))
+                fn = (path.parent / Path(name).expanduser()).resolve()
+                jobs[str(fn)] = t[0] if t and t[0] else ut1
+        elif glob.has_magic(i):
+            for fn in sorted(glob.glob(str(path))):
+                jobs[str(Path(fn).resolve())] = ut1
+        else:
+            jobs[str(path.resolve())] = ut1
+
+    return jobs
+
+
+def frame_time(fn: Path) -> str | float:
+    """
+    image time from file metadata
+    """
+
+    fn = Path(fn)
+
+    match fn.suffix.lower():
+        case ".fits" | ".fit" | ".new":
+            from astropy.io import fits
+
+            try:
+                return fits.getheader(fn)["DATE-OBS"]
+            except KeyError:
+                pass
+        case ".h5":
+            import h5py
+
+            with h5py.File(fn, "r") as f:
+                try:
+                    return float(f["/ut1_unix"][0])
+                except KeyError:
+                    pass
+
+    raise ValueError(f"{fn}: no time in manifest, --ut1, or file metadata")
+
+
+def run_job(
+    fn: str,
+    ut1: str | None,
+    latlon: tuple[float, float],
+    solve: bool,
+    args: str,
+    index_dir: str | None,
+    cache_dir: Path | None,
+    timeout: float | None,
+    retries: int,
+    prior: Path | str | None = None,
+) -> dict:
+    """
+    plate scale one file, retrying on failure. Runs in a worker process.
+    """
+
+    tic = time.monotonic()
+    error = ""
+
+    for attempt in range(1, retries + 2):
+        try:
+            # inside the try: a missing dependency fails this job, not the whole batch
+            from .project import plate_scale
+
+            t = frame_time(Path(fn)) if ut1 is None else ut1
+            scale, _ = plate_scale(
+                Path(fn),
+                latlon,
+                t,
+                solve,
+                args,
+                index_dir=index_dir,
+                cache_dir=cache_dir,
+                timeout=timeout,
+                prior=prior,
+            )
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            logging.warning(f"{fn} attempt {attempt}: {error}")
+            continue
+
+        return {
+            "status": "ok",
+            "attempts": attempt,
+            "output": str(Path(scale.filename).with_suffix(".nc")),
+            "seconds": time.monotonic() - tic,
+        }
+
+    return {
+        "status": "failed",
+        "attempts": retries + 1,
+        "error": error,
+        "seconds": time.monotonic() - tic,
+    }
+
+
+def load_state(state_file: Path) -> dict[str, dict]:
+    state_file = Path(state_file).expanduser()
+    if not state_file.is_file():
+        return {}
+
+    return json.loads(state_file.read_text())
+
+
+def save_state(state: dict[str, dict], state_file: Path) -> None:
+    """
+    write state atomically so an interruption never leaves a truncated file
+    """
+
+    state_file = Path(state_file).expanduser()
+    tmp = state_file.with_name(state_file.name + ".tmp")
+    tmp.write_text(json.dumps(state, indent=2))
+    tmp.replace(state_file)
+
+
+def batch(
+    jobs: dict[str, str | None],
+    latlon: tuple[float, float],
+    *,
+    solve: bool = False,
+    args: str = "",
+    index_dir: str | None = None,
+    cache_dir: Path | None = None,
+    workers: int = 1,
+    timeout: float | None = None,
+    retries: int = 1,
+    state_file: Path | None = None,
+    prior: Path | str | None = None,
+) -> dict[str, dict]:
+    """
+    plate scale each file on a pool of worker processes.
+    Each worker runs at most one solve-field at a time, so "workers" is the number
+    of concurrent solve-field processes.
+
+    Parameters
+    ----------
+    jobs: dict
+        filename: time, from find_jobs()
+    latlon: tuple of float
+        WGS84 camera location (degrees)
+    workers: int
+        number of worker processes
+    timeout: float, optional
+        solve-field time limit per attempt (seconds)
+    retries: int
+        number of retries after a failed attempt
+    state_file: pathlib.Path, optional
+        JSON job state. Files already processed successfully are skipped.
+    prior: pathlib.Path, optional
+        previous .wcs or .nc solution of this camera, see doSolve()
+
+    Returns
+    -------
+    state: dict
+        filename: job result
+    """
+
+    state = load_state(state_file) if state_file else {}
+
+    todo = {fn: t for fn, t in jobs.items() if state.get(fn, {}).get("status") != "ok"}
+    print(f"{len(todo)} of {len(jobs)} files to process with {workers} workers")
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(
+                run_job,
+                fn,
+                t,
+                latlon,
+                solve,
+                args,
+                index_dir,
+                cache_dir,
+                timeout,
+                retries,
+                prior,
+            ): fn
+            for fn, t in todo.items()
+        }
+
+        for i, future in enumerate(as_completed(futures), start=1):
+            fn = futures[future]
+            state[fn] = future.result()
+            print(f"{i}/{len(todo)} {state[fn]['status']} {fn}")
+            if state_file:
+                save_state(state, state_file)
+
+    return state
+
+
+def summary(state: dict[str, dict]) -> str:
+    ok = [fn for fn, s in state.items() if s["status"] == "ok"]
+    failed = {fn: s for fn, s in state.items() if s["status"] != "ok"}
+
+    lines = [f"{len(ok)} succeeded, {len(failed)} failed"]
+    lines += [f"FAILED {fn}: {s['error']}" for fn, s in failed.items()]
+
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    p = ArgumentParser(description="plate scale many image files in parallel")
+    p.add_argument("inputs", help="image files, directories, globs, or manifest .csv", nargs="+")
+    p.add_argument(
+        "-l",
+        "--latlon",
+        help="wgs84 coordinates of cameras (deg.)",
+        nargs=2,
+        type=float,
+        required=True,
+    )
+    p.add_argument("-t", "--ut1", help="UT1 time yyyy-mm-ddTHH:MM:SSZ for all files")
+    p.add_argument(
+        "-i",
+        "--index-dir",
+        help="directory containing astrometry.net index files",
+        default=default_index_dir(),
+    )
+    p.add_argument(
+        "-s", "--solve", help="run solve-field step of astrometry.net", action="store_true"
+    )
+    p.add_argument("-a", "--args", help="arguments to pass through to solve-field", default="")
+    p.add_argument(
+        "-c",
+        "--cache",
+        help="reuse solve-field results for identical image, args and index files",
+        action="store_true",
+    )
+    p.add_argument("-j", "--workers", help="concurrent solve-field processes", type=int, default=1)
+    p.add_argument("--timeout", help="solve-field time limit per attempt (seconds)", type=float)
+    p.add_argument("--retries", help="retries per file after failure", type=int, default=1)
+    p.add_argument(
+        "--state", help="JSON job state file for resuming", default="astrometry_batch.json"
+    )
+    p.add_argument(
+        "-p",
+        "--prior",
+        help="previous .wcs or .nc solution of this camera: hint solve-field position and scale",
+    )
+    P = p.parse_args()
+
+    state = batch(
+        find_jobs(P.inputs, P.ut1),
+        tuple(P.latlon),
+        solve=P.solve,
+        args=P.args,
+        index_dir=P.index_dir,
+        cache_dir=default_cache_dir() if P.cache else None,
+        workers=P.workers,
+        timeout=P.timeout,
+        retries=P.retries,
+        state_file=Path(P.state),
+        prior=P.prior,
+    )
+
+    print(summary(state))
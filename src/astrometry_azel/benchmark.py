@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+"""
+benchmark the plate scale pipeline on synthetic images, without solve-field
+
+    python -m astrometry_azel.benchmark -s 512 2048 8192 -o v1.5.json
+    python -m astrometry_azel.benchmark -s 512 2048 -o new.json --compare v1.5.json
+
+Square images and WCS headers of each size are synthesized from the bundled apod4.wcs,
+keeping its field of view and distortion. Each hot path is timed (best of --repeat runs)
+and its peak resident memory increase measured in one more run in a forked process,
+which includes allocations by C libraries (ERFA, HDF5, ...) and threads.
+Results are saved as JSON with the package and library versions, so releases
+and machines can be compared with --compare.
+"""
+
+from pathlib import Path
+from argparse import ArgumentParser
+from collections.abc import Callable
+from datetime import datetime, timezone
+from functools import cached_property, partial
+from typing import Any
+import importlib.metadata
+import importlib.resources
+import json
+import multiprocessing
+import os
+import platform
+import re
+import sys
+import tempfile
+import time
+
+import numpy as np
+import xarray
+from astropy.io import fits
+
+from . import __version__, fits2radec, radec2azel
+from .io import collapsestack, meanstack, write_fits, write_netcdf
+
+LATLON = (65.0, -148.0)
+# apod4 field is near the meridian at 78 degrees elevation
+TIME = "2024-01-15T14:00:00"
+
+
+def synthetic_wcs(size: int, outfn: Path) -> Path:
+    """
+    apod4.wcs rescaled to a size x size image with the same field of view and distortion
+    """
+
+    with importlib.resources.as_file(
+        importlib.resources.files(__package__) / "tests" / "apod4.wcs"
+    ) as fn:
+        hdr = fits.getheader(fn)
+
+    W = hdr["IMAGEW"]
+    H = hdr["IMAGEH"]
+    s = size / W
+
+    # FITS pixel centers are integers, so scale about the 0.5 edge; center vertically
+    hdr["CRPIX1"] = s * (hdr["CRPIX1"] - 0.5) + 0.5
+    hdr["CRPIX2"] = s * (hdr["CRPIX2"] - 0.5) + 0.5 + (size - s * H) / 2
+    for k in ("CD1_1", "CD1_2", "CD2_1", "CD2_2"):
+        hdr[k] /= s
+    for k in list(hdr.keys()):
+        if m := re.fullmatch(r"(A|B|AP|BP)_(\d+)_(\d+)", k):
+            hdr[k] *= s ** (1 - int(m[2]) - int(m[3]))
+    hdr["IMAGEW"] = size
+    hdr["IMAGEH"] = size
+
+    fits.PrimaryHDU(header=hdr).writeto(outfn, overwrite=True)
+
+    return outfn
+
+
+def synthetic_stack(size: int, frames: int, seed: int = 0) -> np.ndarray:
+    """
+    uint16 frames of background noise and a few hundred stars
+    """
+
+    rng = np.random.default_rng(seed)
+    img = np.empty((frames, size, size), dtype=np.uint16)
+    # frame by frame to bound the float64 temporaries
+    for i in range(frames):
+        img[i] = rng.normal(1000, 20, (size, size)).clip(0)
+    y, x = rng.integers(0, size, (2, 300))
+    img[:, y, x] += rng.integers(100, 20000, 300).astype(np.uint16)
+
+    return img
+
+
+def measure(func, repeat: int = 1, memory: bool = True) -> dict:
+    """
+    best wall time (seconds) of repeat calls of func(), and peak_memory() of one more.
+    Memory is not measured where processes cannot be forked, e.g. Windows.
+    """
+
+    seconds = []
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - tic)
+
+    result = {"seconds": min(seconds), "runs": seconds}
+
+    if memory and "fork" in multiprocessing.get_all_start_methods():
+        result["peak_rss_bytes"] = peak_memory(func)
+
+    return result
+
+
+def peak_memory(func) -> int:
+    """
+    increase of peak resident memory (bytes) while func() runs in a forked process.
+    The fork shares the inputs already built, so only memory func() itself touches counts.
+    """
+
+    ctx = multiprocessing.get_context("fork")
+    recv, send = ctx.Pipe(duplex=False)
+    p = ctx.Process(target=_peak_rss, args=(func, send))
+    p.start()
+    send.close()
+    try:
+        r = recv.recv()
+    except EOFError:
+        # e.g. killed when out of memory
+        r = "benchmark process exited without result"
+    p.join()
+
+    if isinstance(r, str):
+        raise RuntimeError(r)
+
+    return r
+
+
+def _peak_rss(func, conn) -> None:
+    import resource
+
+    # ru_maxrss is bytes on macOS, KiB elsewhere; a forked process starts at its current size
+    unit = 1 if sys.platform == "darwin" else 1024
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        func()
+        conn.send((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) * unit)
+    except Exception as e:
+        conn.send(f"{type(e).__name__}: {e}")
+    finally:
+        conn.close()
+
+
+class Inputs:
+    """
+    synthetic inputs at one image size, each built on first use and shared by later benchmarks
+    """
+
+    def __init__(self, size: int, workdir: Path):
+        self.size = size
+        self.workdir = workdir
+
+    @cached_property
+    def stack(self) -> np.ndarray:
+        frames = max(4, min(32, 2**28 // (2 * self.size**2)))
+        return synthetic_stack(self.size, frames)
+
+    @cached_property
+    def fitsfn(self) -> Path:
+        fitsfn = self.workdir / f"bench{self.size}.fits"
+        write_fits(self.stack[0], fitsfn)
+        synthetic_wcs(self.size, fitsfn.with_suffix(".wcs"))
+        return fitsfn
+
+    @cached_property
+    def stackfn(self) -> Path:
+        stackfn = self.workdir / f"stack{self.size}.fits"
+        write_fits(self.stack, stackfn)
+        return stackfn
+
+    @cached_property
+    def radec(self) -> xarray.Dataset:
+        return fits2radec(self.fitsfn)
+
+    @cached_property
+    def scale(self) -> xarray.Dataset:
+        scale = radec2azel(self.radec, LATLON, TIME, method="rotation")
+        scale["image"] = (("y", "x"), self.stack[0])
+        return scale
+
+    @cached_property
+    def alt(self) -> xarray.Dataset:
+        alt = _image_altitude()(self.scale.copy(), 110.0, 0.0)
+        alt["time"] = np.datetime64(TIME)
+        return alt
+
+
+def cases(size: int, exact_max: int) -> dict[str, Callable[[Inputs], Callable[[], Any]] | None]:
+    """
+    name: setup function for each benchmark at this image size, or None to skip it.
+    setup(inputs) builds what the benchmark needs, outside the timing,
+    and returns the zero-argument function to time.
+    """
+
+    C: dict[str, Callable[[Inputs], Callable[[], Any]] | None] = {
+        "fits2radec": lambda I: partial(fits2radec, I.fitsfn),
+        "fits2radec[workers]": lambda I: partial(fits2radec, I.fitsfn, workers=os.cpu_count() or 1),
+        "radec2azel[rotation]": lambda I: partial(
+            radec2azel, I.radec, LATLON, TIME, method="rotation"
+        ),
+        "radec2azel[interp]": lambda I: partial(radec2azel, I.radec, LATLON, TIME, method="interp"),
+        "radec2azel[astropy]": lambda I: partial(
+            radec2azel, I.radec, LATLON, TIME, method="astropy"
+        ),
+        "image_altitude": lambda I: partial(_on_copy, _image_altitude(), I.scale, 110.0, 0.0),
+        "collapsestack[mean]": lambda I: partial(collapsestack, I.stack, slice(None), "mean"),
+        "collapsestack[median]": lambda I: partial(collapsestack, I.stack, slice(None), "median"),
+        "collapsestack[sigmaclip]": lambda I: partial(
+            collapsestack, I.stack, slice(None), "sigmaclip"
+        ),
+        "meanstack[fits]": lambda I: partial(meanstack, I.stackfn, slice(None)),
+        "write_netcdf": lambda I: partial(write_netcdf, I.scale, I.workdir / "bench.nc"),
+        "plot.az_el": lambda I: partial(_drawn, _plot().az_el, I.scale, img=I.stack[0]),
+        "plot.project.geomap": lambda I: partial(_drawn, _geomap(), I.alt),
+        "plot.project.geomap[raster]": lambda I: partial(_drawn, _geomap(), I.alt, raster=True),
+    }
+
+    if size > exact_max:
+        # minutes per run at large sizes
+        C["radec2azel[astropy]"] = None
+
+    return C
+
+
+def _image_altitude():
+    # needs pymap3d
+    from .project import image_altitude
+
+    return image_altitude
+
+
+def _plot():
+    import matplotlib
+
+    matplotlib.use("Agg")
+    from . import plot
+
+    return plot
+
+
+def _geomap():
+    _plot()
+    from .plot.project import geomap
+
+    return geomap
+
+
+def _drawn(plotter, *args, **kwargs) -> None:
+    from matplotlib.pyplot import close
+
+    fg = plotter(*args, **kwargs)
+    fg.canvas.draw()
+    close(fg)
+
+
+def _on_copy(func, ds: xarray.Dataset, *args):
+    # for functions that modify ds
+    return func(ds.copy(), *args)
+
+
+def run(
+    sizes=(512, 2048),
+    *,
+    select: list[str] | None = None,
+    repeat: int = 1,
+    memory: bool = True,
+    exact_max: int = 2048,
+    outfn: Path | None = None,
+) -> dict:
+    """
+    run benchmarks at each image size
+
+    Parameters
+    ----------
+    sizes: list of int
+        square image sizes (pixels)
+    select: list of str, optional
+        run only benchmarks whose name contains one of these, e.g. ["radec2azel", "plot"]
+    repeat: int
+        timed runs of each benchmark, the best is reported
+    memory: bool
+        measure peak resident memory increase in an extra run, see peak_memory()
+    exact_max: int
+        radec2azel[astropy] is skipped for larger sizes
+    outfn: pathlib.Path, optional
+        JSON results file
+
+    Returns
+    -------
+    results: dict
+        environment and, for each benchmark and size: seconds, runs, peak_rss_bytes,
+        or error if it failed or skipped if not run
+    """
+
+    results: dict[str, Any] = {
+        "version": __version__,
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "machine": {
+            "platform": platform.platform(),
+            "processor": platform.processor() or platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "python": platform.python_version(),
+        },
+        "packages": {},
+        "benchmarks": [],
+    }
+    for pkg in ("numpy", "astropy", "xarray", "netCDF4", "scipy", "matplotlib", "cartopy"):
+        try:
+            results["packages"][pkg] = importlib.metadata.version(pkg)
+        except importlib.metadata.PackageNotFoundError:
+            pass
+
+    with tempfile.TemporaryDirectory() as d:
+        for size in sizes:
+            inputs = Inputs(size, Path(d))
+            for name, setup in cases(size, exact_max).items():
+                if select and not any(s in name for s in select):
+                    continue
+
+                r: dict = {"name": name, "size": size}
+                if setup is None:
+                    r["skipped"] = True
+                else:
+                    try:
+                        r |= measure(setup(inputs), repeat, memory)
+                    except Exception as e:
+                        # e.g. optional dependency or map data missing
+                        r["error"] = f"{type(e).__name__}: {e}"
+
+                results["benchmarks"].append(r)
+                print(_row(r))
+
+    if outfn is not None:
+        outfn = Path(outfn).expanduser()
+        outfn.write_text(json.dumps(results, indent=2))
+        print("wrote", outfn)
+
+    return results
+
+
+def _row(r: dict) -> str:
+    head = f"{r['name']:<30} {r['size']:>6}"
+    if "seconds" in r:
+        mem = f"{r['peak_rss_bytes'] / 2**20:9.1f} MiB" if "peak_rss_bytes" in r else ""
+        return f"{head} {r['seconds']:10.4f} s {mem}"
+
+    return f"{head} {r.get('error', 'skipped')}"
+
+
+def compare(old: Path | dict, new: Path | dict, threshold: float = 1.1) -> list[dict]:
+    """
+    time and memory ratios new / old of benchmarks in both result sets
+
+    Returns
+    -------
+    rows: list of dict
+        name, size, time_ratio, memory_ratio, regression (time or memory ratio above threshold)
+    """
+
+    def load(r) -> dict:
+        if not isinstance(r, dict):
+            r = json.loads(Path(r).expanduser().read_text())
+        return {(b["name"], b["size"]): b for b in r["benchmarks"] if "seconds" in b}
+
+    old = load(old)
+    new = load(new)
+
+    rows = []
+    for k in old.keys() & new.keys():
+        t = new[k]["seconds"] / old[k]["seconds"]
+        m = None
+        if "peak_rss_bytes" in old[k] and "peak_rss_bytes" in new[k]:
+            # resident memory has page and allocator granularity: below 1 MiB is noise
+            m = max(new[k]["peak_rss_bytes"], 2**20) / max(old[k]["peak_rss_bytes"], 2**20)
+        rows.append(
+            {
+                "name": k[0],
+                "size": k[1],
+                "time_ratio": t,
+                "memory_ratio": m,
+                "regression": t > threshold or (m is not None and m > threshold),
+            }
+        )
+
+    return sorted(rows, key=lambda r: (r["name"], r["size"]))
+
+
+if __name__ == "__main__":
+    p = ArgumentParser(description="benchmark the plate scale pipeline on synthetic images")
+    p.add_argument(
+        "-s",
+        "--sizes",
+        help="square image sizes (pixels)",
+        nargs="+",
+        type=int,
+        default=[512, 2048],
+    )
+    p.add_argument("-k", "--select", help="run only benchmarks containing these names", nargs="+")
+    p.add_argument("-r", "--repeat", help="timed runs of each benchmark", type=int, default=3)
+    p.add_argument("--no-memory", help="skip peak memory measurement", action="store_true")
+    p.add_argument(
+        "--exact-max",
+        help="largest size for exact AstroPy radec2azel",
+        type=int,
+        default=2048,
+    )
+    p.add_argument("-o", "--outfn", help="JSON results file")
+    p.add_argument("--compare", help="previous JSON results to compare with")
+    p.add_argument(
+        "--threshold", help="ratio new / old flagged as regression", type=float, default=1.1
+    )
+    P = p.parse_args()
+
+    res = run(
+        P.sizes,
+        select=P.select,
+        repeat=P.repeat,
+        memory=not P.no_memory,
+        exact_max=P.exact_max,
+        outfn=P.outfn,
+    )
+
+    if P.compare:
+        print(f"\n{'':<30} {'size':>6} {'time':>8} {'memory':>8}")
+        for c in compare(P.compare, res, P.threshold):
+            m = f"{c['memory_ratio']:8.2f}" if c["memory_ratio"] is not None else f"{'':8}"
+            flag = "  REGRESSION" if c["regression"] else ""
+            print(f"{c['name']:<30} {c['size']:>6} {c['time_ratio']:8.2f} {m}{flag}")
@@ -0,0 +1,132 @@
+"""
+content-addressed on-disk cache of solve-field products
+
+The cache key is a hash of the image file bytes, the normalized solve-field arguments,
+the index file listing, and the solve-field version.
+Each entry is a directory holding the solve-field products (.wcs, .rdls, .corr, ...).
+Entries are evicted least recently used first when the cache exceeds its size limit.
+"""
+
+from pathlib import Path
+import hashlib
+import os
+import shlex
+import shutil
+import tempfile
+import logging
+
+PRODUCTS = (".wcs", ".rdls", ".corr", ".solved", ".match")
+
+
+def default_cache_dir() -> Path:
+    """
+    default directory to cache solve-field results, following XDG_CACHE_HOME
+    """
+    root = os.environ.get("XDG_CACHE_HOME", "~/.cache")
+    return Path(root, "astrometry_azel", "solve").expanduser().resolve()
+
+
+def solve_key(
+    fitsfn: Path,
+    args: str,
+    index_dir: Path | str | None,
+    version: str,
+    index_files: list[Path] | None = None,
+) -> str:
+    """
+    hash of everything that determines the solve-field output
+
+    index_files: the index files used, if a subset of index_dir
+    """
+
+    h = hashlib.sha256()
+
+    with open(fitsfn, "rb") as f:
+        while block := f.read(2**20):
+            h.update(block)
+
+    # normalize quoting and whitespace
+    h.update(shlex.join(shlex.split(args)).encode())
+
+    if not index_files and index_dir is not None:
+        index_files = list(Path(index_dir).expanduser().glob("*.fits"))
+
+    for fn in sorted(Path(f) for f in index_files or []):
+        st = fn.stat()
+        h.update(f"{fn.name} {st.st_size} {st.st_mtime_ns}".encode())
+
+    h.update(str(version).encode())
+
+    return h.hexdigest()
+
+
+def restore(key: str, fitsfn: Path, cache_dir: Path) -> bool:
+    """
+    copy cached products next to fitsfn
+
+    Returns
+    -------
+    hit: bool
+        True if the key was in the cache
+    """
+
+    entry = Path(cache_dir).expanduser() / key
+    if not (entry / "solve.wcs").is_file():
+        return False
+
+    for src in entry.iterdir():
+        shutil.copy2(src, fitsfn.with_suffix(src.suffix))
+
+    # mark as recently used
+    os.utime(entry)
+
+    return True
+
+
+def store(key: str, fitsfn: Path, cache_dir: Path, max_bytes: int) -> None:
+    """
+    save solve-field products of fitsfn in the cache, then evict to max_bytes
+    """
+
+    cache_dir = Path(cache_dir).expanduser()
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    entry = cache_dir / key
+    if entry.is_dir():
+        return
+
+    # write to a temporary directory and rename so that readers never see partial entries
+    tmp = Path(tempfile.mkdtemp(dir=cache_dir, prefix=".tmp"))
+    for suffix in PRODUCTS:
+        if (src := fitsfn.with_suffix(suffix)).is_file():
+            shutil.copy2(src, tmp / ("solve" + suffix))
+
+    try:
+        tmp.rename(entry)
+    except OSError:
+        # another process stored the same key first
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    evict(cache_dir, max_bytes)
+
+
+def evict(cache_dir: Path, max_bytes: int) -> None:
+    """
+    delete least recently used entries until the cache is at most max_bytes
+    """
+
+    entries = []
+    for entry in Path(cache_dir).expanduser().iterdir():
+        if not entry.is_dir() or entry.name.startswith("."):
+            continue
+        size = sum(f.stat().st_size for f in entry.iterdir())
+        entries.append((entry.stat().st_mtime, size, entry))
+
+    total = sum(e[1] for e in entries)
+
+    for _, size, entry in sorted(entries):
+        if total <= max_bytes:
+            break
+        logging.info(f"solve cache: evicting {entry}")
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
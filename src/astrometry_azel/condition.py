@@ -0,0 +1,314 @@
+"""
+condition an image before plate solving: crop, mask, bin, and extract a star list
+
+solve-field's own source extraction runs on every pixel of the image it is given.
+For large frames it is much faster to bin the image, mask the horizon and obstructions,
+find the stars here, and hand solve-field the star list (xylist) instead.
+The solution is then rescaled back to full-resolution pixel coordinates.
+
+    xyfn = star_list(img, "frame.xyls", bin_factor=4, horizon_radius=1800)
+    doSolve(xyfn, xylist_args(xyfn), binning=4)
+    rescale_wcs(xyfn.with_suffix(".wcs"), xyfn, "frame.wcs")
+"""
+
+from pathlib import Path
+import logging
+import re
+import shlex
+import warnings
+
+import numpy as np
+from astropy.io import fits
+
+
+def sky_mask(
+    shape: tuple[int, int],
+    *,
+    horizon_radius: float | None = None,
+    center: tuple[float, float] | None = None,
+    mask=None,
+) -> np.ndarray:
+    """
+    boolean image, True where the sky is usable
+
+    Parameters
+    ----------
+    shape: tuple of int
+        image (y, x) shape
+    horizon_radius: float, optional
+        pixels further than this from center are below the horizon, e.g. the edge of an all-sky lens
+    center: tuple of float, optional
+        (y, x) pixel of the zenith, default image center
+    mask: numpy.ndarray or pathlib.Path, optional
+        image of the same shape, nonzero where the sky is usable (zero over obstructions)
+    """
+
+    ok = np.ones(shape, dtype=bool)
+
+    if horizon_radius is not None:
+        if center is None:
+            center = ((shape[0] - 1) / 2, (shape[1] - 1) / 2)
+        y, x = np.ogrid[: shape[0], : shape[1]]
+        ok &= (y - center[0]) ** 2 + (x - center[1]) ** 2 <= horizon_radius**2
+
+    if mask is not None:
+        if not isinstance(mask, np.ndarray):
+            from .io import load_image
+
+            mask = load_image(Path(mask))
+        if mask.shape != tuple(shape):
+            raise ValueError(f"mask shape {mask.shape} != image shape {shape}")
+        ok &= mask != 0
+
+    return ok
+
+
+def bin_image(img, factor: int) -> np.ndarray:
+    """
+    mean of factor x factor pixel blocks, ignoring NaN (masked) pixels.
+    Rows and columns beyond a multiple of factor are dropped.
+    """
+
+    img = np.asarray(img, dtype=np.float32)
+    if factor == 1:
+        return img
+
+    ny = img.shape[0] // factor
+    nx = img.shape[1] // factor
+    blocks = img[: ny * factor, : nx * factor].reshape(ny, factor, nx, factor)
+
+    with warnings.catch_warnings():
+        # all-masked blocks are NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return np.nanmean(blocks, axis=(1, 3))
+
+
+def extract_stars(
+    img, *, threshold: float = 5.0, max_stars: int = 500, tile: int = 32, fwhm: float = 2.0
+) -> tuple:
+    """
+    star centroids of an image, brightest first. NaN pixels are masked.
+
+    Parameters
+    ----------
+    img: numpy.ndarray
+        2-D image
+    threshold: float
+        detection threshold (standard deviations of the smoothed background)
+    max_stars: int
+        brightest stars kept
+    tile: int
+        size (pixels) of the tiles over which the background is estimated
+    fwhm: float
+        approximate star full width at half maximum (pixels), for the matched filter
+
+    Returns
+    -------
+    x, y: numpy.ndarray
+        centroids (0-based pixels)
+    flux: numpy.ndarray
+        background-subtracted sum over each star
+    """
+
+    from scipy import ndimage
+
+    img = np.asarray(img, dtype=np.float64)
+    valid = np.isfinite(img)
+    if not valid.any():
+        raise ValueError("no usable pixels")
+
+    # %% background: median of coarse tiles, interpolated back to pixels
+    ny, nx = img.shape
+    by = -(-ny // tile)
+    bx = -(-nx // tile)
+    padded = np.full((by * tile, bx * tile), np.nan)
+    padded[:ny, :nx] = np.where(valid, img, np.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        bg = np.nanmedian(padded.reshape(by, tile, bx, tile), axis=(1, 3))
+    bg[np.isnan(bg)] = np.nanmedian(bg)
+    bg = ndimage.zoom(bg, (ny / by, nx / bx), order=1, grid_mode=True, mode="nearest")
+
+    resid = np.where(valid, img - bg, 0.0)
+
+    # %% detect: smoothed image above threshold, noise from the median absolute deviation
+    smooth = ndimage.gaussian_filter(resid, fwhm / 2.355)
+    s = smooth[valid]
+    sigma = 1.4826 * np.median(np.abs(s - np.median(s)))
+    if sigma == 0:
+        sigma = s.std()
+
+    labels, n = ndimage.label((smooth > threshold * sigma) & valid)
+    if n == 0:
+        logging.warning("no stars found")
+        return np.empty(0), np.empty(0), np.empty(0)
+
+    idx = np.arange(1, n + 1)
+    flux = np.asarray(ndimage.sum(resid, labels, idx))
+    y, x = np.asarray(ndimage.center_of_mass(np.clip(resid, 0, None), labels, idx)).T
+
+    # drop detections at the mask edge, where the masked region meets the sky
+    edge = ndimage.binary_dilation(~valid, iterations=2)
+    good = np.isfinite(x + y) & (flux > 0)
+    good[good] &= ~edge[np.rint(y[good]).astype(int), np.rint(x[good]).astype(int)]
+
+    i = np.flatnonzero(good)[np.argsort(flux[good])[::-1][:max_stars]]
+
+    return x[i], y[i], flux[i]
+
+
+def star_list(
+    img,
+    xyfn: Path,
+    *,
+    bin_factor: int = 2,
+    crop: tuple[int, int, int, int] | None = None,
+    horizon_radius: float | None = None,
+    mask=None,
+    threshold: float = 5.0,
+    max_stars: int = 500,
+) -> Path:
+    """
+    crop, mask and bin an image, and write its star list for solve-field
+
+    Parameters
+    ----------
+    img: numpy.ndarray
+        full-resolution 2-D image, as written by io.write_fits()
+    xyfn: pathlib.Path
+        output xylist FITS file
+    bin_factor: int
+        bin factor x factor pixels before extraction
+    crop: tuple of int, optional
+        (y0, y1, x0, x1) full-resolution pixel region to solve
+    horizon_radius, mask:
+        see sky_mask(), in full-resolution pixels
+    threshold, max_stars:
+        see extract_stars()
+
+    Returns
+    -------
+    xyfn: pathlib.Path
+        with the binning and crop offset in the primary header, for rescale_wcs()
+    """
+
+    xyfn = Path(xyfn).expanduser()
+    img = np.asarray(img)
+    if img.ndim != 2:
+        raise ValueError("star list extraction needs a 2-D greyscale image")
+
+    H, W = img.shape
+
+    ok = sky_mask(img.shape, horizon_radius=horizon_radius, mask=mask)
+    work = np.where(ok, img.astype(np.float32, copy=False), np.nan)
+
+    y0, x0 = 0, 0
+    if crop is not None:
+        y0, y1, x0, x1 = crop
+        work = work[y0:y1, x0:x1]
+
+    work = bin_image(work, bin_factor)
+
+    x, y, flux = extract_stars(work, threshold=threshold, max_stars=max_stars)
+    logging.info(f"{x.size} stars in {work.shape} binned image")
+
+    write_xylist(xyfn, x, y, flux, work.shape)
+
+    with fits.open(xyfn, mode="update") as f:
+        hdr = f[0].header
+        hdr["BINNING"] = (bin_factor, "image pixels per star list pixel")
+        hdr["XOFFSET"] = (x0, "x of crop origin in image (0-based pixels)")
+        hdr["YOFFSET"] = (y0, "y of crop origin in image (0-based pixels)")
+        hdr["FULLW"] = (W, "image width")
+        hdr["FULLH"] = (H, "image height")
+
+    return xyfn
+
+
+def write_xylist(xyfn: Path, x, y, flux, shape: tuple[int, int]) -> Path:
+    """
+    astrometry.net xylist: FITS table of X, Y (1-based pixels) and FLUX, brightest first
+    """
+
+    xyfn = Path(xyfn).expanduser()
+
+    table = fits.BinTableHDU.from_columns(
+        [
+            fits.Column(name="X", format="D", array=np.asarray(x) + 1),
+            fits.Column(name="Y", format="D", array=np.asarray(y) + 1),
+            fits.Column(name="FLUX", format="D", array=np.asarray(flux)),
+        ]
+    )
+    table.header["IMAGEH"], table.header["IMAGEW"] = shape
+
+    fits.HDUList([fits.PrimaryHDU(), table]).writeto(xyfn, overwrite=True)
+
+    return xyfn
+
+
+def xylist_args(xyfn: Path) -> str:
+    """
+    solve-field arguments to solve a star list from star_list()
+    """
+
+    hdr = fits.getheader(xyfn, 1)
+
+    return shlex.join(
+        [
+            "--width",
+            str(hdr["IMAGEW"]),
+            "--height",
+            str(hdr["IMAGEH"]),
+            "--x-column",
+            "X",
+            "--y-column",
+            "Y",
+        ]
+    )
+
+
+def rescale_wcs(wcsfn: Path, xyfn: Path, outfn: Path) -> Path:
+    """
+    WCS of a binned, cropped star list solution in full-resolution image pixels
+
+    A binned pixel p (1-based) covers image pixels centered on b * p - (b - 1) / 2 + offset.
+    The CD matrix scales by 1 / b and each SIP coefficient of order p + q by b ** (1 - p - q).
+
+    Parameters
+    ----------
+    wcsfn: pathlib.Path
+        solve-field .wcs of the star list
+    xyfn: pathlib.Path
+        star list from star_list()
+    outfn: pathlib.Path
+        WCS for the full-resolution image, e.g. image.wcs to be found by find_wcs()
+    """
+
+    geom = fits.getheader(xyfn, 0)
+    b = geom["BINNING"]
+
+    with fits.open(Path(wcsfn).expanduser(), mode="readonly") as f:
+        hdr = f[0].header.copy()
+
+    hdr["CRPIX1"] = b * hdr["CRPIX1"] - (b - 1) / 2 + geom["XOFFSET"]
+    hdr["CRPIX2"] = b * hdr["CRPIX2"] - (b - 1) / 2 + geom["YOFFSET"]
+
+    if "CD1_1" in hdr:
+        for k in ("CD1_1", "CD1_2", "CD2_1", "CD2_2"):
+            if k in hdr:
+                hdr[k] /= b
+    else:
+        for k in ("CDELT1", "CDELT2"):
+            hdr[k] /= b
+
+    for k in list(hdr.keys()):
+        if m := re.fullmatch(r"(A|B|AP|BP)_(\d+)_(\d+)", k):
+            hdr[k] *= float(b) ** (1 - int(m[2]) - int(m[3]))
+
+    hdr["IMAGEW"] = geom["FULLW"]
+    hdr["IMAGEH"] = geom["FULLH"]
+
+    outfn = Path(outfn).expanduser()
+    fits.PrimaryHDU(header=hdr).writeto(outfn, overwrite=True)
+
+    return outfn
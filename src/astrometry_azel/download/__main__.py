@@ -5,21 +5,49 @@ https://astrometry.net/doc/readme.html#getting-index-files
 Downloads 2MASS whole-sky index files, which worked well for me with a
 variety of non-all-sky auroral imagagers in the 5 to 50 degree FOV range.
 Also, the Tycho index files are good for this FOV range and I sometimes need them too.
+
+Files are downloaded concurrently to a ".part" file, resumed with HTTP Range requests
+if interrupted, verified by size and optionally by SHA256 from a manifest
+(sha256sum format: "<hex digest>  <filename>" per line), and only then renamed
+to the final name. A file that already exists is checked against the manifest digest,
+else the server's size, and resumed if incomplete.
 """
 
 from argparse import ArgumentParser
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+import hashlib
+import logging
+import os
+import time
 import urllib.request
+import urllib.error
 
 from .. import default_index_dir
+from ..index import field_of_view, index_range
 
 url_2mass = "https://data.astrometry.net/4200/"
 url_tycho = "https://data.astrometry.net/4100/"
 
 
-def download(odir: Path, source_url: str, irng: list[int]):
+def download(
+    odir: Path,
+    source_url: str,
+    irng: Sequence[int],
+    workers: int = 4,
+    manifest: Path | None = None,
+) -> dict[str, str]:
     """Download star index files.
     The default range was useful for my cameras.
+
+    workers: number of concurrent downloads
+    manifest: sha256sum file to verify downloads against, see read_manifest()
+
+    Returns
+    -------
+    status: dict
+        filename: "downloaded", "exists" or error message
     """
 
     assert len(irng) == 2, "specify start, stop indices"
@@ -29,19 +57,92 @@ def download(odir: Path, source_url: str, irng: list[int]):
 
     ri = int(source_url.split("/")[-2][:2])
 
+    jobs = {}
     for i in range(irng[0], irng[1] + 1):
-        fn = f"index-{ri:2d}{i:02d}.fits"
-        url = f"{source_url}{fn}"
-        ofn = odir / fn
-        if ofn.is_file():  # no clobber
-            print("Exists:", ofn)
+        if ri == 41 and i < 7:
+            logging.warning(f"4100 series has no scale {i}, use the 4200 series")
+            continue
+        if ri == 42 and i < 8:
+            # small scales are split into HEALPix tiles: 48 for scales 0-4, 12 for 5-7
+            names = [f"index-{ri:2d}{i:02d}-{hp:02d}.fits" for hp in range(48 if i < 5 else 12)]
+        else:
+            names = [f"index-{ri:2d}{i:02d}.fits"]
+        for fn in names:
+            jobs[f"{source_url}{fn}"] = odir / fn
+
+    return fetch_all(jobs, workers, read_manifest(manifest) if manifest else {})
+
+
+def fetch_all(
+    jobs: dict[str, Path], workers: int = 4, checksums: dict[str, str] | None = None
+) -> dict[str, str]:
+    """
+    download url: file jobs on a pool of threads, with a progress summary
+
+    checksums: filename: SHA256 hex digest
+    """
+
+    checksums = checksums or {}
+    status = {}
+    nbytes = 0
+    tic = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(url_retrieve, url, ofn, sha256=checksums.get(ofn.name)): ofn
+            for url, ofn in jobs.items()
+        }
+
+        for i, future in enumerate(as_completed(futures), start=1):
+            ofn = futures[future]
+            try:
+                n = future.result()
+            except (OSError, ValueError) as e:
+                status[ofn.name] = f"{type(e).__name__}: {e}"
+                logging.error(f"{ofn.name}: {status[ofn.name]}")
+            else:
+                status[ofn.name] = "exists" if n is None else "downloaded"
+                nbytes += n or 0
+            print(f"{i}/{len(jobs)} {status[ofn.name]} {ofn}")
+
+    seconds = time.monotonic() - tic
+    N = list(status.values())
+    print(
+        f"{N.count('downloaded')} downloaded, {N.count('exists')} existing, "
+        f"{len(N) - N.count('downloaded') - N.count('exists')} failed: "
+        f"{nbytes / 1e6:.1f} MB in {seconds:.1f} s ({nbytes / 1e6 / max(seconds, 1e-3):.1f} MB/s)"
+    )
+
+    return status
+
+
+def read_manifest(fn: Path) -> dict[str, str]:
+    """
+    read sha256sum format file: "<hex digest>  <filename>" per line
+
+    Returns
+    -------
+    checksums: dict
+        filename: SHA256 hex digest
+    """
+
+    checksums = {}
+    for line in Path(fn).expanduser().read_text().splitlines():
+        if not (line := line.strip()) or line.startswith("#"):
             continue
-        print(f"{url} => {ofn}")
+        digest, name = line.split(maxsplit=1)
+        checksums[Path(name.lstrip("*")).name] = digest.lower()
 
-        url_retrieve(url, ofn)
+    return checksums
 
 
-def url_retrieve(url: str, outfile: Path, overwrite: bool = False):
+def url_retrieve(
+    url: str,
+    outfile: Path,
+    overwrite: bool = False,
+    sha256: str | None = None,
+    timeout: float = 60.0,
+) -> int | None:
     """
     Parameters
     ----------
@@ -51,15 +152,101 @@ def url_retrieve(url: str, outfile: Path, overwrite: bool = False):
         output filepath (including name)
     overwrite: bool
         overwrite if file exists
+    sha256: str, optional
+        expected SHA256 hex digest of the file
+    timeout: float
+        network timeout (seconds)
+
+    Returns
+    -------
+    nbytes: int or None
+        bytes transferred, None if the file already existed
     """
 
     outfile = Path(outfile).expanduser().resolve()
     if outfile.is_dir():
         raise ValueError("Please specify full filepath, including filename")
+    part = outfile.with_name(outfile.name + ".part")
     # need .resolve() in case intermediate relative dir doesn't exist
-    if overwrite or not outfile.is_file():
-        outfile.parent.mkdir(parents=True, exist_ok=True)
-        urllib.request.urlretrieve(url, outfile)
+    if outfile.is_file() and not overwrite:
+        if is_complete(url, outfile, sha256, timeout):
+            return None
+        # e.g. truncated by an interrupted run of an older version: resume it
+        logging.warning(f"{outfile} is incomplete, resuming download")
+        os.replace(outfile, part)
+
+    outfile.parent.mkdir(parents=True, exist_ok=True)
+
+    start = part.stat().st_size if part.is_file() else 0
+
+    req = urllib.request.Request(url)
+    if start:
+        req.add_header("Range", f"bytes={start}-")
+
+    try:
+        resp = urllib.request.urlopen(req, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code != 416:
+            raise
+        # Range Not Satisfiable: the previous transfer was complete or the file changed
+        part.unlink()
+        return url_retrieve(url, outfile, overwrite, sha256, timeout)
+
+    with resp:
+        if resp.status == 206:
+            total = int(resp.headers["Content-Range"].rsplit("/", 1)[1])
+            mode = "ab"
+        else:
+            # server ignored Range: start over
+            total = int(resp.headers.get("Content-Length", -1))
+            start = 0
+            mode = "wb"
+
+        with part.open(mode) as f:
+            while block := resp.read(2**20):
+                f.write(block)
+
+    size = part.stat().st_size
+    if total >= 0 and size != total:
+        raise OSError(f"{url}: got {size} bytes, expected {total}. Rerun to resume.")
+
+    if sha256 is not None:
+        if file_sha256(part) != sha256.lower():
+            part.unlink()
+            raise ValueError(f"{url}: SHA256 mismatch, deleted download")
+
+    os.replace(part, outfile)
+
+    return size - start
+
+
+def is_complete(url: str, fn: Path, sha256: str | None = None, timeout: float = 60.0) -> bool:
+    """
+    an existing file matches its manifest digest, or without one, the server's Content-Length.
+    If the server cannot be reached, the file is assumed complete.
+    """
+
+    if sha256 is not None:
+        return file_sha256(fn) == sha256.lower()
+
+    try:
+        req = urllib.request.Request(url, method="HEAD")
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            total = int(resp.headers.get("Content-Length", -1))
+    except OSError as e:
+        logging.warning(f"{fn}: could not check size: {e}")
+        return True
+
+    return total < 0 or fn.stat().st_size == total
+
+
+def file_sha256(fn: Path) -> str:
+    h = hashlib.sha256()
+    with Path(fn).open("rb") as f:
+        while block := f.read(2**20):
+            h.update(block)
+
+    return h.hexdigest()
 
 
 if __name__ == "__main__":
@@ -76,7 +263,25 @@ if __name__ == "__main__":
         type=int,
         default=(8, 19),
     )
+    p.add_argument(
+        "--fov",
+        help="camera field of view (degrees), or narrowest, widest: download only scales needed",
+        nargs="+",
+        type=float,
+    )
+    p.add_argument(
+        "--wcs", help="existing .wcs of the camera: download only the index scales needed"
+    )
+    p.add_argument("-j", "--workers", help="concurrent downloads", type=int, default=4)
+    p.add_argument("-m", "--manifest", help="sha256sum file to verify downloads")
     P = p.parse_args()
 
+    irng = P.indexrange
+    if P.wcs:
+        irng = index_range(field_of_view(P.wcs))
+    elif P.fov:
+        irng = index_range(P.fov)
+    print("index scales", irng)
+
     for s in P.source:
-        download(P.outdir, s, P.indexrange)
+        download(P.outdir, s, irng, workers=P.workers, manifest=P.manifest)
@@ -0,0 +1,143 @@
+"""
+select the astrometry.net index files that matter for a camera field of view
+
+Each index scale holds star quads ("skymarks") of a range of sizes.
+solve-field needs quads of roughly 10% to 100% of the image width;
+loading index files outside that range only costs time and memory.
+https://astrometry.net/doc/readme.html#getting-index-files
+"""
+
+from pathlib import Path
+
+import numpy as np
+from astropy.io import fits
+import astropy.wcs as awcs
+
+# index scale: skymark diameter range (arcminutes), same for the 4100 and 4200 series
+INDEX_SCALES = {
+    0: (2.0, 2.8),
+    1: (2.8, 4.0),
+    2: (4.0, 5.6),
+    3: (5.6, 8.0),
+    4: (8.0, 11.0),
+    5: (11.0, 16.0),
+    6: (16.0, 22.0),
+    7: (22.0, 30.0),
+    8: (30.0, 42.0),
+    9: (42.0, 60.0),
+    10: (60.0, 85.0),
+    11: (85.0, 120.0),
+    12: (120.0, 170.0),
+    13: (170.0, 240.0),
+    14: (240.0, 340.0),
+    15: (340.0, 480.0),
+    16: (480.0, 680.0),
+    17: (680.0, 1000.0),
+    18: (1000.0, 1400.0),
+    19: (1400.0, 2000.0),
+}
+
+
+def index_range(fov_deg, lo: float = 0.1, hi: float = 1.0) -> tuple[int, int]:
+    """
+    first, last (inclusive) index scales for a field of view
+
+    Parameters
+    ----------
+    fov_deg: float or tuple of float
+        field of view (degrees): one value, or (narrowest, widest), e.g. image (height, width)
+        or the range of cameras or zoom settings to cover
+    lo, hi: float
+        fraction of the field of view spanned by the smallest and largest useful quads
+    """
+
+    fov = np.atleast_1d(fov_deg).astype(float)
+    smallest = lo * fov.min() * 60
+    largest = hi * fov.max() * 60
+
+    scales = [s for s, (a, b) in INDEX_SCALES.items() if b > smallest and a < largest]
+    if not scales:
+        # field smaller or larger than any index
+        scales = [0] if largest <= INDEX_SCALES[0][0] else [max(INDEX_SCALES)]
+
+    return min(scales), max(scales)
+
+
+def field_of_view(wcsfn: Path) -> tuple[float, float]:
+    """
+    image height, width (degrees) from a WCS FITS file (.wcs, .new, wcs.fits)
+    """
+
+    with fits.open(Path(wcsfn).expanduser(), mode="readonly") as f:
+        hdr = f[0].header
+        w = awcs.WCS(hdr).celestial
+
+    width = hdr.get("IMAGEW", hdr.get("NAXIS1", 2 * hdr["CRPIX1"]))
+    height = hdr.get("IMAGEH", hdr.get("NAXIS2", 2 * hdr["CRPIX2"]))
+
+    scale_x, scale_y = awcs.utils.proj_plane_pixel_scales(w)
+
+    return height * scale_y, width * scale_x
+
+
+def index_files(index_dir: Path | str, irng: tuple[int, int]) -> list[Path]:
+    """
+    4100 and 4200 series index files in index_dir for scales irng (inclusive),
+    including the HEALPix-split files of the small 4200 scales (index-4205-00.fits etc.)
+    """
+
+    index_dir = Path(index_dir).expanduser()
+
+    files: list[Path] = []
+    for i in range(irng[0], irng[1] + 1):
+        for series in (41, 42):
+            files += sorted(index_dir.glob(f"index-{series}{i:02d}.fits"))
+            files += sorted(index_dir.glob(f"index-{series}{i:02d}-*.fits"))
+
+    return files
+
+
+def system_config(exe: str | None = None) -> Path | None:
+    """
+    astrometry.cfg that solve-field reads without --config, if found:
+    next to the solve-field installation, else the usual system locations
+    """
+
+    candidates = [Path("/etc/astrometry.cfg"), Path("/usr/local/etc/astrometry.cfg")]
+    if exe is not None:
+        candidates.insert(0, Path(exe).resolve().parent.parent / "etc" / "astrometry.cfg")
+
+    for fn in candidates:
+        if fn.is_file():
+            return fn
+
+    return None
+
+
+def write_config(files: list[Path], cfgfn: Path, base: Path | None = None) -> Path:
+    """
+    write solve-field configuration that loads only these index files
+
+    --config replaces the system configuration, so its other settings
+    (inparallel, cpulimit, minwidth, add_path, ...) are copied from base,
+    dropping only its index and autoindex lines.
+    Without base, inparallel is set as recommended in the README.
+    """
+
+    cfgfn = Path(cfgfn).expanduser()
+
+    if base is not None:
+        base = Path(base).expanduser()
+        lines = [f"# settings from {base}"]
+        for line in base.read_text().splitlines():
+            words = line.split()
+            if not words or words[0] not in {"index", "autoindex"}:
+                lines.append(line)
+    else:
+        lines = ["inparallel"]
+
+    lines += ["# index files selected by astrometry_azel.index"]
+    lines += [f"index {Path(f).resolve()}" for f in files]
+    cfgfn.write_text("\n".join(lines) + "\n")
+
+    return cfgfn
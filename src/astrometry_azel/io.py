@@ -9,7 +9,10 @@ Averaging a selected stack of images improves SNR for astrometry.net
 from pathlib import Path
 import numpy as np
 from datetime import datetime
+from collections.abc import Hashable
+from typing import Any
 import logging
+import time
 
 from astropy.io import fits
 import xarray
@@ -58,7 +61,19 @@ def rgb2grey(rgb_img):
 
 
 def read_data(in_file: Path):
-    img = xarray.open_dataset(in_file)
+    """
+    read plate scale from netCDF (.nc) or Zarr (.zarr) with the original image
+
+    Variables are read lazily, so slicing a Zarr store decompresses only the chunks needed.
+    """
+
+    in_file = Path(in_file).expanduser()
+
+    if in_file.suffix == ".zarr":
+        # write_zarr() does not consolidate metadata
+        img = xarray.open_dataset(in_file, engine="zarr", consolidated=False)
+    else:
+        img = xarray.open_dataset(in_file)
     img["image"] = (("y", "x"), load_image(img.filename))
 
     return img
@@ -89,8 +104,21 @@ def load_image(file: Path):
 
 
 def meanstack(
-    infn: Path, Navg: slice | int, ut1: datetime | None = None, method: str = "mean"
+    infn: Path,
+    Navg: slice | int,
+    ut1: datetime | None = None,
+    method: str = "mean",
+    max_bytes: int = 2**28,
+    sigma: float = 3.0,
 ) -> tuple:
+    """
+    collapse selected frames of an image stack to one frame
+
+    method: "mean", "median", "sigmaclip" or "winsorized", see collapsestack()
+    max_bytes: approximate peak working memory, independent of the number of frames.
+    sigma: clipping threshold (standard deviations) for "sigmaclip" and "winsorized"
+    """
+
     infn = Path(infn).expanduser().resolve(strict=True)
 
     # %% parse indicies to load
@@ -110,31 +138,34 @@ def meanstack(
     """
     match infn.suffix:
         case ".h5":
-            img, ut1 = _h5mean(infn, ut1, key, method)
-        case ".fits", ".new":
-            # mmap doesn't work with BZERO/BSCALE/BLANK
+            img, ut1 = _h5mean(infn, ut1, key, method, max_bytes, sigma)
+        case ".fits" | ".new":
+            # mmap doesn't work with BZERO/BSCALE/BLANK, .section reads only the frames requested
             with fits.open(infn, mode="readonly", memmap=False) as f:
-                img = collapsestack(f[0].data, key, method)
+                img = collapsestack(f[0].section, key, method, max_bytes, sigma)
         case ".mat":
             from scipy.io import loadmat
 
             img = loadmat(infn)
-            img = collapsestack(img["data"].T, key, method)  # matlab is fortran order
+            # matlab is fortran order
+            img = collapsestack(img["data"].T, key, method, max_bytes, sigma)
         case _:  # .tif etc.
             import imageio.v3 as iio
 
             img = iio.imread(infn, as_gray=True)
             if img.ndim in {3, 4} and img.shape[-1] == 3:  # assume RGB
-                img = collapsestack(img, key, method)
+                img = collapsestack(img, key, method, max_bytes, sigma)
 
     return img, ut1
 
 
-def _h5mean(fn: Path, ut1: datetime | None, key: slice, method: str) -> tuple:
+def _h5mean(
+    fn: Path, ut1: datetime | None, key: slice, method: str, max_bytes: int, sigma: float
+) -> tuple:
     import h5py
 
     with h5py.File(fn, "r") as f:
-        img = collapsestack(f["/rawimg"], key, method)
+        img = collapsestack(f["/rawimg"], key, method, max_bytes, sigma)
         # %% time
         if ut1 is None:
             try:
@@ -150,47 +181,435 @@ def _h5mean(fn: Path, ut1: datetime | None, key: slice, method: str) -> tuple:
     return img, ut1
 
 
-def collapsestack(img, key: slice, method: str):
-    if img.ndim not in {2, 3, 4}:
+def collapsestack(img, key: slice, method: str, max_bytes: int = 2**28, sigma: float = 3.0):
+    """
+    collapse frames img[key] along the first axis.
+
+    img may be a NumPy array, h5py.Dataset or astropy.io.fits Section:
+    frames are read in blocks of about max_bytes, so peak memory does not depend
+    on the number of frames. The mean is accumulated in float64.
+    The median is exact if the frames fit in max_bytes, otherwise it is found by bisection
+    with one pass over the frames per step: exact for integer images, and within
+    (max - min) / 2**32 for float images.
+
+    "sigmaclip" and "winsorized" reject satellites, meteors and other transients
+    in three streaming passes: the per-pixel mean and standard deviation are computed by
+    merging Welford statistics of each block, then recomputed without values beyond
+    sigma standard deviations, then values within mean +/- sigma * std are averaged
+    ("sigmaclip"), or values clipped to that range are averaged ("winsorized").
+    """
+
+    ndim = len(img.shape)
+    if ndim not in {2, 3, 4}:
         raise ValueError("only 2D, 3D, or 4D image stacks are handled")
 
     # %% 2-D
-    if img.ndim == 2:
-        return img
+    if ndim == 2:
+        return np.asarray(img[:])
     # %% 3-D
+    start, stop, step = key.indices(img.shape[0])
+    if len(range(start, stop, step)) == 0:
+        raise ValueError(f"no frames selected by {key}")
+    dtype = np.asarray(img[start : start + 1]).dtype
+
     match method:
         case "mean":
-            func = np.mean
+            colaps = _stream_mean(img, key, max_bytes)
         case "median":
-            func = np.median
+            colaps = _stream_median(img, key, max_bytes, np.issubdtype(dtype, np.integer))
+        case "sigmaclip" | "winsorized":
+            colaps = _stream_clip(img, key, max_bytes, sigma, method == "winsorized")
         case _:
             raise TypeError(f"unknown method {method}")
 
-    colaps = func(img[key, ...], axis=0).astype(img.dtype)
+    colaps = colaps.astype(dtype)
     assert colaps.ndim > 0
     assert isinstance(colaps, np.ndarray)
 
     return colaps
 
 
-def write_netcdf(ds: xarray.Dataset, out_file: Path) -> None:
+def iter_frames(img, key: slice, max_bytes: int):
+    """
+    yield blocks of frames img[key] of about max_bytes as float64, at least one frame per block,
+    in the order of key, which may have a negative step.
+    For HDF5 datasets, contiguous blocks are aligned to the chunk layout of the first axis
+    so each chunk is read once.
+    """
+
+    start, stop, step = key.indices(img.shape[0])
+
+    frame_bytes = 8 * int(np.prod(img.shape[1:]))
+    N = max(1, max_bytes // frame_bytes)
+
+    if step < 0:
+        # h5py and FITS sections only read forward: read each block forward and reverse it
+        idx = range(start, stop, step)
+        for k in range(0, len(idx), N):
+            b = idx[k : k + N]
+            yield np.asarray(img[b[-1] : b[0] + 1 : -step], dtype=np.float64)[::-1]
+        return
+
+    chunks = getattr(img, "chunks", None)
+    if step == 1 and chunks and N >= chunks[0]:
+        N -= N % chunks[0]
+        edges = [start, *range((start // N + 1) * N, stop, N), stop]
+    else:
+        edges = [*range(start, stop, N * step), stop]
+
+    for i, j in zip(edges[:-1], edges[1:]):
+        if i < j:
+            yield np.asarray(img[i:j:step], dtype=np.float64)
+
+
+def _stream_mean(img, key: slice, max_bytes: int):
+    total = np.zeros(img.shape[1:])
+    N = 0
+    for block in iter_frames(img, key, max_bytes):
+        total += block.sum(axis=0)
+        N += block.shape[0]
+
+    return total / N
+
+
+def _stream_stats(img, key: slice, max_bytes: int, lo=None, hi=None) -> tuple:
+    """
+    per-pixel count, mean and standard deviation of values in [lo, hi] in one pass,
+    merging the statistics of each block (Chan et al. parallel Welford algorithm)
+    """
+
+    N = np.zeros(img.shape[1:])
+    mean = np.zeros(img.shape[1:])
+    M2 = np.zeros(img.shape[1:])
+
+    for block in iter_frames(img, key, max_bytes):
+        if lo is None:
+            keep = np.ones(block.shape, dtype=bool)
+        else:
+            keep = (block >= lo) & (block <= hi)
+
+        n = keep.sum(axis=0)
+        block_mean = np.divide(
+            np.where(keep, block, 0).sum(axis=0), n, out=np.zeros(n.shape), where=n > 0
+        )
+        block_M2 = np.where(keep, (block - block_mean) ** 2, 0).sum(axis=0)
+
+        total = np.maximum(N + n, 1)
+        delta = block_mean - mean
+        mean += delta * n / total
+        M2 += block_M2 + delta**2 * N * n / total
+        N += n
+
+    return N, mean, np.sqrt(M2 / np.maximum(N, 1))
+
+
+def _stream_clip(
+    img, key: slice, max_bytes: int, sigma: float, winsorize: bool, iterations: int = 2
+):
+    N, mean, std = _stream_stats(img, key, max_bytes)
+    for _ in range(iterations - 1):
+        # statistics without the outliers of the previous pass
+        N, mean, std = _stream_stats(img, key, max_bytes, mean - sigma * std, mean + sigma * std)
+
+    lo = mean - sigma * std
+    hi = mean + sigma * std
+
+    total = np.zeros(img.shape[1:])
+    count = np.zeros(img.shape[1:], dtype=np.int64)
+    for block in iter_frames(img, key, max_bytes):
+        if winsorize:
+            total += np.clip(block, lo, hi).sum(axis=0)
+            count += block.shape[0]
+        else:
+            keep = (block >= lo) & (block <= hi)
+            total += np.where(keep, block, 0).sum(axis=0)
+            count += keep.sum(axis=0)
+
+    # all values can be rejected only if sigma is tiny
+    return np.divide(total, count, out=mean.copy(), where=count > 0)
+
+
+def _stream_median(img, key: slice, max_bytes: int, integer: bool, passes: int = 32):
+    N = len(range(*key.indices(img.shape[0])))
+
+    if N * 8 * np.prod(img.shape[1:]) <= max_bytes:
+        # one block, read as iter_frames() does for any key step
+        return np.median(np.concatenate(list(iter_frames(img, key, max_bytes))), axis=0)
+
+    # %% bisection for the lower and upper middle order statistics
+    lo = np.full(img.shape[1:], np.inf)
+    hi = np.full(img.shape[1:], -np.inf)
+    for block in iter_frames(img, key, max_bytes):
+        lo = np.minimum(lo, block.min(axis=0))
+        hi = np.maximum(hi, block.max(axis=0))
+
+    # rank (1-based) of the two middle values: equal for odd N
+    ranks = ((N + 1) // 2, N // 2 + 1)
+    bounds = [(lo.copy(), hi.copy()) for _ in ranks]
+
+    for _ in range(64 if integer else passes):
+        if all((a >= b).all() for a, b in bounds):
+            break
+
+        mids = [np.floor((a + b) / 2) if integer else (a + b) / 2 for a, b in bounds]
+        counts = [np.zeros(img.shape[1:], dtype=np.int64) for _ in ranks]
+        for block in iter_frames(img, key, max_bytes):
+            for c, m in zip(counts, mids):
+                c += (block <= m).sum(axis=0)
+
+        for (a, b), m, c, r in zip(bounds, mids, counts, ranks):
+            found = c >= r
+            b[found] = m[found]
+            a[~found] = (m + 1 if integer else m)[~found]
+
+    return (bounds[0][1] + bounds[1][1]) / 2
+
+
+# netCDF4 module attribute flagging library support, None if always built in
+NETCDF_CODECS: dict[str, str | None] = {
+    "zlib": None,
+    "zstd": "__has_zstandard_support__",
+    "bzip2": "__has_bzip2_support__",
+    "blosc_lz4": "__has_blosc_support__",
+    "blosc_zstd": "__has_blosc_support__",
+}
+
+
+def netcdf_codec(codec: str = "zlib") -> str:
+    """
+    netCDF4 compression filter, falling back to zlib if the netCDF library was built without it
+
+    codec: "zlib", "zstd", "bzip2", "blosc_lz4", "blosc_zstd", or "auto" for the fastest available
+    """
+
+    import netCDF4
+
+    if codec == "auto":
+        for c in ("zstd", "blosc_zstd"):
+            if (flag := NETCDF_CODECS[c]) is not None and getattr(netCDF4, flag, False):
+                return c
+        return "zlib"
+
+    if codec not in NETCDF_CODECS:
+        raise ValueError(f"unknown codec {codec}")
+
+    if (flag := NETCDF_CODECS[codec]) is not None and not getattr(netCDF4, flag, False):
+        logging.warning(f"netCDF4 library lacks {codec}, using zlib")
+        return "zlib"
+
+    return codec
+
+
+def chunk_shape(dims, shape, itemsize: int, access: str = "frame") -> tuple[int, ...]:
+    """
+    chunk shape for the expected read pattern
+
+    access:
+        "frame": one chunk per time step (or altitude) holding the whole image, up to 16 MiB
+        "rows": full-width strips of about 64 kiB, for reading a few rows at a time
+        "time": all times of a small spatial tile in one chunk of about 1 MiB,
+                for reading the time series of a few pixels
+    """
+
+    size = dict(zip(dims, shape))
+    chunk = dict(size)
+
+    match access:
+        case "frame":
+            budget = 2**24
+        case "rows":
+            budget = 2**16
+        case "time":
+            budget = 2**20
+        case _:
+            raise ValueError(f"unknown access pattern {access}")
+
+    if access == "time":
+        nt = size.get("time", 1)
+        side = max(1, int(np.sqrt(budget / (itemsize * nt))))
+        for d in dims:
+            if d != "time":
+                chunk[d] = min(size[d], side)
+    else:
+        for d in ("time", "altitude"):
+            if d in chunk:
+                chunk[d] = 1
+        for d in dims:
+            rest = itemsize * int(np.prod([chunk[e] for e in dims if e != d]))
+            chunk[d] = max(1, min(chunk[d], budget // max(1, rest)))
+
+    # netCDF chunks must be at least 1, even for zero-length dimensions
+    return tuple(max(1, chunk[d]) for d in dims)
+
+
+def write_netcdf(
+    ds: xarray.Dataset,
+    out_file: Path,
+    dtype=None,
+    *,
+    access: str = "frame",
+    codec: str = "zlib",
+    complevel: int = 3,
+    least_significant_digit: dict[str, int] | None = None,
+    significant_digits: dict[str, int] | None = None,
+    quantize_mode: str = "GranularBitRound",
+) -> None:
+    """
+    write Dataset to compressed netCDF4
+
+    dtype: if given, floating point variables of 2 or more dimensions are stored
+    as this type, e.g. numpy.float32 to halve file size
+
+    access: expected read pattern, sets the chunk shape, see chunk_shape()
+
+    codec: compression filter, see netcdf_codec()
+
+    least_significant_digit: per-variable number of decimal places to keep,
+    e.g. {"azimuth": 3, "elevation": 3} for 0.001 degree. Truncated values compress much better.
+
+    significant_digits: per-variable number of significant digits to keep, using
+    netCDF quantization with quantize_mode ("BitGroom", "GranularBitRound" or "BitRound")
+    """
+
+    codec = netcdf_codec(codec)
+
     enc = {}
 
-    for k in ds.data_vars:
+    for k in ds.variables:
         if ds[k].ndim < 2:
             continue
 
+        v_dtype = ds[k].dtype
+        if dtype is not None and np.issubdtype(v_dtype, np.floating):
+            v_dtype = np.dtype(dtype)
+
         enc[k] = {
-            "zlib": True,
-            "complevel": 3,
+            "compression": codec,
+            "complevel": complevel,
             "fletcher32": True,
-            "chunksizes": tuple(map(lambda x: x // 2, ds[k].shape)),
-            # arbitrary, little impact on compression
+            "chunksizes": chunk_shape(ds[k].dims, ds[k].shape, v_dtype.itemsize, access),
         }
+        if v_dtype != ds[k].dtype:
+            enc[k]["dtype"] = v_dtype
+        if least_significant_digit and k in least_significant_digit:
+            enc[k]["least_significant_digit"] = least_significant_digit[k]
+        if significant_digits and k in significant_digits:
+            enc[k]["significant_digits"] = significant_digits[k]
+            enc[k]["quantize_mode"] = quantize_mode
 
     ds.to_netcdf(out_file, format="NETCDF4", engine="netcdf4", encoding=enc)
 
 
+def benchmark_netcdf(ds: xarray.Dataset, out_file: Path, **kwargs) -> dict[str, float]:
+    """
+    write Dataset with write_netcdf(**kwargs) and report write time and file size
+
+    Returns
+    -------
+    stats: dict
+        seconds: write time
+        bytes: file size
+        ratio: in-memory size / file size
+    """
+
+    out_file = Path(out_file).expanduser()
+
+    tic = time.perf_counter()
+    write_netcdf(ds, out_file, **kwargs)
+    seconds = time.perf_counter() - tic
+
+    size = out_file.stat().st_size
+
+    stats = {"seconds": seconds, "bytes": size, "ratio": ds.nbytes / size}
+
+    print(
+        f"{out_file.name}: {kwargs}  {seconds:.3f} s  {size / 1e6:.2f} MB  ratio {stats['ratio']:.1f}"
+    )
+
+    return stats
+
+
+def write_zarr(
+    ds: xarray.Dataset,
+    out_dir: Path,
+    *,
+    chunks: dict[Hashable, int] | None = None,
+    codec: str | None = "blosc",
+    clevel: int = 3,
+    append_dim: str | None = None,
+    dtype=None,
+) -> None:
+    """
+    write Dataset to a compressed Zarr store.
+
+    Each chunk is a separate object, so Dask-backed variables (e.g. from fits2radec(chunks=))
+    are written in parallel, and readers decompress only the chunks they slice.
+
+    Parameters
+    ----------
+    ds: xarray.Dataset
+        data to write
+    out_dir: pathlib.Path
+        Zarr store directory, conventionally ending in .zarr
+    chunks: dict, optional
+        chunk size per dimension name, default is the whole dimension,
+        except 1 for "time" so each time step is a chunk.
+    codec: str, optional
+        "blosc" (Blosc with zstd and byte shuffle), "zstd", or None for no compression
+    clevel: int
+        compression level
+    append_dim: str, optional
+        append along this dimension (e.g. "time") to an existing store,
+        for writing time series incrementally. Chunking and codec are those of the existing store.
+    dtype: optional
+        if given, floating point variables of 2 or more dimensions are stored as this type
+    """
+
+    import zarr.codecs
+
+    out_dir = Path(out_dir).expanduser()
+
+    if append_dim is not None and out_dir.is_dir():
+        ds.to_zarr(out_dir, mode="a", append_dim=append_dim, consolidated=False)
+        return
+
+    match codec:
+        case "blosc":
+            compressors = (zarr.codecs.BloscCodec(cname="zstd", clevel=clevel, shuffle="shuffle"),)
+        case "zstd":
+            compressors = (zarr.codecs.ZstdCodec(level=clevel),)
+        case None:
+            compressors = None
+        case _:
+            raise ValueError(f"unknown codec {codec}")
+
+    chunks = {"time": 1} | (chunks or {})
+
+    ds = ds.copy()
+    enc: dict[Hashable, dict[str, Any]] = {}
+    if "time" in ds.coords and np.issubdtype(ds["time"].dtype, np.datetime64):
+        # fixed units so appended times of any resolution encode exactly
+        enc["time"] = {"units": "microseconds since 1970-01-01", "dtype": np.int64}
+
+    for k in ds.data_vars:
+        v = ds[k]
+        if v.ndim < 2:
+            continue
+
+        enc[k] = {
+            "compressors": compressors,
+            "chunks": tuple(min(chunks.get(d, n), n) for d, n in zip(v.dims, v.shape)),
+        }
+        if dtype is not None and np.issubdtype(v.dtype, np.floating):
+            enc[k]["dtype"] = np.dtype(dtype)
+
+        if v.chunks is not None:
+            # Dask chunks must not straddle Zarr chunks for parallel writes
+            ds[k] = v.chunk(dict(zip(v.dims, enc[k]["chunks"])))
+
+    ds.to_zarr(out_dir, mode="w", encoding=enc, zarr_format=3, consolidated=False)
+
+
 def write_fits(img, outfn: Path) -> None:
     f = fits.PrimaryHDU(img)
 
@@ -0,0 +1,165 @@
+"""
+inverse lookup: viewing direction or sky coordinate -> pixel
+
+Built once per camera calibration (the Dataset from fits2azel or plate_scale),
+a PixelIndex answers batched queries without scanning the azimuth/elevation grids:
+a KD-tree on the pixel East, North, Up unit vectors finds the nearest pixel,
+then Gauss-Newton iterations on the bilinear interpolant of the grid give sub-pixel x, y.
+RA/Dec queries use the analytic WCS inverse (all_world2pix).
+"""
+
+from pathlib import Path
+import pickle
+
+import numpy as np
+import xarray
+
+from . import find_wcs, read_wcs
+from .sky import azel2enu
+
+
+class PixelIndex:
+    """
+    pixel lookup for one camera calibration, from the Dataset of fits2azel()
+    """
+
+    def __init__(self, scale: xarray.Dataset):
+        from scipy.spatial import cKDTree
+
+        self.enu = azel2enu(
+            scale["azimuth"].values.astype(np.float64), scale["elevation"].values.astype(np.float64)
+        )
+        self.shape = self.enu.shape[:2]
+        self.tree = cKDTree(self.enu.reshape(-1, 3))
+
+        self.observer = (scale["observer_latitude"].item(), scale["observer_longitude"].item())
+
+        # queries farther than this from every pixel are outside the field of view
+        self.max_chord = 2 * pixel_chord(self.enu)
+
+        try:
+            self.wcs = read_wcs(find_wcs(Path(scale.filename)))
+        except (AttributeError, FileNotFoundError):
+            self.wcs = None
+
+    def azel2pix(self, az_deg, el_deg, iterations: int = 3) -> tuple:
+        """
+        fractional pixel x, y viewing azimuth, elevation (degrees).
+        NaN outside the field of view.
+        """
+
+        az_deg = np.asarray(az_deg, dtype=np.float64)
+        target = azel2enu(az_deg, el_deg).reshape(-1, 3)
+
+        dist, i = self.tree.query(target)
+
+        y, x = np.unravel_index(i, self.shape)
+        x, y = refine_pixel(self.enu, x, y, target, iterations)
+
+        outside = dist > self.max_chord
+        x[outside] = np.nan
+        y[outside] = np.nan
+
+        return x.reshape(az_deg.shape), y.reshape(az_deg.shape)
+
+    def geodetic2pix(self, lat_deg, lon_deg, alt_m, observer_altitude_m: float = 0.0) -> tuple:
+        """
+        fractional pixel x, y viewing a point at geodetic latitude, longitude (degrees), altitude (meters)
+        """
+
+        import pymap3d
+
+        az, el, _ = pymap3d.geodetic2aer(
+            lat_deg, lon_deg, alt_m, *self.observer, observer_altitude_m
+        )
+
+        return self.azel2pix(az, el)
+
+    def radec2pix(self, ra_deg, dec_deg) -> tuple:
+        """
+        fractional pixel x, y of right ascension, declination (degrees) by the WCS inverse
+        """
+
+        if self.wcs is None:
+            raise FileNotFoundError("no WCS file found for this calibration")
+
+        return self.wcs.all_world2pix(ra_deg, dec_deg, 0)
+
+    def save(self, fn: Path) -> None:
+        """
+        save the built index, so it need not be rebuilt for each session
+        """
+
+        with Path(fn).expanduser().open("wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(fn: Path) -> "PixelIndex":
+        """
+        load an index written by save(). Only load trusted files, as with any pickle.
+        """
+
+        with Path(fn).expanduser().open("rb") as f:
+            return pickle.load(f)
+
+
+def pixel_chord(grid) -> float:
+    """
+    typical distance between adjacent pixels of a (y, x, 3) vector grid. NaN pixels are ignored.
+    """
+
+    return max(
+        np.nanmedian(np.linalg.norm(np.diff(grid, axis=0), axis=-1)),
+        np.nanmedian(np.linalg.norm(np.diff(grid, axis=1), axis=-1)),
+    )
+
+
+def refine_pixel(grid, x, y, target, iterations: int = 3) -> tuple:
+    """
+    fractional pixel x, y where the bilinear interpolant of a (y, x, 3) vector grid
+    best matches target (N, 3), by Gauss-Newton iterations starting from pixel x, y
+    """
+
+    ny, nx = grid.shape[:2]
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    for _ in range(iterations):
+        v, dx, dy = bilinear(grid, x, y)
+        r = target - v
+        # 2x2 normal equations of the least squares step, per query
+        a = (dx * dx).sum(axis=1)
+        b = (dx * dy).sum(axis=1)
+        c = (dy * dy).sum(axis=1)
+        p = (dx * r).sum(axis=1)
+        q = (dy * r).sum(axis=1)
+        det = a * c - b * b
+        x = np.clip(x + (c * p - b * q) / det, 0, nx - 1)
+        y = np.clip(y + (a * q - b * p) / det, 0, ny - 1)
+
+    return x, y
+
+
+def bilinear(grid, x, y) -> tuple:
+    """
+    bilinear interpolant of a (y, x, 3) vector grid and its x, y derivatives
+    """
+
+    ny, nx = grid.shape[:2]
+    x0 = np.clip(np.floor(x).astype(int), 0, max(nx - 2, 0))
+    y0 = np.clip(np.floor(y).astype(int), 0, max(ny - 2, 0))
+    x1 = np.minimum(x0 + 1, nx - 1)
+    y1 = np.minimum(y0 + 1, ny - 1)
+    fx = (x - x0)[:, None]
+    fy = (y - y0)[:, None]
+
+    v00 = grid[y0, x0]
+    v01 = grid[y0, x1]
+    v10 = grid[y1, x0]
+    v11 = grid[y1, x1]
+
+    v = (1 - fy) * ((1 - fx) * v00 + fx * v01) + fy * ((1 - fx) * v10 + fx * v11)
+    dx = (1 - fy) * (v01 - v00) + fy * (v11 - v10)
+    dy = (1 - fx) * (v10 - v00) + fx * (v11 - v01)
+
+    return v, dx, dy
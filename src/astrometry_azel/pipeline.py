@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+geoproject a long frame sequence from a fixed camera onto a regular lat/lon grid
+
+    python -m astrometry_azel.pipeline cal.nc night1.h5 night1_110km.zarr 110 --lat 60 70 201 --lon -160 -135 251 -j 4
+
+One camera calibration (.nc from python -m astrometry_azel) gives the regridding matrix,
+built once (see regrid.regrid_operator). Frames are read in blocks by a prefetch thread,
+regridded on a pool of worker threads, and written in order, so memory is bounded by
+the block size and number of blocks in flight, not by the number of frames.
+Zarr output (.zarr) is appended block by block; netCDF output is held in memory
+(only the projected grids) and written at the end.
+"""
+
+from pathlib import Path
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from contextlib import closing
+import queue
+import threading
+
+import numpy as np
+import xarray
+
+from .io import iter_frames, write_netcdf, write_zarr
+from .project import image_altitude
+from .regrid import apply_regrid, regrid_operator
+
+
+def read_blocks(fn: Path, key: slice, max_bytes: int):
+    """
+    yield (frames, times) blocks of an HDF5 /rawimg or FITS image stack.
+    times are datetime64 from HDF5 /ut1_unix, else frame indices.
+    """
+
+    fn = Path(fn).expanduser()
+
+    if fn.suffix == ".h5":
+        import h5py
+
+        with h5py.File(fn, "r") as f:
+            img = f["/rawimg"]
+            idx = np.arange(*key.indices(img.shape[0]))
+            try:
+                t = f["/ut1_unix"][:][idx]
+                times = (t * 1e6).astype("datetime64[us]")
+            except KeyError:
+                times = idx
+            try:
+                k = int(f["/params"]["rotccw"])
+            except KeyError:
+                k = 0
+
+            i = 0
+            for block in iter_frames(img, key, max_bytes):
+                # same orientation as io.meanstack, which the calibration image came from
+                yield np.rot90(block, k=k, axes=(1, 2)), times[i : i + block.shape[0]]
+                i += block.shape[0]
+    else:
+        from astropy.io import fits
+
+        with fits.open(fn, mode="readonly", memmap=False) as f:
+            img = f[0].section
+            times = np.arange(*key.indices(f[0].shape[0]))
+
+            i = 0
+            for block in iter_frames(img, key, max_bytes):
+                yield block, times[i : i + block.shape[0]]
+                i += block.shape[0]
+
+
+def _prefetch(blocks, depth: int):
+    """
+    run a generator in a background thread, at most depth items ahead.
+    If the consumer stops early (exception or close()), the thread stops
+    and closes blocks, releasing its open files.
+    """
+
+    q: queue.Queue = queue.Queue(maxsize=depth)
+    done = object()
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        # False once the consumer has stopped
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for b in blocks:
+                if not put(b):
+                    break
+            else:
+                put(done)
+        except Exception as e:
+            put(e)
+        finally:
+            blocks.close()
+
+    t = threading.Thread(target=produce, daemon=True)
+    t.start()
+
+    try:
+        while (item := q.get()) is not done:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        t.join()
+
+
+def geoproject_frames(
+    calibration: Path,
+    frames_file: Path,
+    out_file: Path,
+    projection_altitude_km: float,
+    lat,
+    lon,
+    *,
+    observer_altitude_m: float = 0.0,
+    method: str = "bilinear",
+    minimum_elevation: float = 0.0,
+    key: slice = slice(None),
+    max_bytes: int = 2**26,
+    workers: int = 1,
+    prefetch: int = 2,
+    cache_dir: Path | None = None,
+) -> Path:
+    """
+    project every frame of frames_file to projection_altitude_km on the lat, lon grid
+
+    Parameters
+    ----------
+    calibration: pathlib.Path
+        netCDF plate scale of this camera from python -m astrometry_azel
+    frames_file: pathlib.Path
+        HDF5 (/rawimg) or FITS image stack
+    out_file: pathlib.Path
+        .zarr (appended as frames are projected) or .nc
+    lat, lon: numpy.ndarray
+        ascending grid centers (degrees)
+    method, minimum_elevation, cache_dir:
+        see regrid.regrid_operator()
+    key: slice
+        frames to project
+    max_bytes: int
+        approximate size of each block of frames read
+    workers: int
+        threads regridding blocks
+    prefetch: int
+        blocks read ahead of the workers
+
+    Returns
+    -------
+    out_file: pathlib.Path
+    """
+
+    out_file = Path(out_file).expanduser()
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+
+    with xarray.open_dataset(calibration) as cal:
+        cal = image_altitude(cal.load(), projection_altitude_km, observer_altitude_m)
+
+    M = regrid_operator(
+        cal, lat, lon, method=method, minimum_elevation=minimum_elevation, cache_dir=cache_dir
+    )
+
+    def regrid(block, times) -> xarray.Dataset:
+        ds = apply_regrid(M, block, lat, lon).assign_coords(time=times).to_dataset(name="image")
+        ds["image"].attrs["projection_altitude_km"] = projection_altitude_km
+        ds["observer_latitude"] = cal["observer_latitude"]
+        ds["observer_longitude"] = cal["observer_longitude"]
+        return ds
+
+    if out_file.suffix == ".zarr" and out_file.exists():
+        import shutil
+
+        shutil.rmtree(out_file)
+
+    parts = []
+    pending: deque = deque()
+
+    def write(ds: xarray.Dataset) -> None:
+        if out_file.suffix == ".zarr":
+            write_zarr(ds, out_file, append_dim="time", chunks={"time": ds.sizes["time"]})
+        else:
+            parts.append(ds)
+
+    blocks = _prefetch(read_blocks(frames_file, key, max_bytes), prefetch)
+    with ThreadPoolExecutor(max_workers=workers) as pool, closing(blocks):
+        for block, times in blocks:
+            pending.append(pool.submit(regrid, block, times))
+            # bounded number of blocks in flight, written in frame order
+            while len(pending) > workers:
+                write(pending.popleft().result())
+
+        while pending:
+            write(pending.popleft().result())
+
+    if out_file.suffix != ".zarr":
+        ds = xarray.concat(parts, dim="time", data_vars="minimal")
+        write_netcdf(ds, out_file, access="time")
+
+    print("wrote", out_file)
+
+    return out_file
+
+
+if __name__ == "__main__":
+    p = ArgumentParser(description="geoproject a frame sequence from a fixed camera")
+    p.add_argument("calibration", help="netCDF from python -m astrometry_azel")
+    p.add_argument("frames", help="HDF5 or FITS image stack")
+    p.add_argument("out_file", help="output .zarr or .nc")
+    p.add_argument("projection_altitude_km", type=float, help="altitude of emission (kilometers)")
+    p.add_argument(
+        "--lat", help="latitude grid: start stop number", nargs=3, type=float, required=True
+    )
+    p.add_argument(
+        "--lon", help="longitude grid: start stop number", nargs=3, type=float, required=True
+    )
+    p.add_argument("-m", "--method", choices=["nearest", "bilinear", "area"], default="bilinear")
+    p.add_argument(
+        "-minel", "--minimum_elevation", type=float, default=0.0, help="minimum elevation (degrees)"
+    )
+    p.add_argument(
+        "-obsalt",
+        "--observer_altitude_m",
+        type=float,
+        help="altitude of observer (meters)",
+        default=0.0,
+    )
+    p.add_argument("-j", "--workers", help="regridding threads", type=int, default=1)
+    p.add_argument("--cache-dir", help="directory to cache regridding matrices")
+    P = p.parse_args()
+
+    geoproject_frames(
+        P.calibration,
+        P.frames,
+        P.out_file,
+        P.projection_altitude_km,
+        np.linspace(P.lat[0], P.lat[1], int(P.lat[2])),
+        np.linspace(P.lon[0], P.lon[1], int(P.lon[2])),
+        observer_altitude_m=P.observer_altitude_m,
+        method=P.method,
+        minimum_elevation=P.minimum_elevation,
+        workers=P.workers,
+        cache_dir=P.cache_dir,
+    )
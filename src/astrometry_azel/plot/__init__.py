@@ -1,23 +1,73 @@
 from pathlib import Path
 import logging
 
-import numpy as np
 from astropy.io import fits
 from astropy.wcs import wcs
 
 import matplotlib.pyplot as plt
 from matplotlib.colors import LogNorm
 
+from .. import pix2world_tiled
 
-def az_el(scale, plottype: str = "singlecontour", img=None):
+
+def decimate(scale, img=None, max_points: int | None = 1000) -> tuple:
+    """
+    subsample coordinate grids to at most max_points along each axis.
+    The fields are smooth, so contours at figure resolution look the same, and are
+    much faster to draw on large frames. x, y remain full-resolution pixel indices.
+    The image is kept at full resolution, so stars and fine features are not lost.
+
+    Returns
+    -------
+    scale: xarray.Dataset
+        decimated
+    img: numpy.ndarray
+        unchanged
+    extent: tuple
+        for imshow() of the image in full-resolution pixel coordinates
+    """
+
+    ny, nx = scale.sizes["y"], scale.sizes["x"]
+    extent = (-0.5, nx - 0.5, -0.5, ny - 0.5)
+
+    if max_points is None or max(ny, nx) <= max_points:
+        return scale, img, extent
+
+    step = -(-max(ny, nx) // max_points)
+
+    scale = scale.isel(y=slice(None, None, step), x=slice(None, None, step))
+
+    return scale, img, extent
+
+
+def _grid_extent(scale) -> tuple:
+    """
+    imshow() extent of a (possibly decimated) grid in full-resolution pixel coordinates
+    """
+
+    x = scale["x"].values
+    y = scale["y"].values
+    dx = (x[1] - x[0]) / 2 if x.size > 1 else 0.5
+    dy = (y[1] - y[0]) / 2 if y.size > 1 else 0.5
+
+    return (x[0] - dx, x[-1] + dx, y[0] - dy, y[-1] + dy)
+
+
+def az_el(scale, plottype: str = "singlecontour", img=None, max_points: int | None = 1000):
     """
     plot azimuth and elevation mapped to sky
+
+    max_points: decimate grids to at most this many points per axis before plotting,
+    None for full resolution
     """
+
+    scale, img, extent = decimate(scale, img, max_points)
+
     match plottype:
         case "singlecontour":
             fg, ax = plt.subplots(layout="constrained")
             if img is not None:
-                ax.imshow(img, origin="lower", cmap="gray")
+                ax.imshow(img, origin="lower", extent=extent, cmap="gray")
             cs = ax.contour(scale["x"], scale["y"], scale["azimuth"])
             ax.clabel(cs, inline=1, fmt="%0.1f")
             cs = ax.contour(scale["x"], scale["y"], scale["elevation"])
@@ -33,13 +83,13 @@ def az_el(scale, plottype: str = "singlecontour", img=None):
             return fg
         case "image":
             fg, ax = plt.subplots(1, 2, figsize=(12, 5), layout="constrained")
-            hia = ax[0].imshow(scale["azimuth"], origin="lower")
+            hia = ax[0].imshow(scale["azimuth"], origin="lower", extent=_grid_extent(scale))
             hc = fg.colorbar(hia)
             hc.set_label("Azimuth [deg]")
         case "contour":
             fg, ax = plt.subplots(1, 2, figsize=(12, 5), sharey=True, layout="constrained")
             if img is not None:
-                ax[0].imshow(img, origin="lower", cmap="gray")
+                ax[0].imshow(img, origin="lower", extent=extent, cmap="gray")
             cs = ax[0].contour(scale["x"], scale["y"], scale["azimuth"])
             ax[0].clabel(cs, inline=1, fmt="%0.1f")
 
@@ -50,12 +100,12 @@ def az_el(scale, plottype: str = "singlecontour", img=None):
     axe = ax[1]
     match plottype:
         case "image":
-            hie = axe.imshow(scale["elevation"], origin="lower")
+            hie = axe.imshow(scale["elevation"], origin="lower", extent=_grid_extent(scale))
             hc = fg.colorbar(hie)
             hc.set_label("Elevation [deg]")
         case "contour":
             if img is not None:
-                axe.imshow(img, origin="lower", cmap="gray")
+                axe.imshow(img, origin="lower", extent=extent, cmap="gray")
             cs = axe.contour(scale["x"], scale["y"], scale["elevation"])
             axe.clabel(cs, inline=True, fmt="%0.1f")
 
@@ -70,18 +120,23 @@ def az_el(scale, plottype: str = "singlecontour", img=None):
     return fg
 
 
-def ra_dec(scale, plottype: str = "singlecontour", img=None):
+def ra_dec(scale, plottype: str = "singlecontour", img=None, max_points: int | None = 1000):
     """
     plot right ascension and declination mapped to sky
+
+    max_points: decimate grids to at most this many points per axis before plotting,
+    None for full resolution
     """
     if "ra" not in scale:
         return None
 
+    scale, img, extent = decimate(scale, img, max_points)
+
     match plottype:
         case "singlecontour":
             fg, ax = plt.subplots(layout="constrained")
             if img is not None:
-                ax.imshow(img, origin="lower", cmap="gray")
+                ax.imshow(img, origin="lower", extent=extent, cmap="gray")
             cs = ax.contour(scale["x"], scale["y"], scale["ra"])
             ax.clabel(cs, inline=1, fmt="%0.1f")
             cs = ax.contour(scale["x"], scale["y"], scale["dec"])
@@ -93,13 +148,13 @@ def ra_dec(scale, plottype: str = "singlecontour", img=None):
             return fg
         case "image":
             fg, ax = plt.subplots(1, 2, figsize=(12, 5), sharey=True, layout="constrained")
-            hri = ax[0].imshow(scale["ra"], origin="lower")
+            hri = ax[0].imshow(scale["ra"], origin="lower", extent=_grid_extent(scale))
             hc = fg.colorbar(hri)
             hc.set_label("RA [deg]")
         case "contour":
             fg, ax = plt.subplots(1, 2, figsize=(12, 5), sharey=True, layout="constrained")
             if img is not None:
-                ax[0].imshow(img, origin="lower", cmap="gray")
+                ax[0].imshow(img, origin="lower", extent=extent, cmap="gray")
             cs = ax[0].contour(scale["x"], scale["y"], scale["ra"])
             ax[0].clabel(cs, inline=1, fmt="%0.1f")
 
@@ -109,12 +164,12 @@ def ra_dec(scale, plottype: str = "singlecontour", img=None):
     # %%
     match plottype:
         case "image":
-            hdi = ax[1].imshow(scale["dec"], origin="lower")
+            hdi = ax[1].imshow(scale["dec"], origin="lower", extent=_grid_extent(scale))
             hc = fg.colorbar(hdi)
             hc.set_label("Dec [deg]")
         case "contour":
             if img is not None:
-                ax[1].imshow(img, origin="lower", cmap="gray")
+                ax[1].imshow(img, origin="lower", extent=extent, cmap="gray")
             cs = ax[1].contour(scale["x"], scale["y"], scale["dec"])
             ax[1].clabel(cs, inline=1, fmt="%0.1f")
 
@@ -168,11 +223,11 @@ def image_stack(img, fn: Path, clim=None):
     fg.savefig(plotFN)
 
 
-def wcs_image(fn: Path, cmap, ax, alpha=1):
+def wcs_image(fn: Path, cmap, ax, alpha=1, workers: int = 1):
     """
     Astrometry.net makes file ".new" with the image and the WCS SIP 2-D polynomial fit coefficients in the FITS header
 
-    Warps the image to sky coordinates using the WCS.
+    Warps the image to sky coordinates using the WCS, evaluated on "workers" threads.
 
     pcolormesh() is used as it handles arbitrary pixel shapes.
     Note that pcolormesh() cannot tolerate NaN in X or Y (NaN in C is OK).
@@ -186,13 +241,8 @@ def wcs_image(fn: Path, cmap, ax, alpha=1):
         img = f[0].data
 
         yPix, xPix = f[0].shape[-2:]
-        x, y = np.meshgrid(range(xPix), range(yPix))  # pixel indices to find RA/dec of
-        xy = np.column_stack((x.ravel(order="C"), y.ravel(order="C")))
-
-        radec = wcs.WCS(f[0].header).all_pix2world(xy, 0)
 
-    ra = radec[:, 0].reshape((yPix, xPix), order="C")
-    dec = radec[:, 1].reshape((yPix, xPix), order="C")
+        ra, dec = pix2world_tiled(wcs.WCS(f[0].header), yPix, xPix, workers)
 
     ax.set_title(fn.name)
     ax.pcolormesh(ra, dec, img, alpha=alpha, cmap=cmap, norm=LogNorm())
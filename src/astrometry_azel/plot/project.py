@@ -1,3 +1,5 @@
+from pathlib import Path
+
 import xarray
 import numpy as np
 
@@ -6,7 +8,13 @@ from matplotlib.colors import LogNorm
 import cartopy
 
 
-def geomap(img: xarray.Dataset, minimum_elevation: float = 0.0):
+def geomap(
+    img: xarray.Dataset,
+    minimum_elevation: float = 0.0,
+    raster: bool = False,
+    resolution: tuple[int, int] | None = None,
+    cache_dir: Path | None = None,
+):
     """
     plot geomapped image
 
@@ -17,6 +25,14 @@ def geomap(img: xarray.Dataset, minimum_elevation: float = 0.0):
         image data and coordinates
     minimum_elevation: float
         minimum elevation angle to mask (degrees)
+    raster: bool
+        regrid to a regular lat/lon raster drawn with imshow(), much faster than
+        pcolormesh() of every pixel, e.g. for movies
+    resolution: tuple of int, optional
+        raster (latitude, longitude) size, at least 2 each. Default is the axes size in screen pixels,
+        or the image size if smaller.
+    cache_dir: pathlib.Path, optional
+        cache of regridding matrices, see regrid.regrid_operator()
     """
 
     projection_altitude_km = img["latitude_proj"].attrs["projection_altitude_km"]
@@ -68,7 +84,10 @@ def geomap(img: xarray.Dataset, minimum_elevation: float = 0.0):
     hgl.bottom_labels = True
     hgl.left_labels = True
 
-    ax.pcolormesh(img.longitude_proj, img.latitude_proj, masked, norm=LogNorm(), cmap="Greys_r")
+    if raster:
+        _raster(ax, img, lat_bounds, lon_bounds, minimum_elevation, resolution, cache_dir)
+    else:
+        ax.pcolormesh(img.longitude_proj, img.latitude_proj, masked, norm=LogNorm(), cmap="Greys_r")
 
     ax.set_title(
         f"{str(img.time.values)[:-10]}  "
@@ -83,3 +102,40 @@ def geomap(img: xarray.Dataset, minimum_elevation: float = 0.0):
     ax.set_extent(lims)
 
     return fg
+
+
+def _raster(ax, img, lat_bounds, lon_bounds, minimum_elevation, resolution, cache_dir) -> None:
+    """
+    regrid image to a regular lat/lon grid at screen resolution and imshow() it
+    """
+
+    from ..regrid import apply_regrid, regrid_operator
+
+    if resolution is None:
+        bbox = ax.get_window_extent()
+        resolution = (
+            min(int(bbox.height), img.sizes["y"]),
+            min(int(bbox.width), img.sizes["x"]),
+        )
+
+    if min(resolution) < 2:
+        raise ValueError(f"raster resolution {resolution} must be at least 2 x 2")
+
+    lat = np.linspace(float(lat_bounds[0]), float(lat_bounds[1]), resolution[0])
+    lon = np.linspace(float(lon_bounds[0]), float(lon_bounds[1]), resolution[1])
+
+    M = regrid_operator(img, lat, lon, minimum_elevation=minimum_elevation, cache_dir=cache_dir)
+    frame = apply_regrid(M, img.image, lat, lon)
+
+    dlat = (lat[1] - lat[0]) / 2
+    dlon = (lon[1] - lon[0]) / 2
+
+    ax.imshow(
+        np.ma.masked_invalid(frame.values),
+        origin="lower",
+        extent=(lon[0] - dlon, lon[-1] + dlon, lat[0] - dlat, lat[-1] + dlat),
+        transform=cartopy.crs.PlateCarree(),
+        norm=LogNorm(),
+        cmap="Greys_r",
+        interpolation="nearest",
+    )
@@ -3,9 +3,10 @@ from datetime import datetime
 
 import xarray
 import numpy as np
+from astropy.io import fits
 
 from .io import load_image, write_fits, write_netcdf
-from . import fits2azel
+from . import fits2azel, doSolve
 
 import pymap3d
 
@@ -13,11 +14,22 @@ import pymap3d
 def plate_scale(
     in_file: Path,
     latlon: tuple[float, float],
-    ut1: datetime,
+    ut1: datetime | str | float,
     solve: bool,
     args: str,
     index_dir: str | None = None,
+    cache_dir: Path | None = None,
+    timeout: float | None = None,
+    prior: Path | str | None = None,
+    dtype=np.float64,
+    workers: int = 1,
+    presolve: dict | None = None,
 ) -> tuple:
+    """
+    presolve: if given, keyword arguments of condition.star_list(), e.g. {"bin_factor": 4}.
+    solve-field is given the star list of the binned, masked image instead of the image,
+    and the solution is rescaled to full-resolution pixels.
+    """
     # %% filenames
     in_file = Path(in_file).expanduser().resolve()
 
@@ -26,9 +38,34 @@ def plate_scale(
     img = load_image(in_file)
     write_fits(img, new_file)
 
-    scale = fits2azel(
-        new_file, latlon=latlon, time=ut1, solve=solve, args=args, index_dir=index_dir
-    )
+    if solve and presolve is not None:
+        from . import condition
+
+        xyfn = condition.star_list(img, new_file.with_suffix(".xyls"), **presolve)
+        doSolve(
+            xyfn,
+            f"{condition.xylist_args(xyfn)} {args}",
+            index_dir=index_dir,
+            cache_dir=cache_dir,
+            timeout=timeout,
+            prior=prior,
+            time=ut1,
+            binning=fits.getheader(xyfn, 0)["BINNING"],
+        )
+        if xyfn.with_suffix(".solved").is_file():
+            condition.rescale_wcs(xyfn.with_suffix(".wcs"), xyfn, new_file.with_suffix(".wcs"))
+    elif solve:
+        doSolve(
+            new_file,
+            args,
+            index_dir=index_dir,
+            cache_dir=cache_dir,
+            timeout=timeout,
+            prior=prior,
+            time=ut1,
+        )
+
+    scale = fits2azel(new_file, latlon=latlon, time=ut1, dtype=dtype, workers=workers)
 
     # %% write to file
     netcdf_file = Path(scale.filename).with_suffix(".nc")
@@ -38,31 +75,177 @@ def plate_scale(
     return scale, img
 
 
-def image_altitude(img: xarray.Dataset, projection_altitude_km: float, observer_altitude_m: float):
+def image_altitude(
+    img: xarray.Dataset,
+    projection_altitude_km: float,
+    observer_altitude_m: float,
+    dtype=np.float64,
+    engine: str = "shell",
+):
     """
     project image to projection_altitude_km
 
+    dtype: output data type of latitude_proj, longitude_proj.
+    The "shell" engine computes per-pixel quantities in this type, the "secant" engine in float64.
+
+    engine:
+        "shell": exact intersection of each pixel's look ray with the WGS84 shell, see ray_shell()
+        "secant": flat-earth slant range altitude / sin(elevation), inaccurate at low elevation
+
+    Pixels whose look ray never reaches the shell are NaN.
+
     adapted from https://github.com/space-physics/dascasi
     """
 
-    slant_range_m = projection_altitude_km * 1e3 / np.sin(np.radians(img["elevation"]))
-    # secant approximation
+    lat, lon = _project_altitudes(img, [projection_altitude_km], observer_altitude_m, dtype, engine)
 
-    lat, lon, _ = pymap3d.aer2geodetic(
-        az=img["azimuth"],
-        el=img["elevation"],
-        srange=slant_range_m,  # meters
-        lat0=img["observer_latitude"].item(),  # degrees north
-        lon0=img["observer_longitude"].item(),  # degrees east
-        h0=observer_altitude_m,  # meters
-    )
-
-    img.coords["latitude_proj"] = (("y", "x"), lat)
+    img.coords["latitude_proj"] = (("y", "x"), lat[0].astype(dtype, copy=False))
     img["latitude_proj"].attrs["projection_altitude_km"] = projection_altitude_km
     img["latitude_proj"].attrs["units"] = "degrees north WGS84"
 
-    img.coords["longitude_proj"] = (("y", "x"), lon)
+    img.coords["longitude_proj"] = (("y", "x"), lon[0].astype(dtype, copy=False))
     img["longitude_proj"].attrs["projection_altitude_km"] = projection_altitude_km
     img["longitude_proj"].attrs["units"] = "degrees east WGS84"
 
     return img
+
+
+def image_altitudes(
+    img: xarray.Dataset,
+    projection_altitudes_km,
+    observer_altitude_m: float,
+    dtype=np.float64,
+    engine: str = "shell",
+):
+    """
+    project image to each of several altitudes, e.g. [100, 110, 150, 230] km
+
+    Returns latitude_proj, longitude_proj with dimensions (altitude, y, x).
+    The pixel look directions are computed once for all altitudes.
+    For writing the cube, see io.write_netcdf(), which stores one altitude per chunk.
+    dtype and engine are as for image_altitude().
+    """
+
+    alt_km = np.atleast_1d(np.asarray(projection_altitudes_km, dtype=np.float64))
+
+    lat, lon = _project_altitudes(img, alt_km, observer_altitude_m, dtype, engine)
+
+    img = img.assign_coords(altitude=alt_km)
+    img["altitude"].attrs["units"] = "km"
+
+    img.coords["latitude_proj"] = (("altitude", "y", "x"), lat.astype(dtype, copy=False))
+    img["latitude_proj"].attrs["units"] = "degrees north WGS84"
+
+    img.coords["longitude_proj"] = (("altitude", "y", "x"), lon.astype(dtype, copy=False))
+    img["longitude_proj"].attrs["units"] = "degrees east WGS84"
+
+    return img
+
+
+def _project_altitudes(
+    img: xarray.Dataset, alt_km, observer_altitude_m: float, dtype=np.float64, engine: str = "shell"
+) -> tuple:
+    """
+    geodetic latitude, longitude (altitude, y, x) of each pixel's look ray at each altitude
+    """
+
+    if engine not in {"shell", "secant"}:
+        raise ValueError(f"unknown engine {engine}")
+
+    lat0 = img["observer_latitude"].item()
+    lon0 = img["observer_longitude"].item()
+
+    if engine == "secant":
+        dtype = np.float64
+
+    # per pixel quantities independent of altitude
+    az = img["azimuth"].values.astype(dtype)
+    el = img["elevation"].values.astype(dtype)
+    e, n, u = pymap3d.aer2enu(az, el, 1.0)
+    look = np.stack(pymap3d.enu2uvw(e, n, u, lat0, lon0)).astype(dtype, copy=False)
+    observer = np.array(pymap3d.geodetic2ecef(lat0, lon0, observer_altitude_m))
+    sin_el = np.sin(np.radians(el))
+
+    lat = np.empty((len(alt_km), *az.shape), dtype=dtype)
+    lon = np.empty((len(alt_km), *az.shape), dtype=dtype)
+
+    for i, a in enumerate(alt_km):
+        if engine == "shell":
+            lat[i], lon[i] = ray_shell(observer, look, a * 1e3)
+        else:
+            slant_range_m = a * 1e3 / sin_el
+            # secant approximation
+
+            lat[i], lon[i], _ = pymap3d.ecef2geodetic(
+                *(observer[:, None, None] + slant_range_m * look)
+            )
+
+    return lat, lon
+
+
+def ray_shell(observer, look, alt_m: float, iterations: int = 1) -> tuple:
+    """
+    geodetic latitude, longitude (degrees) where rays from observer first cross altitude alt_m
+
+    The ray is first intersected with the ellipsoid of semi-axes (a + alt_m, b + alt_m),
+    then moved along the ray to the exact geodetic altitude by Newton iterations
+    (the offset ellipsoid is within meters of constant geodetic altitude, so one suffices).
+    Rays that never reach the altitude, or hit the ground first, are NaN.
+    Per-ray arithmetic is in the data type of look, e.g. float32, with observer
+    position terms in float64.
+
+    Parameters
+    ----------
+    observer: numpy.ndarray
+        ECEF position (3,) of observer (meters)
+    look: numpy.ndarray
+        ECEF unit look vectors (3, ...)
+    alt_m: float
+        altitude above WGS84 ellipsoid (meters)
+    """
+
+    ell = pymap3d.Ellipsoid.from_name("wgs84")
+    A = ell.semimajor_axis + alt_m
+    B = ell.semiminor_axis + alt_m
+    k2 = (A / B) ** 2
+
+    # Python floats do not promote float32 look vectors
+    ox, oy, oz = map(float, observer)
+    ux, uy, uz = look
+
+    # quadratic qa t^2 + qb t + qc = 0 in distance t along the ray
+    qa = ux**2 + uy**2 + k2 * uz**2
+    qb = 2 * (ox * ux + oy * uy + k2 * oz * uz)
+    # float64 for the difference of large numbers
+    qc = ox**2 + oy**2 + k2 * oz**2 - A**2
+
+    disc = qb**2 - 4 * qa * qc
+    sq = np.sqrt(np.maximum(disc, 0))
+    if qc < 0:
+        # observer below the shell: the positive root, unless the ray first goes below the
+        # ellipsoid through the observer, whose roots are t = 0 and -qb0 / qa0
+        t = (-qb + sq) / (2 * qa)
+        h0 = pymap3d.ecef2geodetic(ox, oy, oz)[2]
+        k0 = ((ell.semimajor_axis + h0) / (ell.semiminor_axis + h0)) ** 2
+        qb0 = ox * ux + oy * uy + k0 * oz * uz
+        t = np.where(qb0 < 0, np.nan, t)
+    else:
+        # observer above the shell: the nearer crossing, ahead of the observer
+        t = (-qb - sq) / (2 * qa)
+        t[(disc < 0) | (t < 0)] = np.nan
+
+    for _ in range(iterations):
+        x, y, z = ox + t * ux, oy + t * uy, oz + t * uz
+        lat, lon, alt = pymap3d.ecef2geodetic(x, y, z)
+        # rate of altitude change along the ray is the look vector component along the local vertical
+        clat = np.cos(np.radians(lat))
+        up = (
+            clat * np.cos(np.radians(lon)) * ux
+            + clat * np.sin(np.radians(lon)) * uy
+            + np.sin(np.radians(lat)) * uz
+        )
+        t = t + (alt_m - alt) / up
+
+    lat, lon, _ = pymap3d.ecef2geodetic(ox + t * ux, oy + t * uy, oz + t * uz)
+
+    return lat, lon
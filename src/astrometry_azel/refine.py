@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+refine an existing WCS for a new frame of a slowly drifting camera, without solve-field
+
+    python -m astrometry_azel.refine new.fits old.wcs
+
+The catalog stars of a previous solve (.corr matched stars, else .rdls) are located
+near their predicted pixels in the new frame, and the WCS reference point and CD matrix
+(optionally SIP distortion) are refit by linear least squares, which takes milliseconds.
+If too few stars match or the fit residual is too large, solve-field is run instead.
+"""
+
+from pathlib import Path
+from argparse import ArgumentParser
+import logging
+
+import numpy as np
+from astropy.io import fits
+import astropy.wcs as awcs
+
+from . import doSolve, read_wcs
+from .io import get_sources
+
+
+def catalog_stars(fn: Path) -> tuple:
+    """
+    RA, Dec (degrees) of catalog stars from solve-field products of fn:
+    .corr (stars matched in the solved image) if present, else .rdls (all index stars in the field)
+    """
+
+    fn = Path(fn).expanduser()
+
+    if (corr := fn.with_suffix(".corr")).is_file():
+        src = get_sources(corr)
+        return np.asarray(src["index_ra"], float), np.asarray(src["index_dec"], float)
+
+    src = get_sources(fn.with_suffix(".rdls"))
+
+    return np.asarray(src["RA"], float), np.asarray(src["DEC"], float)
+
+
+def match_stars(img, w: awcs.WCS, ra, dec, search_radius: float = 5.0) -> tuple:
+    """
+    detected stars of img nearest the predicted pixels of catalog stars ra, dec
+
+    Each catalog star is matched to at most one detection within search_radius (pixels),
+    after removing the median offset of a first match, which absorbs a small drift.
+
+    Returns
+    -------
+    x, y: numpy.ndarray
+        detected centroids (0-based pixels)
+    ra, dec: numpy.ndarray
+        catalog positions of the matched stars (degrees)
+    """
+
+    from scipy.spatial import cKDTree
+    from .condition import extract_stars
+
+    img = np.asarray(img)
+    ny, nx = img.shape
+
+    xp, yp = w.all_world2pix(ra, dec, 0)
+    inside = np.isfinite(xp + yp) & (xp > -0.5) & (xp < nx - 0.5) & (yp > -0.5) & (yp < ny - 0.5)
+    xp, yp, ra, dec = xp[inside], yp[inside], ra[inside], dec[inside]
+
+    x, y, _ = extract_stars(img, max_stars=max(500, 4 * xp.size))
+    if x.size == 0 or xp.size == 0:
+        return np.empty(0), np.empty(0), np.empty(0), np.empty(0)
+
+    tree = cKDTree(np.column_stack((x, y)))
+
+    shift = np.zeros(2)
+    for radius in (search_radius, max(search_radius / 4, 1.0)):
+        dist, i = tree.query(np.column_stack((xp, yp)) + shift, distance_upper_bound=radius)
+        ok = np.isfinite(dist)
+        if not ok.any():
+            return np.empty(0), np.empty(0), np.empty(0), np.empty(0)
+        shift = np.median(np.column_stack((x[i[ok]] - xp[ok], y[i[ok]] - yp[ok])), axis=0)
+
+    # one catalog star per detection: keep the closest
+    j = np.flatnonzero(ok)
+    j = j[np.argsort(dist[j])]
+    _, first = np.unique(i[j], return_index=True)
+    j = np.sort(j[first])
+
+    return x[i[j]], y[i[j]], ra[j], dec[j]
+
+
+def fit_wcs(w: awcs.WCS, x, y, ra, dec, sip_order: int | None = None, iterations: int = 3) -> tuple:
+    """
+    refit CRVAL and CD (and SIP if sip_order) of w to stars at pixels x, y (0-based) and ra, dec
+
+    CRPIX is held fixed. The catalog positions are projected onto the tangent plane,
+    where the model is linear in its coefficients; the tangent point is then moved
+    to the fitted offset and the fit repeated.
+    With sip_order None, the existing SIP distortion (if any) is kept; with 1, it is removed.
+
+    Returns
+    -------
+    w: astropy.wcs.WCS
+        refined copy
+    rms: float
+        root mean square residual (pixels)
+    """
+
+    from numpy.polynomial import polynomial as P
+
+    w = w.deepcopy()
+    x = np.asarray(x, float)
+    y = np.asarray(y, float)
+    world = np.column_stack((ra, dec))
+
+    # SIP is relative to CRPIX in 1-based pixels
+    u = x + 1 - w.wcs.crpix[0]
+    v = y + 1 - w.wcs.crpix[1]
+
+    if sip_order is None:
+        order = 1
+        if w.sip is not None:
+            u, v = u + P.polyval2d(u, v, w.sip.a), v + P.polyval2d(u, v, w.sip.b)
+    else:
+        order = sip_order
+
+    # polynomial terms u**p * v**q of total order 1..order
+    terms = [(p, q) for p in range(order + 1) for q in range(order + 1) if 1 <= p + q <= order]
+    A = np.column_stack([np.ones_like(u)] + [u**p * v**q for p, q in terms])
+
+    if A.shape[0] < A.shape[1]:
+        raise ValueError(f"{A.shape[0]} stars cannot constrain {A.shape[1]} terms")
+
+    for _ in range(iterations):
+        # tangent plane (intermediate world) coordinates, degrees
+        xi = w.wcs.s2p(world, 1)["imgcrd"]
+
+        coef = np.linalg.lstsq(A, xi, rcond=None)[0]
+
+        cd = np.column_stack((coef[1 + terms.index((1, 0))], coef[1 + terms.index((0, 1))]))
+
+        # move the tangent point to the fitted offset of CRPIX
+        p0 = w.wcs.crpix + np.linalg.solve(w.pixel_scale_matrix, coef[0])
+        crval = w.wcs.p2s(p0[None, :], 1)["world"][0]
+
+        w.wcs.crval = crval
+        if w.wcs.has_cd():
+            w.wcs.cd = cd
+        else:
+            w.wcs.pc = cd / w.wcs.cdelt[:, None]
+
+    if sip_order is not None:
+        # order 1 is linear: CD alone, no distortion
+        w.sip = _fit_sip(w, coef, terms, cd, order) if sip_order >= 2 else None
+
+    xf, yf = w.all_world2pix(ra, dec, 0)
+    rms = np.sqrt(np.mean((xf - x) ** 2 + (yf - y) ** 2))
+
+    return w, rms
+
+
+def _fit_sip(w: awcs.WCS, coef, terms, cd, order: int):
+    """
+    SIP forward coefficients from the nonlinear terms of the fit, and their inverse
+    fit over a grid spanning the image
+    """
+
+    from numpy.polynomial import polynomial as P
+
+    # nonlinear terms in pixel units: CD^-1 @ (xi - CD @ (u, v))
+    dist = np.linalg.solve(cd, coef[1:].T).T
+    a = np.zeros((order + 1, order + 1))
+    b = np.zeros((order + 1, order + 1))
+    for (p, q), (da, db) in zip(terms, dist):
+        if p + q >= 2:
+            a[p, q] = da
+            b[p, q] = db
+
+    nx, ny = w.pixel_shape or 2 * w.wcs.crpix
+    gu, gv = np.meshgrid(
+        np.linspace(1, nx, 25) - w.wcs.crpix[0], np.linspace(1, ny, 25) - w.wcs.crpix[1]
+    )
+    U = gu + P.polyval2d(gu, gv, a)
+    V = gv + P.polyval2d(gu, gv, b)
+
+    inv = [(p, q) for p in range(order + 2) for q in range(order + 2) if p + q <= order + 1]
+    A = np.column_stack([U.ravel() ** p * V.ravel() ** q for p, q in inv])
+    c = np.linalg.lstsq(A, np.column_stack(((gu - U).ravel(), (gv - V).ravel())), rcond=None)[0]
+
+    ap = np.zeros((order + 2, order + 2))
+    bp = np.zeros((order + 2, order + 2))
+    for (p, q), (da, db) in zip(inv, c):
+        ap[p, q] = da
+        bp[p, q] = db
+
+    return awcs.Sip(a, b, ap, bp, w.wcs.crpix)
+
+
+def refine_wcs(
+    fitsfn: Path,
+    wcsfn: Path,
+    *,
+    catalog: Path | None = None,
+    search_radius: float = 5.0,
+    sip_order: int | None = None,
+    max_rms: float = 1.0,
+    min_stars: int = 10,
+    fallback: bool = True,
+    **solve_kwargs,
+) -> Path:
+    """
+    WCS of image fitsfn by refining the solution wcsfn of a previous frame of the same camera
+
+    Parameters
+    ----------
+    fitsfn: pathlib.Path
+        new FITS image
+    wcsfn: pathlib.Path
+        previous solution, e.g. from doSolve()
+    catalog: pathlib.Path, optional
+        file whose .corr or .rdls gives the catalog stars, default wcsfn
+    search_radius: float
+        maximum drift (pixels) of stars since wcsfn
+    sip_order: int, optional
+        refit SIP distortion of this order, else keep the existing distortion
+    max_rms: float
+        largest acceptable fit residual (pixels)
+    min_stars: int
+        fewest matched stars to accept a refinement
+    fallback: bool
+        run doSolve(fitsfn, prior=wcsfn, **solve_kwargs) if refinement fails, else raise RuntimeError
+
+    Returns
+    -------
+    wcsfn: pathlib.Path
+        fitsfn.with_suffix(".wcs"), as found by find_wcs()
+    """
+
+    fitsfn = Path(fitsfn).expanduser()
+    wcsfn = Path(wcsfn).expanduser()
+    outfn = fitsfn.with_suffix(".wcs")
+
+    with fits.open(fitsfn, mode="readonly", memmap=False) as f:
+        img = f[0].data
+
+    w = read_wcs(wcsfn)
+    w.pixel_shape = img.shape[::-1]
+
+    ra, dec = catalog_stars(catalog or wcsfn)
+    x, y, ra, dec = match_stars(img, w, ra, dec, search_radius)
+
+    if x.size < min_stars:
+        reason = f"{x.size} stars matched, need {min_stars}"
+    else:
+        w, rms = fit_wcs(w, x, y, ra, dec, sip_order)
+        reason = f"fit residual {rms:.2f} pixels > {max_rms}"
+        if rms <= max_rms:
+            logging.info(f"{outfn}: refined with {x.size} stars, {rms:.2f} pixels rms")
+
+            hdr = w.to_header(relax=True)
+            hdr["IMAGEH"], hdr["IMAGEW"] = img.shape[-2:]
+            fits.PrimaryHDU(header=hdr).writeto(outfn, overwrite=True)
+
+            return outfn
+
+    if not fallback:
+        raise RuntimeError(f"{fitsfn}: WCS refinement failed: {reason}")
+
+    logging.warning(f"{fitsfn}: WCS refinement failed ({reason}), running solve-field")
+    doSolve(fitsfn, prior=wcsfn, **solve_kwargs)
+
+    return outfn
+
+
+if __name__ == "__main__":
+    p = ArgumentParser(description="refine a previous WCS for a new frame of the same camera")
+    p.add_argument("fitsfn", help="new FITS image")
+    p.add_argument("wcsfn", help="previous .wcs solution, with its .corr or .rdls")
+    p.add_argument("-r", "--search-radius", help="maximum drift (pixels)", type=float, default=5.0)
+    p.add_argument("--sip", help="refit SIP distortion of this order", type=int)
+    p.add_argument("--max-rms", help="largest fit residual (pixels)", type=float, default=1.0)
+    p.add_argument(
+        "--no-fallback", help="do not run solve-field if refinement fails", action="store_true"
+    )
+    P = p.parse_args()
+
+    print(
+        refine_wcs(
+            P.fitsfn,
+            P.wcsfn,
+            search_radius=P.search_radius,
+            sip_order=P.sip,
+            max_rms=P.max_rms,
+            fallback=not P.no_fallback,
+        )
+    )
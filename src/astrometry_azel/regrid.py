@@ -0,0 +1,202 @@
+"""
+resample geomapped images to a regular latitude/longitude grid
+
+The projected pixel locations latitude_proj, longitude_proj from project.image_altitude()
+depend only on the camera calibration and projection altitude, so the resampling is a
+fixed linear operator: a sparse matrix built once and applied to every frame as one
+sparse matrix-vector product.
+
+    M = regrid_operator(img, lat, lon, cache_dir="~/regrid")
+    frame = apply_regrid(M, img["image"], lat, lon)
+"""
+
+from pathlib import Path
+import hashlib
+import logging
+
+import numpy as np
+import xarray
+
+from .lookup import pixel_chord, refine_pixel
+from .sky import radec2icrs
+
+
+def regrid_operator(
+    img: xarray.Dataset,
+    lat,
+    lon,
+    *,
+    method: str = "bilinear",
+    minimum_elevation: float = 0.0,
+    cache_dir: Path | None = None,
+):
+    """
+    sparse resampling matrix from image pixels to a regular lat, lon grid
+
+    Parameters
+    ----------
+    img: xarray.Dataset
+        with latitude_proj, longitude_proj, elevation from project.image_altitude()
+    lat, lon: numpy.ndarray
+        ascending target grid centers (degrees)
+    method: str
+        "nearest": nearest pixel
+        "bilinear": bilinear interpolation between the four surrounding pixels
+        "area": mean of all pixels whose center falls in the grid cell, for grids coarser than the pixels
+    minimum_elevation: float
+        pixels below this elevation (degrees) are not used
+    cache_dir: pathlib.Path, optional
+        matrices are saved here, keyed by the projected pixel locations, target grid and method,
+        and loaded instead of rebuilt
+
+    Returns
+    -------
+    M: scipy.sparse.csr_matrix
+        (lat.size * lon.size, y.size * x.size)
+    """
+
+    from scipy import sparse
+
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+
+    plat = img["latitude_proj"].values.astype(np.float64)
+    plon = img["longitude_proj"].values.astype(np.float64)
+    valid = np.isfinite(plat) & np.isfinite(plon) & (img["elevation"].values >= minimum_elevation)
+
+    if cache_dir is not None:
+        cache_dir = Path(cache_dir).expanduser()
+        h = hashlib.sha256()
+        for a in (plat, plon, valid, lat, lon):
+            h.update(np.ascontiguousarray(a).tobytes())
+        h.update(method.encode())
+        cache_file = cache_dir / f"{h.hexdigest()}.npz"
+        if cache_file.is_file():
+            logging.info(f"regrid operator loaded from {cache_file}")
+            return sparse.load_npz(cache_file)
+
+    match method:
+        case "nearest" | "bilinear":
+            rows, cols, weights = _interp_weights(plat, plon, valid, lat, lon, method)
+        case "area":
+            rows, cols, weights = _area_weights(plat, plon, valid, lat, lon)
+        case _:
+            raise ValueError(f"unknown method {method}")
+
+    M = sparse.csr_matrix((weights, (rows, cols)), shape=(lat.size * lon.size, plat.size))
+
+    if cache_dir is not None:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        sparse.save_npz(cache_file, M)
+
+    return M
+
+
+def _interp_weights(plat, plon, valid, lat, lon, method: str) -> tuple:
+    from scipy.spatial import cKDTree
+
+    # spherical to Cartesian, avoiding the longitude wrap
+    grid = np.stack(radec2icrs(plon, plat), axis=-1)
+    grid[~valid] = np.nan
+
+    glon, glat = np.meshgrid(lon, lat)
+    target = np.stack(radec2icrs(glon.ravel(), glat.ravel()), axis=-1)
+
+    ny, nx = plat.shape
+    i_valid = np.flatnonzero(valid)
+    dist, i = cKDTree(grid.reshape(-1, 3)[i_valid]).query(target)
+
+    y, x = np.unravel_index(i_valid[np.minimum(i, i_valid.size - 1)], plat.shape)
+    x, y = refine_pixel(grid, x, y, target)
+
+    # outside the image or next to an unused pixel
+    inside = (dist <= 2 * pixel_chord(grid)) & np.isfinite(x + y)
+    rows = np.flatnonzero(inside)
+    x = x[inside]
+    y = y[inside]
+
+    if method == "nearest":
+        return rows, np.rint(y).astype(int) * nx + np.rint(x).astype(int), np.ones(rows.size)
+
+    x0 = np.clip(np.floor(x).astype(int), 0, max(nx - 2, 0))
+    y0 = np.clip(np.floor(y).astype(int), 0, max(ny - 2, 0))
+    fx = x - x0
+    fy = y - y0
+
+    corners = [
+        (y0, x0, (1 - fy) * (1 - fx)),
+        (y0, np.minimum(x0 + 1, nx - 1), (1 - fy) * fx),
+        (np.minimum(y0 + 1, ny - 1), x0, fy * (1 - fx)),
+        (np.minimum(y0 + 1, ny - 1), np.minimum(x0 + 1, nx - 1), fy * fx),
+    ]
+
+    return (
+        np.tile(rows, 4),
+        np.concatenate([yi * nx + xi for yi, xi, _ in corners]),
+        np.concatenate([w for *_, w in corners]),
+    )
+
+
+def _area_weights(plat, plon, valid, lat, lon) -> tuple:
+    cols = np.flatnonzero(valid)
+
+    # cell edges midway between grid centers
+    ilat = np.searchsorted((lat[1:] + lat[:-1]) / 2, plat.ravel()[cols])
+    ilon = np.searchsorted((lon[1:] + lon[:-1]) / 2, plon.ravel()[cols])
+
+    # pixels beyond the outer half cell are outside the grid
+    dlat = (lat[-1] - lat[0]) / max(lat.size - 1, 1) / 2
+    dlon = (lon[-1] - lon[0]) / max(lon.size - 1, 1) / 2
+    inside = (
+        (plat.ravel()[cols] >= lat[0] - dlat)
+        & (plat.ravel()[cols] <= lat[-1] + dlat)
+        & (plon.ravel()[cols] >= lon[0] - dlon)
+        & (plon.ravel()[cols] <= lon[-1] + dlon)
+    )
+
+    rows = ilat[inside] * lon.size + ilon[inside]
+    cols = cols[inside]
+    count = np.bincount(rows, minlength=lat.size * lon.size)
+
+    return rows, cols, 1.0 / count[rows]
+
+
+def apply_regrid(M, image, lat, lon) -> xarray.DataArray:
+    """
+    resample one image (y, x) or a stack of images (..., y, x) with a matrix from regrid_operator().
+    The leading dimensions and their coordinates of an xarray.DataArray are kept;
+    a NumPy stack is (time, y, x).
+    Grid cells with no pixels are NaN.
+    """
+
+    lead: tuple = ("time",)
+    coords: dict = {}
+    if isinstance(image, xarray.DataArray):
+        lead = image.dims[:-2]
+        coords = {k: v for k, v in image.coords.items() if set(v.dims) <= set(lead)}
+        image = image.values
+
+    lat = np.asarray(lat)
+    lon = np.asarray(lon)
+    image = np.asarray(image, dtype=np.float64)
+    Ny, Nx = image.shape[-2:]
+    stack = image.reshape(-1, Ny * Nx)
+
+    out = (M @ stack.T).T
+    out[:, M.getnnz(axis=1) == 0] = np.nan
+
+    if image.ndim == 2:
+        return xarray.DataArray(
+            out.reshape(len(lat), len(lon)),
+            coords={"latitude": lat, "longitude": lon},
+            dims=("latitude", "longitude"),
+        )
+
+    if len(lead) != image.ndim - 2:
+        raise ValueError(f"NumPy image stacks are (time, y, x), not {image.shape}")
+
+    return xarray.DataArray(
+        out.reshape(*image.shape[:-2], len(lat), len(lon)),
+        coords={**coords, "latitude": lat, "longitude": lon},
+        dims=(*lead, "latitude", "longitude"),
+    )
@@ -0,0 +1,416 @@
+"""
+faster engines for converting whole-frame RA/Dec grids to Az/El
+
+The exact path (astrometry_azel.pymap3d_radec2azel) pushes every pixel through
+AstroPy SkyCoord.transform_to(AltAz), which takes minutes on large sensors.
+The Az/El field of an imager is very smooth in pixel coordinates, so these engines
+do the exact transform on a small set of points and derive the rest.
+"""
+
+from datetime import datetime
+import logging
+
+import numpy as np
+
+from . import pymap3d_radec2azel
+
+
+def azel2enu(az_deg, el_deg) -> np.ndarray:
+    """
+    azimuth, elevation (degrees) to East, North, Up unit vector (last axis)
+    """
+
+    az = np.radians(az_deg)
+    el = np.radians(el_deg)
+    cel = np.cos(el)
+
+    return np.stack((cel * np.sin(az), cel * np.cos(az), np.sin(el)), axis=-1)
+
+
+def enu2azel(enu) -> tuple:
+    """
+    East, North, Up vector (last axis) to azimuth, elevation (degrees).
+    The vector need not be normalized.
+    """
+
+    e = enu[..., 0]
+    n = enu[..., 1]
+    u = enu[..., 2]
+
+    az = np.degrees(np.arctan2(e, n)) % 360.0
+    el = np.degrees(np.arctan2(u, np.hypot(e, n)))
+
+    return az, el
+
+
+def angular_separation(az1_deg, el1_deg, az2_deg, el2_deg):
+    """
+    great circle angle (degrees) between two viewing directions
+    """
+
+    v1 = azel2enu(az1_deg, el1_deg)
+    v2 = azel2enu(az2_deg, el2_deg)
+
+    # atan2 of cross and dot products is well conditioned for tiny angles
+    cross = np.linalg.norm(np.cross(v1, v2), axis=-1)
+    dot = (v1 * v2).sum(axis=-1)
+
+    return np.degrees(np.arctan2(cross, dot))
+
+
+def interp_radec2azel(
+    ra_deg,
+    dec_deg,
+    lat_deg: float,
+    lon_deg: float,
+    time: datetime,
+    *,
+    max_error_deg: float = 1 / 3600,
+    step: int | None = None,
+    Ncheck: int = 64,
+) -> tuple:
+    """
+    sky coordinates (ra, dec) to viewing angle (az, el) by exact transform
+    on a coarse control grid, with bicubic spline interpolation between.
+
+    The East, North, Up components are interpolated rather than azimuth, elevation
+    to avoid the azimuth wrap at 0/360 degrees and the singularity at zenith.
+    The interpolation is checked against the exact transform at Ncheck pixels
+    between control points; the control grid is refined until the maximum error
+    is below max_error_deg.
+
+    Parameters
+    ----------
+    ra_deg : numpy.ndarray
+         2-D (y, x) right ascension (degrees)
+    dec_deg : numpy.ndarray
+         2-D (y, x) declination (degrees)
+    lat_deg : float
+              observer latitude [-90, 90]
+    lon_deg : float
+              observer longitude [-180, 180] (degrees)
+    time : datetime.datetime
+           time of observation
+    max_error_deg : float
+           maximum angular error allowed at check points (degrees)
+    step : int, optional
+           initial control grid spacing (pixels)
+    Ncheck : int
+           number of pixels to check against the exact transform
+
+    Returns
+    -------
+    az_deg : numpy.ndarray
+             azimuth [degrees clockwize from North]
+    el_deg : numpy.ndarray
+             elevation [degrees above horizon (neglecting aberration)]
+    """
+
+    ra_deg = np.asarray(ra_deg)
+    dec_deg = np.asarray(dec_deg)
+    if ra_deg.ndim != 2 or ra_deg.shape != dec_deg.shape:
+        raise ValueError("ra_deg, dec_deg must be 2-D arrays of the same shape")
+
+    splines = enu_splines(
+        lambda y, x: (ra_deg[y, x], dec_deg[y, x]),
+        ra_deg.shape,
+        lat_deg,
+        lon_deg,
+        time,
+        max_error_deg=max_error_deg,
+        step=step,
+        Ncheck=Ncheck,
+    )
+
+    if splines is None:
+        logging.warning("interp_radec2azel: could not meet max_error_deg, using exact transform")
+        return pymap3d_radec2azel(ra_deg, dec_deg, lat_deg, lon_deg, time)
+
+    return eval_enu_splines(splines, np.arange(ra_deg.shape[0]), np.arange(ra_deg.shape[1]))
+
+
+def enu_splines(
+    sample,
+    shape: tuple[int, int],
+    lat_deg: float,
+    lon_deg: float,
+    time: datetime,
+    *,
+    max_error_deg: float = 1 / 3600,
+    step: int | None = None,
+    Ncheck: int = 64,
+) -> list | None:
+    """
+    East, North, Up bicubic splines over pixel (y, x) for interp_radec2azel(),
+    refined until the error at Ncheck pixels is below max_error_deg.
+
+    sample(y, x) returns ra, dec (degrees) at 1-D integer pixel index arrays y, x,
+    so the frame need not be in memory, e.g. lazy Dask arrays.
+
+    Returns
+    -------
+    splines: list of scipy.interpolate.RectBivariateSpline, or None if max_error_deg was not met
+    """
+
+    from scipy.interpolate import RectBivariateSpline
+
+    ny, nx = shape
+    if step is None:
+        step = max(2, max(ny, nx) // 32)
+
+    # check points are fixed so that refinement is deterministic
+    rng = np.random.default_rng(0)
+    cy = rng.integers(0, ny, Ncheck)
+    cx = rng.integers(0, nx, Ncheck)
+    ra_check, dec_check = sample(cy, cx)
+    az_check, el_check = pymap3d_radec2azel(ra_check, dec_check, lat_deg, lon_deg, time)
+
+    while step >= 2:
+        iy = np.unique(np.r_[0:ny:step, ny - 1])
+        ix = np.unique(np.r_[0:nx:step, nx - 1])
+        if iy.size < 4 or ix.size < 4:
+            # too few control points for a bicubic spline
+            step //= 2
+            continue
+
+        Y, X = np.meshgrid(iy, ix, indexing="ij")
+        ra_c, dec_c = sample(Y.ravel(), X.ravel())
+        az_c, el_c = pymap3d_radec2azel(ra_c, dec_c, lat_deg, lon_deg, time)
+        enu_c = azel2enu(az_c, el_c).reshape(iy.size, ix.size, 3)
+
+        splines = [RectBivariateSpline(iy, ix, enu_c[..., i]) for i in range(3)]
+
+        az_i, el_i = enu2azel(np.stack([s.ev(cy, cx) for s in splines], axis=-1))
+        err = angular_separation(az_i, el_i, az_check, el_check).max()
+        logging.info(f"enu_splines: step {step} pixels, max error {err * 3600:.3f} arcsec")
+
+        if err <= max_error_deg:
+            return splines
+
+        step //= 2
+
+    return None
+
+
+def eval_enu_splines(splines: list, yi, xi) -> tuple:
+    """
+    azimuth, elevation (degrees) on the pixel grid yi x xi from enu_splines()
+    """
+
+    return enu2azel(np.stack([s(yi, xi) for s in splines], axis=-1))
+
+
+def radec2icrs(ra_deg, dec_deg) -> tuple:
+    """
+    right ascension, declination (degrees) to ICRS unit vector components x, y, z
+    """
+
+    ra = np.radians(ra_deg)
+    dec = np.radians(dec_deg)
+    cdec = np.cos(dec)
+
+    return cdec * np.cos(ra), cdec * np.sin(ra), np.sin(dec)
+
+
+def icrs2enu_matrix(lat_deg: float, lon_deg: float, time: datetime, N: int = 128) -> np.ndarray:
+    """
+    affine map from ICRS unit vector to (unnormalized) East, North, Up vector
+    for one observer and one time.
+
+    To first order, annual and diurnal aberration displace the direction v to
+    v + beta before the bias/precession/nutation/Earth rotation/topocentric rotation R,
+    so ENU ~ R @ v + R @ beta.
+    The 3x4 matrix [R | R @ beta] is least-squares fit to the exact AstroPy transform of
+    N directions spread over the whole sphere, which keeps the fit well conditioned
+    regardless of the camera field of view.
+
+    Returns
+    -------
+    M : numpy.ndarray
+        3x4 affine matrix, ENU = M[:, :3] @ v + M[:, 3]
+    """
+
+    # Fibonacci sphere: nearly uniform directions
+    i = np.arange(N) + 0.5
+    dec = np.degrees(np.arcsin(1 - 2 * i / N))
+    ra = np.degrees(np.pi * (1 + 5**0.5) * i) % 360.0
+
+    az, el = pymap3d_radec2azel(ra, dec, lat_deg, lon_deg, time)
+
+    A = np.column_stack((*radec2icrs(ra, dec), np.ones(N)))
+    enu = azel2enu(az, el)
+    coef, *_ = np.linalg.lstsq(A, enu, rcond=None)
+    # R @ (v + beta) is not a unit vector: its length varies by ~beta across the sky.
+    # Rescale the unit targets to the predicted lengths and refit until converged.
+    for _ in range(50):
+        length = np.linalg.norm(A @ coef, axis=1, keepdims=True)
+        prev = coef
+        coef, *_ = np.linalg.lstsq(A, enu * length, rcond=None)
+        if np.abs(coef - prev).max() < 1e-14:
+            break
+
+    return coef.T
+
+
+def rotation_radec2azel(
+    ra_deg, dec_deg, lat_deg: float, lon_deg: float, time: datetime, *, M=None
+) -> tuple:
+    """
+    sky coordinates (ra, dec) to viewing angle (az, el) using one affine rotation
+    per frame, since all pixels share the same observer and time.
+
+    The rotation and aberration terms are computed once with AstroPy by icrs2enu_matrix(),
+    then applied to every pixel with vectorized NumPy. Typical error is well under 0.1 arcsec;
+    see accuracy_report().
+
+    Parameters
+    ----------
+    ra_deg : numpy.ndarray
+         right ascension (degrees)
+    dec_deg : numpy.ndarray
+         declination (degrees)
+    lat_deg : float
+              observer latitude [-90, 90]
+    lon_deg : float
+              observer longitude [-180, 180] (degrees)
+    time : datetime.datetime
+           time of observation
+    M : numpy.ndarray, optional
+        3x4 matrix from icrs2enu_matrix(), if already computed
+
+    Returns
+    -------
+    az_deg : numpy.ndarray
+             azimuth [degrees clockwize from North]
+    el_deg : numpy.ndarray
+             elevation [degrees above horizon (neglecting aberration)]
+    """
+
+    if M is None:
+        M = icrs2enu_matrix(lat_deg, lon_deg, time)
+
+    return apply_icrs2enu(M, *radec2icrs(ra_deg, dec_deg))
+
+
+def apply_icrs2enu(M, x, y, z) -> tuple:
+    """
+    apply 3x4 matrix from icrs2enu_matrix() to ICRS unit vector components
+
+    Returns
+    -------
+    az_deg : numpy.ndarray
+             azimuth [degrees clockwize from North]
+    el_deg : numpy.ndarray
+             elevation [degrees above horizon (neglecting aberration)]
+    """
+
+    e = M[0, 0] * x + M[0, 1] * y + M[0, 2] * z + M[0, 3]
+    n = M[1, 0] * x + M[1, 1] * y + M[1, 2] * z + M[1, 3]
+    u = M[2, 0] * x + M[2, 1] * y + M[2, 2] * z + M[2, 3]
+
+    az = np.degrees(np.arctan2(e, n)) % 360.0
+    el = np.degrees(np.arctan2(u, np.hypot(e, n)))
+
+    return az, el
+
+
+def icrs2enu_series(
+    lat_deg: float, lon_deg: float, times, anchor_interval: float = 3600.0
+) -> np.ndarray:
+    """
+    icrs2enu_matrix() for a vector of times from one observer, e.g. a fixed camera all night.
+
+    The exact AstroPy matrix is computed at anchor times spaced by anchor_interval seconds.
+    Between anchors, the sky is rotated about the Celestial Intermediate Pole by the
+    change in Earth Rotation Angle (sidereal rotation). Precession, nutation and annual
+    aberration change by milliarcseconds per hour, so they are held at the anchor values.
+
+    Parameters
+    ----------
+    lat_deg : float
+              observer latitude [-90, 90]
+    lon_deg : float
+              observer longitude [-180, 180] (degrees)
+    times : sequence of datetime.datetime or str
+           times of observation
+    anchor_interval : float
+           seconds between exact AstroPy anchor matrices
+
+    Returns
+    -------
+    M : numpy.ndarray
+        (time, 3, 4) affine matrices, see icrs2enu_matrix()
+    """
+
+    import erfa
+    from astropy.time import Time
+
+    t = Time(times)
+    t = t.reshape(-1) if t.ndim else t.reshape(1)
+
+    ut1 = t.ut1
+    era = erfa.era00(ut1.jd1, ut1.jd2)
+
+    M = np.empty((t.size, 3, 4))
+    anchor = None
+    for i in range(t.size):
+        if anchor is None or abs((t[i] - t[anchor]).sec) > anchor_interval:
+            anchor = i
+            M0 = icrs2enu_matrix(lat_deg, lon_deg, t[i].datetime)
+            R0 = M0[:, :3]
+            # aberration offset in ICRS, held fixed between anchors
+            beta = np.linalg.solve(R0, M0[:, 3])
+            tt = t[i].tt
+            C = erfa.c2i06a(tt.jd1, tt.jd2)
+
+        # terrestrial = Rz(ERA) @ C @ icrs, so a change in ERA is C.T @ Rz(dERA) @ C in ICRS
+        Q = C.T @ erfa.rz(era[i] - era[anchor], np.eye(3)) @ C
+        R = R0 @ Q
+        M[i, :, :3] = R
+        M[i, :, 3] = R @ beta
+
+    return M
+
+
+def accuracy_report(
+    ra_deg,
+    dec_deg,
+    lat_deg: float,
+    lon_deg: float,
+    time: datetime,
+    method: str = "rotation",
+    Ncheck: int = 1000,
+) -> dict[str, float]:
+    """
+    compare a fast engine with the exact AstroPy transform at Ncheck random pixels
+
+    Returns
+    -------
+    report : dict
+        maximum, RMS and median angular error (arcsec) and number of pixels checked
+    """
+
+    ra_deg = np.asarray(ra_deg).ravel()
+    dec_deg = np.asarray(dec_deg).ravel()
+
+    rng = np.random.default_rng(0)
+    i = rng.choice(ra_deg.size, min(Ncheck, ra_deg.size), replace=False)
+
+    az, el = pymap3d_radec2azel(ra_deg[i], dec_deg[i], lat_deg, lon_deg, time)
+
+    match method:
+        case "rotation":
+            az_f, el_f = rotation_radec2azel(ra_deg[i], dec_deg[i], lat_deg, lon_deg, time)
+        case "interp":
+            raise ValueError("interp engine is checked internally, see interp_radec2azel()")
+        case _:
+            raise ValueError(f"unknown method {method}")
+
+    err = angular_separation(az, el, az_f, el_f) * 3600
+
+    return {
+        "max_arcsec": float(err.max()),
+        "rms_arcsec": float(np.sqrt((err**2).mean())),
+        "median_arcsec": float(np.median(err)),
+        "Ncheck": int(i.size),
+    }
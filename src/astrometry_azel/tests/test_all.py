@@ -8,7 +8,10 @@ from pathlib import Path
 from pytest import approx
 import shutil
 
+import numpy as np
+
 import astrometry_azel as ael
+from astrometry_azel.io import write_netcdf
 
 import importlib.resources as ir
 
@@ -55,3 +58,808 @@ def test_fits2azel(fits_file):
 
     el_expected = [17.78086795, 15.74570897, 12.50919858]
     assert scale["elevation"].values[[32, 51, 98], [28, 92, 156]] == approx(el_expected, rel=0.01)
+
+
+def test_fits2azel_interp(fits_file):
+    pytest.importorskip("scipy")
+
+    exact = ael.fits2azel(fits_file, latlon=(0, 0), time="2000-01-01T00:00")
+    scale = ael.fits2azel(
+        fits_file, latlon=(0, 0), time="2000-01-01T00:00", method="interp", max_error_deg=1e-4
+    )
+
+    assert scale["azimuth"].dims == ("y", "x")
+    assert scale["azimuth"].values == approx(exact["azimuth"].values, abs=1e-3)
+    assert scale["elevation"].values == approx(exact["elevation"].values, abs=1e-3)
+
+
+def test_radec2azel_rotation(fits_file):
+    from astrometry_azel.sky import accuracy_report
+
+    exact = ael.fits2azel(fits_file, latlon=(0, 0), time="2000-01-01T00:00")
+    scale = ael.fits2azel(fits_file, latlon=(0, 0), time="2000-01-01T00:00", method="rotation")
+
+    assert scale["azimuth"].values == approx(exact["azimuth"].values, abs=1e-5)
+    assert scale["elevation"].values == approx(exact["elevation"].values, abs=1e-5)
+
+    report = accuracy_report(scale["ra"].values, scale["dec"].values, 0, 0, "2000-01-01T00:00")
+    assert report["max_arcsec"] < 0.1
+
+
+def test_fits2azel_series(fits_file, tmp_path):
+    times = ["2000-01-01T00:00", "2000-01-01T00:10", "2000-01-01T03:00"]
+    series = ael.fits2azel_series(fits_file, latlon=(0, 0), times=times)
+
+    assert series["azimuth"].dims == ("time", "y", "x")
+    assert series.sizes["time"] == 3
+
+    for i, t in enumerate(times):
+        exact = ael.fits2azel(fits_file, latlon=(0, 0), time=t)
+        assert series["azimuth"][i].values == approx(exact["azimuth"].values, abs=1e-4)
+        assert series["elevation"][i].values == approx(exact["elevation"].values, abs=1e-4)
+
+    pytest.importorskip("netCDF4")
+    write_netcdf(series, tmp_path / "series.nc")
+
+
+def test_solve_cache(fits_file, tmp_path):
+    from astrometry_azel import cache
+
+    cache_dir = tmp_path / "cache"
+    fits_file.with_suffix(".solved").touch()
+
+    key = cache.solve_key(fits_file, "--scale-low  20", None, "0.95")
+    assert key == cache.solve_key(fits_file, "--scale-low 20", None, "0.95")
+    assert key != cache.solve_key(fits_file, "--scale-low 20", None, "0.96")
+
+    assert not cache.restore(key, fits_file, cache_dir)
+    cache.store(key, fits_file, cache_dir, max_bytes=2**20)
+
+    fits_file.with_suffix(".wcs").unlink()
+    assert cache.restore(key, fits_file, cache_dir)
+    assert fits_file.with_suffix(".wcs").is_file()
+
+    cache.evict(cache_dir, max_bytes=0)
+    assert not cache.restore(key, fits_file, cache_dir)
+
+
+def test_batch(fits_file, tmp_path):
+    pytest.importorskip("netCDF4")
+    pytest.importorskip("pymap3d")
+    from astrometry_azel.batch import batch, find_jobs
+
+    frame = shutil.copy(fits_file, tmp_path / "frame.fits")
+    # plate_scale writes frame_new.fits, which needs its WCS
+    shutil.copy(fits_file.with_suffix(".wcs"), tmp_path / "frame_new.wcs")
+    (tmp_path / "manifest.csv").write_text("frame.fits, 2000-01-01T00:00\nmissing.fits\n")
+
+    jobs = find_jobs([str(tmp_path / "manifest.csv")])
+    assert jobs[str(frame)] == "2000-01-01T00:00"
+
+    state_file = tmp_path / "state.json"
+    state = batch(jobs, (0, 0), retries=0, state_file=state_file)
+
+    done = state[str(frame)]
+    assert done["status"] == "ok"
+    assert Path(state[str(frame)]["output"]).is_file()
+    assert state[str(tmp_path / "missing.fits")]["status"] == "failed"
+
+    # resume: only the failed job runs again
+    state = batch(jobs, (0, 0), retries=0, state_file=state_file)
+    assert state[str(frame)] == done
+
+
+def test_solve_hints(fits_file, tmp_path):
+    pytest.importorskip("netCDF4")
+
+    hints = ael.solve_hints(fits_file.with_suffix(".wcs")).split()
+    assert float(hints[hints.index("--scale-low") + 1]) < 169.4
+    assert float(hints[hints.index("--scale-high") + 1]) > 169.4
+
+    # fixed camera one hour later: field center RA advances ~15.04 degrees
+    cal = tmp_path / "cal.nc"
+    write_netcdf(ael.fits2azel(fits_file, latlon=(0, 0), time="2000-01-01T00:00"), cal)
+    later = ael.solve_hints(cal, time="2000-01-01T01:00").split()
+
+    ra0 = float(hints[hints.index("--ra") + 1])
+    ra1 = float(later[later.index("--ra") + 1])
+    assert ra1 - ra0 == approx(15.041, abs=0.001)
+
+
+@pytest.mark.parametrize("method", ["mean", "median"])
+def test_collapsestack_stream(method):
+    from astrometry_azel.io import collapsestack
+
+    rng = np.random.default_rng(0)
+    stack = rng.integers(0, 4096, (25, 16, 20), dtype=np.uint16)
+    func = getattr(np, method)
+
+    frame_bytes = 8 * 16 * 20
+    for key in (slice(0, 25), slice(2, 21, 3), slice(None, None, -1), slice(20, 2, -3)):
+        colaps = collapsestack(stack, key, method, max_bytes=3 * frame_bytes)
+        assert colaps.dtype == stack.dtype
+        assert (colaps == func(stack[key], axis=0).astype(stack.dtype)).all()
+
+
+def test_iter_frames_reversed():
+    from astrometry_azel.io import iter_frames
+
+    stack = np.arange(10)[:, None, None] * np.ones((1, 2, 3))
+    for key in (slice(None, None, -1), slice(8, 0, -3), slice(-2, None, -1)):
+        blocks = list(iter_frames(stack, key, max_bytes=2 * 8 * 6))
+        assert all(b.shape[0] <= 2 for b in blocks)
+        assert (np.concatenate(blocks) == stack[key]).all()
+
+
+@pytest.mark.parametrize("method", ["sigmaclip", "winsorized"])
+def test_collapsestack_clip(method):
+    from astrometry_azel.io import collapsestack
+
+    rng = np.random.default_rng(0)
+    stack = rng.normal(1000, 10, (50, 16, 20))
+    # satellite streak in one frame
+    stack[7, 5, :] = 60000
+
+    colaps = collapsestack(stack, slice(0, 50), method, max_bytes=8 * 16 * 20 * 4)
+    assert colaps[5] == approx(np.full(20, 1000), abs=10)
+    assert np.mean(stack, axis=0)[5] == approx(np.full(20, 2180), abs=10)
+
+
+def test_fits2azel_float32(fits_file, tmp_path):
+    pytest.importorskip("netCDF4")
+    import xarray
+
+    exact = ael.fits2azel(fits_file, latlon=(0, 0), time="2000-01-01T00:00")
+    scale = ael.fits2azel(fits_file, latlon=(0, 0), time="2000-01-01T00:00", dtype=np.float32)
+
+    for k in ("ra", "dec", "azimuth", "elevation"):
+        assert scale[k].dtype == np.float32
+        assert scale[k].values == approx(exact[k].values, abs=1e-4)
+
+    write_netcdf(exact, tmp_path / "f32.nc", dtype=np.float32)
+    with xarray.open_dataset(tmp_path / "f32.nc") as ds:
+        assert ds["azimuth"].dtype == np.float32
+
+
+def test_fits2azel_lazy(fits_file, tmp_path):
+    pytest.importorskip("dask")
+    pytest.importorskip("netCDF4")
+    import xarray
+
+    exact = ael.fits2azel(fits_file, latlon=(0, 0), time="2000-01-01T00:00")
+    scale = ael.fits2azel(fits_file, latlon=(0, 0), time="2000-01-01T00:00", chunks=64)
+
+    for k in ("ra", "dec", "azimuth", "elevation"):
+        assert scale[k].chunks is not None
+        assert scale[k][:64, :64].values == approx(exact[k][:64, :64].values)
+
+    write_netcdf(scale, tmp_path / "lazy.nc")
+    with xarray.open_dataset(tmp_path / "lazy.nc") as ds:
+        assert ds["elevation"].values == approx(exact["elevation"].values)
+
+
+def test_fits2radec_workers(fits_file):
+    serial = ael.fits2radec(fits_file)
+    tiled = ael.fits2radec(fits_file, workers=4)
+
+    assert np.array_equal(tiled["ra"].values, serial["ra"].values)
+    assert np.array_equal(tiled["dec"].values, serial["dec"].values)
+
+
+@pytest.mark.parametrize("codec", ["blosc", "zstd", None])
+def test_write_zarr(fits_file, tmp_path, codec):
+    pytest.importorskip("zarr")
+    import xarray
+    from astrometry_azel.io import write_zarr
+
+    times = ["2000-01-01T00:00", "2000-01-01T00:10", "2000-01-01T00:20"]
+    series = ael.fits2azel_series(fits_file, latlon=(0, 0), times=times)
+
+    store = tmp_path / "series.zarr"
+    write_zarr(series.isel(time=[0]), store, chunks={"y": 50, "x": 64}, codec=codec)
+    write_zarr(series.isel(time=[1, 2]), store, append_dim="time")
+
+    with xarray.open_dataset(store, engine="zarr", consolidated=False) as ds:
+        assert ds["azimuth"].shape == series["azimuth"].shape
+        assert ds["azimuth"].encoding["chunks"] == (1, 50, 64)
+        assert ds["elevation"][2, :50, :64].values == approx(
+            series["elevation"][2, :50, :64].values
+        )
+        assert ds["ra"].values == approx(series["ra"].values)
+
+
+@pytest.mark.parametrize(
+    "access,expected",
+    [("frame", (1, 101, 333)), ("rows", (1, 24, 333)), ("time", (5, 101, 161))],
+)
+def test_chunk_shape(access, expected):
+    from astrometry_azel.io import chunk_shape
+
+    assert chunk_shape(("time", "y", "x"), (5, 101, 333), 8, access) == expected
+    assert chunk_shape(("y", "x"), (0, 1), 8, access) == (1, 1)
+
+
+def test_write_netcdf_quantize(fits_file, tmp_path):
+    pytest.importorskip("netCDF4")
+    import xarray
+    from astrometry_azel.io import benchmark_netcdf
+
+    scale = ael.fits2azel(fits_file, latlon=(0, 0), time="2000-01-01T00:00")
+
+    exact = benchmark_netcdf(scale, tmp_path / "exact.nc")
+    lossy = benchmark_netcdf(
+        scale,
+        tmp_path / "lossy.nc",
+        codec="auto",
+        access="rows",
+        least_significant_digit={"azimuth": 3, "elevation": 3},
+        significant_digits={"ra": 6, "dec": 6},
+    )
+    assert lossy["bytes"] < exact["bytes"]
+
+    with xarray.open_dataset(tmp_path / "lossy.nc") as ds:
+        assert ds["azimuth"].values == approx(scale["azimuth"].values, abs=1e-3)
+        assert ds["ra"].values == approx(scale["ra"].values, abs=1e-3)
+
+
+def test_pixel_index(fits_file, tmp_path):
+    pytest.importorskip("scipy")
+    pytest.importorskip("pymap3d")
+    from astrometry_azel.lookup import PixelIndex
+
+    scale = ael.fits2azel(fits_file, latlon=(0, 0), time="2000-01-01T00:00")
+    index = PixelIndex(scale)
+
+    rows = np.array([32, 51, 98])
+    cols = np.array([28, 92, 156])
+    x, y = index.azel2pix(
+        scale["azimuth"].values[rows, cols], scale["elevation"].values[rows, cols]
+    )
+    assert x == approx(cols, abs=0.01)
+    assert y == approx(rows, abs=0.01)
+
+    x, y = index.radec2pix(scale["ra"].values[rows, cols], scale["dec"].values[rows, cols])
+    assert x == approx(cols, abs=0.01)
+    assert y == approx(rows, abs=0.01)
+
+    # opposite direction from the camera
+    x, _ = index.azel2pix([scale["azimuth"].values[50, 50] + 180], [-10])
+    assert np.isnan(x).all()
+
+    # sub-pixel
+    az = scale["azimuth"].values[60, 70:72].mean()
+    el = scale["elevation"].values[60, 70:72].mean()
+    x, y = index.azel2pix(az, el)
+    assert (x, y) == approx((70.5, 60), abs=0.05)
+
+    index.save(tmp_path / "index.pkl")
+    assert PixelIndex.load(tmp_path / "index.pkl").azel2pix(az, el) == approx((x, y))
+
+
+@pytest.mark.parametrize("method", ["nearest", "bilinear", "area"])
+def test_regrid(fits_file, tmp_path, method):
+    pytest.importorskip("scipy")
+    pytest.importorskip("pymap3d")
+    from astrometry_azel.project import image_altitude
+    import xarray
+    from astrometry_azel.regrid import regrid_operator, apply_regrid
+
+    scale = ael.fits2azel(fits_file, latlon=(65, -148), time="2000-01-01T00:00")
+    img = image_altitude(scale, 110, 0)
+
+    lat = np.linspace(img.latitude_proj.min().item(), img.latitude_proj.max().item(), 20)
+    lon = np.linspace(img.longitude_proj.min().item(), img.longitude_proj.max().item(), 30)
+
+    M = regrid_operator(img, lat, lon, method=method, cache_dir=tmp_path)
+    assert len(list(tmp_path.glob("*.npz"))) == 1
+    assert (regrid_operator(img, lat, lon, method=method, cache_dir=tmp_path) != M).nnz == 0
+
+    # resampling the projected latitude gives back the grid latitude
+    out = apply_regrid(M, img["latitude_proj"], lat, lon)
+    assert out.dims == ("latitude", "longitude")
+    assert np.isfinite(out).sum() > 50
+    glat = np.broadcast_to(lat[:, None], out.shape)
+    ok = np.isfinite(out.values)
+    assert out.values[ok] == approx(glat[ok], abs=0.5 * (lat[1] - lat[0]))
+
+    stack = apply_regrid(M, np.stack([img["latitude_proj"].values] * 2), lat, lon)
+    assert stack.shape == (2, 20, 30)
+    assert stack.dims == ("time", "latitude", "longitude")
+
+    # leading dimension of a DataArray, e.g. an image_altitudes() cube, is kept
+    cube = xarray.concat([img["latitude_proj"]] * 3, dim="altitude").assign_coords(
+        altitude=[100, 110, 230]
+    )
+    out = apply_regrid(M, cube, lat, lon)
+    assert out.dims == ("altitude", "latitude", "longitude")
+    assert out.altitude.values.tolist() == [100, 110, 230]
+
+
+def test_raster(fits_file, tmp_path):
+    """
+    regridded imshow() on plain PlateCarree axes, without Natural Earth map data
+    """
+    pytest.importorskip("scipy")
+    pytest.importorskip("pymap3d")
+    cartopy = pytest.importorskip("cartopy")
+    matplotlib = pytest.importorskip("matplotlib")
+    matplotlib.use("Agg")
+    from matplotlib.pyplot import figure, close
+    from astrometry_azel.project import image_altitude
+    from astrometry_azel.plot.project import _raster
+
+    scale = ael.fits2azel(fits_file, latlon=(65, -148), time="2000-01-01T00:00")
+    img = image_altitude(scale, 110, 0)
+    img["image"] = img["elevation"] + 100
+
+    lat_bounds = (img.latitude_proj.min() - 0.5, img.latitude_proj.max() + 0.5)
+    lon_bounds = (img.longitude_proj.min() - 0.5, img.longitude_proj.max() + 0.5)
+
+    fg = figure()
+    ax = fg.add_subplot(projection=cartopy.crs.PlateCarree())
+    _raster(ax, img, lat_bounds, lon_bounds, 0.0, (20, 30), tmp_path)
+    fg.canvas.draw()
+
+    im = ax.get_images()[0]
+    assert im.get_array().shape == (20, 30)
+    assert im.get_array().count() > 50
+    assert len(list(tmp_path.glob("*.npz"))) == 1
+
+    with pytest.raises(ValueError):
+        _raster(ax, img, lat_bounds, lon_bounds, 0.0, (1, 30), tmp_path)
+    close(fg)
+
+
+def test_image_altitudes(fits_file, tmp_path):
+    pymap3d = pytest.importorskip("pymap3d")
+    pytest.importorskip("netCDF4")
+    import xarray
+    from astrometry_azel.project import image_altitude, image_altitudes
+
+    scale = ael.fits2azel(fits_file, latlon=(65, -148), time="2000-01-01T00:00")
+
+    cube = image_altitudes(scale.copy(), [100, 110, 230], 50, engine="secant")
+    assert cube["latitude_proj"].dims == ("altitude", "y", "x")
+
+    for a in cube.altitude.values:
+        img = image_altitude(scale.copy(), a, 50, engine="secant")
+        assert cube["latitude_proj"].sel(altitude=a).values == approx(img["latitude_proj"].values)
+        assert cube["longitude_proj"].sel(altitude=a).values == approx(img["longitude_proj"].values)
+
+    lat, lon, _ = pymap3d.aer2geodetic(
+        scale.azimuth.values,
+        scale.elevation.values,
+        110e3 / np.sin(np.radians(scale.elevation.values)),
+        65,
+        -148,
+        50,
+    )
+    assert cube["latitude_proj"][1].values == approx(lat)
+    assert cube["longitude_proj"][1].values == approx(lon)
+
+    write_netcdf(cube, tmp_path / "cube.nc")
+    with xarray.open_dataset(tmp_path / "cube.nc") as ds:
+        assert ds["latitude_proj"].encoding["chunksizes"] == (1, *scale["azimuth"].shape)
+
+
+def test_image_altitude_shell(fits_file):
+    pymap3d = pytest.importorskip("pymap3d")
+    from astrometry_azel.project import image_altitude, ray_shell
+
+    scale = ael.fits2azel(fits_file, latlon=(65, -148), time="2000-01-01T00:00")
+
+    img = image_altitude(scale.copy(), 110, 50)
+
+    # the projected points are at 110 km altitude, in the pixel's look direction
+    az, el, _ = pymap3d.geodetic2aer(
+        img.latitude_proj.values, img.longitude_proj.values, 110e3, 65, -148, 50
+    )
+    assert az == approx(scale.azimuth.values, abs=1e-6)
+    assert el == approx(scale.elevation.values, abs=1e-6)
+
+    img32 = image_altitude(scale.copy(), 110, 50, dtype=np.float32)
+    assert img32.latitude_proj.dtype == np.float32
+    assert img32.latitude_proj.values == approx(img.latitude_proj.values, abs=1e-3)
+    assert img32.longitude_proj.values == approx(img.longitude_proj.values, abs=1e-3)
+
+    # observer above the shell: looking up misses, looking down hits
+    observer = np.array(pymap3d.geodetic2ecef(65, -148, 300e3))
+    enu = pymap3d.aer2enu(np.array([0.0, 0.0]), np.array([60.0, -60.0]), 1.0)
+    look = np.stack(pymap3d.enu2uvw(*enu, 65, -148))
+    lat, lon = ray_shell(observer, look, 110e3)
+    assert np.isnan(lat[0]) and np.isnan(lon[0])
+    assert np.isfinite(lat[1]) and lat[1] > 65
+
+    # observer below the shell: rays below the horizon hit the ground, not the far side
+    observer = np.array(pymap3d.geodetic2ecef(0, 0, 0))
+    enu = pymap3d.aer2enu(np.array([0.0, 0.0, 90.0]), np.array([-89.0, -1.0, 1.0]), 1.0)
+    look = np.stack(pymap3d.enu2uvw(*enu, 0, 0))
+    lat, lon = ray_shell(observer, look, 110e3)
+    assert np.isnan(lat[:2]).all() and np.isnan(lon[:2]).all()
+    assert np.isfinite(lat[2]) and np.isfinite(lon[2])
+
+    scale["elevation"][0, 0] = -5
+    below = image_altitude(scale.copy(), 110, 50)
+    assert np.isnan(below.latitude_proj[0, 0]) and np.isnan(below.longitude_proj[0, 0])
+    assert np.isfinite(below.latitude_proj[1, 1])
+
+
+@pytest.mark.parametrize("suffix", [".nc", ".zarr"])
+def test_geoproject_frames(fits_file, tmp_path, suffix):
+    pytest.importorskip("scipy")
+    pytest.importorskip("pymap3d")
+    if suffix == ".zarr":
+        pytest.importorskip("zarr")
+    import xarray
+    from astropy.io import fits
+    from astrometry_azel.pipeline import geoproject_frames
+    from astrometry_azel.project import image_altitude
+
+    scale = ael.fits2azel(fits_file, latlon=(65, -148), time="2000-01-01T00:00")
+    write_netcdf(scale, tmp_path / "cal.nc")
+
+    frames = np.ones((7, *scale["azimuth"].shape), dtype=np.uint16) * np.arange(1, 8)[:, None, None]
+    fits.PrimaryHDU(frames).writeto(tmp_path / "frames.fits")
+
+    img = image_altitude(scale.copy(), 110, 0)
+    lat = np.linspace(img.latitude_proj.min().item(), img.latitude_proj.max().item(), 20)
+    lon = np.linspace(img.longitude_proj.min().item(), img.longitude_proj.max().item(), 30)
+
+    out = geoproject_frames(
+        tmp_path / "cal.nc",
+        tmp_path / "frames.fits",
+        tmp_path / f"proj{suffix}",
+        110,
+        lat,
+        lon,
+        key=slice(1, 7),
+        max_bytes=2 * frames[0].size * 8,
+        workers=2,
+    )
+
+    kw = {"engine": "zarr", "consolidated": False} if suffix == ".zarr" else {}
+    with xarray.open_dataset(out, **kw) as ds:
+        assert ds["image"].dims == ("time", "latitude", "longitude")
+        assert ds.time.values.tolist() == list(range(1, 7))
+        for i, frame in enumerate(ds["image"].values, start=2):
+            ok = np.isfinite(frame)
+            assert ok.sum() > 50
+            assert frame[ok] == approx(i)
+
+
+def test_prefetch_close():
+    pytest.importorskip("pymap3d")
+    import threading
+    from astrometry_azel.pipeline import _prefetch
+
+    closed = threading.Event()
+
+    def blocks():
+        try:
+            yield from range(100)
+        finally:
+            closed.set()
+
+    # consumer stops early: the producer thread exits and closes its generator
+    threads = threading.active_count()
+    p = _prefetch(blocks(), 1)
+    assert next(p) == 0
+    p.close()
+    assert closed.is_set()
+    assert threading.active_count() == threads
+
+
+def test_plot_decimate(fits_file):
+    pytest.importorskip("matplotlib")
+    from astrometry_azel.plot import decimate, ra_dec
+
+    scale = ael.fits2radec(fits_file)
+    img = np.ones(scale["ra"].shape)
+
+    small, small_img, extent = decimate(scale, img, max_points=50)
+    assert max(small.sizes.values()) <= 50
+    # image stays full resolution, registered to its full-resolution extent
+    assert small_img is img
+    assert extent == (-0.5, scale.sizes["x"] - 0.5, -0.5, scale.sizes["y"] - 0.5)
+    assert small["ra"].values == approx(scale["ra"].sel(x=small.x, y=small.y).values)
+
+    assert decimate(scale, img, max_points=None)[0] is scale
+
+    ra_dec(scale, img=img, max_points=50)
+    ra_dec(scale, "image", max_points=50)
+
+
+@pytest.fixture
+def http_server(tmp_path):
+    import hashlib
+    import http.server
+    import threading
+
+    data = {f"index-42{i:02d}.fits": bytes(range(256)) * (i + 100) for i in (8, 9, 10)}
+    requests = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = data[Path(self.path).name]
+            requests.append(self.headers.get("Range"))
+            if r := self.headers.get("Range"):
+                start = int(r.split("=")[1].rstrip("-"))
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}")
+                body = body[start:]
+            else:
+                self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_HEAD(self):
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data[Path(self.path).name])))
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    manifest = tmp_path / "SHA256SUMS"
+    manifest.write_text("\n".join(f"{hashlib.sha256(v).hexdigest()}  {k}" for k, v in data.items()))
+
+    yield f"http://127.0.0.1:{server.server_port}/4200/", data, manifest, requests
+
+    server.shutdown()
+
+
+def test_download(http_server, tmp_path):
+    from astrometry_azel.download.__main__ import download
+
+    url, data, manifest, requests = http_server
+    odir = tmp_path / "index"
+    odir.mkdir()
+
+    # interrupted transfer
+    (odir / "index-4209.fits.part").write_bytes(data["index-4209.fits"][:1000])
+
+    status = download(odir, url, [8, 10], workers=2, manifest=manifest)
+    assert set(status.values()) == {"downloaded"}
+    assert "bytes=1000-" in requests
+    for k, v in data.items():
+        assert (odir / k).read_bytes() == v
+    assert not list(odir.glob("*.part"))
+
+    assert set(download(odir, url, [8, 10], manifest=manifest).values()) == {"exists"}
+
+    # truncated final files, e.g. from an older version, are resumed
+    for manifest_arg in (manifest, None):
+        (odir / "index-4210.fits").write_bytes(data["index-4210.fits"][:500])
+        requests.clear()
+        status = download(odir, url, [8, 10], manifest=manifest_arg)
+        assert status["index-4210.fits"] == "downloaded"
+        assert status["index-4208.fits"] == "exists"
+        assert requests == ["bytes=500-"]
+        assert (odir / "index-4210.fits").read_bytes() == data["index-4210.fits"]
+
+    manifest.write_text(f"{'0' * 64}  index-4208.fits")
+    (odir / "index-4208.fits").unlink()
+    status = download(odir, url, [8, 8], manifest=manifest)
+    assert "SHA256 mismatch" in status["index-4208.fits"]
+    assert not (odir / "index-4208.fits").exists()
+
+
+def test_index_selection(fits_file, tmp_path):
+    from astrometry_azel.index import field_of_view, index_files, index_range, write_config
+
+    # 10 degrees = 600 arcmin: quads of 60 to 600 arcmin
+    assert index_range(10) == (10, 16)
+    assert index_range((5, 30)) == (8, 19)
+    assert index_range(0.01) == (0, 0)
+
+    fov = field_of_view(fits_file.with_suffix(".wcs"))
+    assert len(fov) == 2
+    lo, hi = index_range(fov)
+    assert lo <= hi
+
+    for name in ("index-4107.fits", "index-4205-00.fits", "index-4205-11.fits", "index-4213.fits"):
+        (tmp_path / name).touch()
+    files = index_files(tmp_path, (5, 7))
+    assert [f.name for f in files] == [
+        "index-4205-00.fits",
+        "index-4205-11.fits",
+        "index-4107.fits",
+    ]
+
+    cfg = write_config(files, tmp_path / "solve.cfg").read_text().splitlines()
+    assert f"index {tmp_path.resolve() / 'index-4107.fits'}" in cfg
+    assert "inparallel" in cfg
+
+    # system settings are kept, its index files are not
+    base = tmp_path / "astrometry.cfg"
+    base.write_text("inparallel\ncpulimit 300\nadd_path /data\nautoindex\nindex index-4219\n")
+    cfg = write_config(files, tmp_path / "solve.cfg", base).read_text().splitlines()
+    assert {"inparallel", "cpulimit 300", "add_path /data"} <= set(cfg)
+    assert "autoindex" not in cfg and "index index-4219" not in cfg
+    assert sum(line.startswith("index ") for line in cfg) == 3
+
+
+def test_star_list(fits_file, tmp_path):
+    pytest.importorskip("scipy")
+    from astropy.io import fits
+    from astrometry_azel import condition
+
+    rng = np.random.default_rng(0)
+    H, W = 400, 600
+    img = rng.normal(100, 2, (H, W))
+    stars = np.array([[50.2, 80.7], [123.4, 310.1], [300.6, 450.3], [200.0, 200.0]])
+    y, x = np.mgrid[:H, :W]
+    for k, (ys, xs) in enumerate(stars):
+        img += (1000 - 100 * k) * np.exp(-((y - ys) ** 2 + (x - xs) ** 2) / (2 * 1.5**2))
+    img[:, 560:] = 5000  # obstruction
+    mask = np.ones((H, W))
+    mask[:, 550:] = 0
+
+    xyfn = condition.star_list(
+        img, tmp_path / "a.xyls", bin_factor=2, crop=(20, 380, 40, 600), mask=mask
+    )
+
+    with fits.open(xyfn) as f:
+        t = f[1].data
+        assert f[1].header["IMAGEW"] == 280
+        assert f[1].header["IMAGEH"] == 180
+        # binned 1-based to full 0-based pixels
+        xf = 2 * t["X"] - 0.5 + 40 - 1
+        yf = 2 * t["Y"] - 0.5 + 20 - 1
+    assert t["FLUX"] == approx(np.sort(t["FLUX"])[::-1])
+    assert len(t) == 4
+    assert np.column_stack((yf, xf)) == approx(stars, abs=0.3)
+
+    assert "--width 280" in condition.xylist_args(xyfn)
+
+    # binned WCS of the test image, made with the inverse of the rescaling
+    b, x0, y0 = 2, 40, 20
+    hdr = fits.getheader(fits_file.with_suffix(".wcs"))
+    binned = hdr.copy()
+    binned["CRPIX1"] = (hdr["CRPIX1"] + (b - 1) / 2 - x0) / b
+    binned["CRPIX2"] = (hdr["CRPIX2"] + (b - 1) / 2 - y0) / b
+    for k in ("CD1_1", "CD1_2", "CD2_1", "CD2_2"):
+        binned[k] = hdr[k] * b
+    for k in hdr:
+        if k[:2] in {"A_", "B_", "AP", "BP"} and "ORDER" not in k:
+            p, q = map(int, k.split("_")[1:])
+            binned[k] = hdr[k] * b ** (p + q - 1)
+    fits.PrimaryHDU(header=binned).writeto(tmp_path / "a.wcs")
+
+    full = condition.rescale_wcs(tmp_path / "a.wcs", xyfn, tmp_path / "full.wcs")
+
+    w0 = ael.read_wcs(fits_file.with_suffix(".wcs"))
+    w1 = ael.read_wcs(full)
+    wb = ael.read_wcs(tmp_path / "a.wcs")
+    px = np.array([[0, 0], [100.0, 50.0], [599, 399], [300, 200]])
+    assert w1.all_pix2world(px, 0) == approx(w0.all_pix2world(px, 0))
+    assert wb.all_pix2world((px - [x0, y0] - (b - 1) / 2) / b, 0) == approx(w1.all_pix2world(px, 0))
+    assert fits.getheader(full)["IMAGEW"] == W
+
+
+def test_refine_wcs(fits_file, tmp_path):
+    pytest.importorskip("scipy")
+    from astropy.io import fits
+    from astrometry_azel.refine import fit_wcs, refine_wcs
+
+    w0 = ael.read_wcs(fits_file.with_suffix(".wcs"))
+    H, W = 507, 719
+
+    rng = np.random.default_rng(1)
+    ra, dec = w0.all_pix2world(rng.uniform(5, [W - 5, H - 5], (150, 2)), 0).T
+    fits.BinTableHDU.from_columns(
+        [
+            fits.Column(name="RA", format="D", array=ra),
+            fits.Column(name="DEC", format="D", array=dec),
+        ]
+    ).writeto(fits_file.with_suffix(".rdls"))
+
+    # camera drifted and rotated slightly since the previous solution
+    truth = w0.deepcopy()
+    truth.wcs.crval = truth.wcs.crval + [0.15, -0.1]
+    th = np.radians(0.3)
+    truth.wcs.cd = np.array([[np.cos(th), -np.sin(th)], [np.sin(th), np.cos(th)]]) @ truth.wcs.cd
+
+    y, x = np.mgrid[:H, :W]
+    img = rng.normal(100, 2, (H, W))
+    for xs, ys in zip(*truth.all_world2pix(ra, dec, 0)):
+        img += 500 * np.exp(-((x - xs) ** 2 + (y - ys) ** 2) / (2 * 1.2**2))
+    new = tmp_path / "new.fits"
+    fits.PrimaryHDU(img.astype(np.float32)).writeto(new)
+
+    out = refine_wcs(new, fits_file.with_suffix(".wcs"), search_radius=8, fallback=False)
+    assert out == new.with_suffix(".wcs")
+
+    px = np.array([[0, 0], [700, 500], [350, 250]])
+    # better than 0.1 pixel
+    assert ael.read_wcs(out).all_pix2world(px, 0) == approx(truth.all_pix2world(px, 0), abs=5e-3)
+
+    with pytest.raises(RuntimeError):
+        refine_wcs(new, fits_file.with_suffix(".wcs"), min_stars=1000, fallback=False)
+
+    # linear refit of an undistorted camera drops the previous SIP
+    linear = truth.deepcopy()
+    linear.sip = None
+    xl, yl = linear.all_world2pix(ra, dec, 0)
+    w1, rms = fit_wcs(w0, xl, yl, ra, dec, sip_order=1)
+    assert w1.sip is None
+    assert rms < 1e-3
+
+
+def test_benchmark(tmp_path):
+    pytest.importorskip("netCDF4")
+    from astrometry_azel import benchmark
+    from astrometry_azel.index import field_of_view
+
+    wcsfn = benchmark.synthetic_wcs(256, tmp_path / "a.wcs")
+    with ir.as_file(ir.files(f"{__package__}") / "apod4.wcs") as fn:
+        assert field_of_view(wcsfn)[1] == approx(field_of_view(fn)[1], rel=1e-3)
+
+    res = benchmark.run(
+        [128],
+        select=["fits2radec", "collapsestack[mean]", "write_netcdf"],
+        outfn=tmp_path / "b.json",
+    )
+    names = {b["name"] for b in res["benchmarks"]}
+    assert names == {"fits2radec", "fits2radec[workers]", "collapsestack[mean]", "write_netcdf"}
+    assert all(b["seconds"] > 0 and b["peak_rss_bytes"] >= 0 for b in res["benchmarks"])
+
+    rows = benchmark.compare(tmp_path / "b.json", res)
+    assert len(rows) == 4
+    assert all(r["time_ratio"] == approx(1) and not r["regression"] for r in rows)
+
+
+def test_hinted_solve_timeout(fits_file, tmp_path, monkeypatch):
+    calls = []
+    timeouts = []
+    clock = [100.0]
+
+    def run_solve(cmd, timeout=None):
+        calls.append(cmd)
+        timeouts.append(timeout)
+        if len(calls) == 1:
+            clock[0] += 0.75
+            raise TimeoutError("hinted solve timed out")
+
+    monkeypatch.setattr(ael, "get_solve_exe", lambda: "solve-field")
+    monkeypatch.setattr(ael.subprocess, "check_output", lambda *a, **k: "0.97")
+    monkeypatch.setattr(ael, "run_solve", run_solve)
+    monkeypatch.setattr(ael, "monotonic", lambda: clock[0])
+
+    ael.doSolve(fits_file, index_dir=tmp_path, prior=fits_file.with_suffix(".wcs"), timeout=1)
+
+    # timed out hinted solve, then blind solve in the remaining time
+    assert len(calls) == 2
+    assert "--ra" in calls[0] and "--ra" not in calls[1]
+    assert timeouts == approx([1, 0.25])
+
+    # hinted solve used all the time: no blind solve
+    def slow_solve(cmd, timeout=None):
+        calls.append(cmd)
+        clock[0] += timeout
+        raise TimeoutError("hinted solve timed out")
+
+    calls.clear()
+    monkeypatch.setattr(ael, "run_solve", slow_solve)
+    with pytest.raises(TimeoutError):
+        ael.doSolve(fits_file, index_dir=tmp_path, prior=fits_file.with_suffix(".wcs"), timeout=1)
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("method", ["rotation", "interp"])
+def test_radec2azel_lazy_fast(fits_file, method):
+    pytest.importorskip("dask")
+    pytest.importorskip("scipy")
+
+    eager = ael.fits2azel(fits_file, latlon=(0, 0), time="2000-01-01T00:00", method=method)
+    lazy = ael.fits2azel(
+        fits_file, latlon=(0, 0), time="2000-01-01T00:00", method=method, chunks=64
+    )
+
+    # one whole-frame fit, so chunked and eager results agree
+    for k in ("azimuth", "elevation"):
+        assert lazy[k].values == approx(eager[k].values, abs=1e-9)